@@ -1,71 +1,319 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import (
+    Flask, Blueprint, Response, current_app, g, request, jsonify, render_template, redirect, url_for, stream_with_context
+)
 from flask_cors import CORS
-from pymongo import MongoClient
+from werkzeug.middleware.proxy_fix import ProxyFix
 from bson.objectid import ObjectId
-from datetime import datetime
 # 引入 itsdangerous 的特定模組
-from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadTimeSignature
-from werkzeug.security import generate_password_hash, check_password_hash
-import smtplib
-from email.mime.text import MIMEText
+from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadTimeSignature, BadSignature
 import os
-import uuid
-from urllib.parse import urlparse
-
-app = Flask(__name__, static_folder="static", template_folder="templates")
-CORS(app)
-
-# MongoDB
-MONGO_URI = os.environ.get("MONGO_URI")
-client = MongoClient(MONGO_URI)
-try:
-    client.admin.command("ping")
-    print("✅ MongoDB Atlas 連線成功")
-except Exception as e:
-    print("❌ MongoDB 連線失敗", e)
-
-db = client["datasys114"]
-users = db["users"]
-forms = db["forms"]
-
-
-# secret key（若已在 app.config['SECRET_KEY']，使用現有的）
-app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY", "your_production_secret_here")
-# 🚨 新增：用於密碼重設的額外安全鹽值
-app.config['SECURITY_PASSWORD_SALT'] = os.environ.get("SECURITY_PASSWORD_SALT", "a_unique_salt_for_password_reset")
-
-# 用來產生與驗證 token (使用 SECRET_KEY 和 額外的 SALT)
-serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt=app.config['SECURITY_PASSWORD_SALT'])
-
-# SMTP 設定（可用環境變數或直接填入）
-SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")      # e.g. "smtp.gmail.com"
-SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
-SMTP_USER = os.environ.get("SMTP_USER")
-SMTP_PASS = os.environ.get("SMTP_PASS")
-FROM_EMAIL = os.environ.get("FROM_EMAIL", SMTP_USER)
-
-# ---------------- 郵件發送函式 ----------------
+import hmac
+import hashlib
+import logging
+import json
+import sqlite3
+import click
+import time
+from datetime import datetime
+from itertools import chain, islice
+from functools import wraps
+from urllib.parse import quote
+from pymongo.errors import OperationFailure
+import config
+from storage import (
+    create_storage, ASCENDING, DESCENDING, ROW_SORT_KEYS, ROW_FIELDS, EMPTY_FORM_STATS, BATCH_PATCH_FIELDS,
+    REPORT_GROUPS, SUMMARY_COUNTERS, SEARCH_QUERY_MAX, BUYER_SUGGEST_DEFAULT, BUYER_SUGGEST_MAX, ARCHIVE_BATCH_ROWS,
+    DuplicateEmailError, RowQueryError, form_stats_delta, normalize_search, archive_cutoff_id, find_rows_page
+)
+from order_io import (
+    parse_row_amounts, detect_import_format, iter_import_records,
+    build_import_row, ImportRowError,
+    EXPORT_FORMATS, export_columns, iter_csv_export, iter_xlsx_export
+)
+from mail_queue import MailQueue
+from events import create_event_backend, StreamLimiter, row_events, event_visible, event_payload
+from responses import json_response, columnar_rows, init_compression
+from form_cache import create_form_cache
+from passwords import PasswordHasher, HashPoolBusy, LoginThrottle
+from observability import (
+    configure_logging, log_sampled, MongoCommandCounter, RequestMetrics, init_request_metrics
+)
+
+# 路由都註冊在 blueprint 上，由 create_app() 建立 Flask app（見檔案最後）。
+# import 本模組不會連線資料庫：store 在第一次存取時才建立連線（依 pid，fork 後重新連線），
+# 資料庫是否可用由 /healthz 回報，gunicorn --preload 時 master import 一次，worker 直接 fork。
+bp = Blueprint("orders", __name__, cli_group=None)
+
+# Logging 與 /metrics 統計
+logger = logging.getLogger("order_app")
+mongo_counter = MongoCommandCounter()
+request_metrics = RequestMetrics()
+
+# 資料庫：STORAGE_BACKEND=mongo（預設）或 sqlite，設定見 config.py。
+# 所有讀寫都經過 store.users / store.forms / store.viewers / store.rows / store.archive / store.buyers 等 repository
+store = create_storage(config, event_listeners=[mongo_counter])
+
+
+def resolve_row_id(form_id, data):
+    """優先使用前端傳來的 row_id；舊版前端只傳 index 時再轉換成 _id。"""
+    row_id = data.get("row_id")
+    if row_id:
+        return str(row_id)
+    try:
+        index = int(data.get("index"))
+    except (TypeError, ValueError):
+        return None
+    return store.rows.id_at_index(form_id, index)
+
+
+def parse_row_version(data):
+    """前端讀取訂單時拿到的 version；未帶時不做衝突檢查。"""
+    raw = data.get("version")
+    if raw is None or raw == "":
+        return None
+    return int(raw)
+
+
+def row_conflict_response(form_id, row_id):
+    """寫入條件不成立時：訂單不存在回 404，版本不符回 409 並附上目前內容。"""
+    current = store.rows.get(form_id, row_id)
+    if not current:
+        return jsonify({"success": False, "message": "找不到訂單"}), 404
+    return jsonify({
+        "success": False,
+        "conflict": True,
+        "message": "此訂單已被其他人修改，請重新整理後再試",
+        "row": current
+    }), 409
+
+
+# ---------------- 訂單查詢：篩選 / 排序 / 分頁 ----------------
+ROW_PAGE_MAX = 500
+_TRUE_VALUES = {"1", "true", "yes", "shipped"}
+_FALSE_VALUES = {"0", "false", "no", "unshipped"}
+
+
+def _parse_bool_arg(args, key):
+    raw = args.get(key)
+    if raw is None or raw == "":
+        return None
+    raw = raw.strip().lower()
+    if raw in _TRUE_VALUES:
+        return True
+    if raw in _FALSE_VALUES:
+        return False
+    raise RowQueryError(f"{key} 參數不合法")
+
+
+def parse_row_filters(args):
+    """將 query string 轉成篩選條件，由資料庫執行（remittance、shipped、buyer_email、item_name）。"""
+    return {
+        "remittance": _parse_bool_arg(args, "remittance"),
+        "shipped": _parse_bool_arg(args, "shipped"),
+        "buyer_email": args.get("buyer_email") or None,
+        "item_name": args.get("item_name") or None,
+    }
+
+
+def parse_row_sort(args):
+    """sort=item_total 為遞增，sort=-item_total 為遞減；預設依建立順序 (_id)。"""
+    raw = args.get("sort") or "_id"
+    direction = ASCENDING
+    if raw.startswith("-"):
+        direction = DESCENDING
+        raw = raw[1:]
+    if raw not in ROW_SORT_KEYS:
+        raise RowQueryError("sort 參數不合法")
+    return raw, direction
+
+
+def parse_row_limit(args):
+    """未帶 limit 時回傳 None（一次回傳全部，相容舊版前端）。"""
+    raw = args.get("limit")
+    if raw is None or raw == "":
+        return None
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise RowQueryError("limit 參數不合法")
+    if limit <= 0:
+        raise RowQueryError("limit 參數不合法")
+    return min(limit, ROW_PAGE_MAX)
+
+
+ROWS_FORMATS = ("objects", "columns")
+
+
+def parse_row_fields(args):
+    """fields=buyer_name,item_total,...：只回傳這些訂單欄位（_id 與 version 一定會回傳）。"""
+    raw = args.get("fields")
+    if not raw:
+        return None
+    fields = [k.strip() for k in raw.split(",") if k.strip()]
+    unknown = [k for k in fields if k not in ROW_FIELDS and k not in ("_id", "version")]
+    if unknown:
+        raise RowQueryError(f"fields 參數不合法：{', '.join(unknown)}")
+    return [k for k in fields if k in ROW_FIELDS]
+
+
+def parse_rows_format(args):
+    """rows_format=columns：訂單以 {"columns": [...], "values": [[...]]} 回傳，欄位名稱只出現一次。"""
+    rows_format = args.get("rows_format") or "objects"
+    if rows_format not in ROWS_FORMATS:
+        raise RowQueryError(f"rows_format 必須是 {' / '.join(ROWS_FORMATS)}")
+    return rows_format
+
+
+SEARCH_PAGE_DEFAULT = 50
+
+
+def parse_search_text(args):
+    """q=搜尋字串（不分大小寫）；去除前後空白後不可為空，長度上限 SEARCH_QUERY_MAX。"""
+    text = normalize_search(args.get("q"))
+    if not text:
+        raise RowQueryError("請輸入搜尋文字")
+    if len(text) > SEARCH_QUERY_MAX:
+        raise RowQueryError(f"搜尋文字最多 {SEARCH_QUERY_MAX} 個字")
+    return text
+
+
+def parse_suggest_limit(args):
+    """自動完成的筆數：預設 BUYER_SUGGEST_DEFAULT，上限 BUYER_SUGGEST_MAX。"""
+    raw = args.get("limit")
+    if raw is None or raw == "":
+        return BUYER_SUGGEST_DEFAULT
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise RowQueryError("limit 參數不合法")
+    if limit <= 0:
+        raise RowQueryError("limit 參數不合法")
+    return min(limit, BUYER_SUGGEST_MAX)
+
+
+# ---------------- ETag / 條件式 GET ----------------
+def make_etag(*parts):
+    """由版本號等資訊產生 ETag 值（以 weak ETag 送出，回應內容可能經過壓縮）。
+
+    以 SECRET_KEY 做 HMAC：304 在權限判斷之前就回傳，沒有權限的人無法自行算出 ETag 來
+    試探表單是否存在或目前的版本號；檢視者被移除時版本號會遞增，舊的 ETag 也不再相符。
+    """
+    key = current_app.config["SECRET_KEY"].encode("utf-8")
+    return hmac.new(key, "|".join(str(p) for p in parts).encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def request_args_key():
+    """分頁 / 篩選參數也會影響回應內容；token 只用於驗證，不列入。"""
+    return "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)) if k != "token")
+
+
+def with_etag(resp, etag):
+    resp.set_etag(etag, weak=True)
+    # 私人資料：瀏覽器可快取，但每次都要以 If-None-Match 重新驗證
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def not_modified(etag):
+    """If-None-Match 相符時回傳 304 回應，否則回傳 None。"""
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(Response(status=304), etag)
+    return None
+
+
+def summary_totals_by_name(summaries):
+    """相容舊版前端的 summary_by_buyer 格式：{買家名稱: 總金額}。"""
+    summary = {}
+    for s in summaries:
+        name = s.get("buyer_name") or ""
+        summary[name] = summary.get(name, 0) + float(s.get("total") or 0)
+    return summary
+
+
+def reset_serializer():
+    """密碼重設 token（SECRET_KEY 加上 SECURITY_PASSWORD_SALT），由 create_app() 建立。"""
+    return current_app.extensions["reset_serializer"]
+
+
+def session_serializer():
+    """登入 session token：帶有 user id 與 email 的簽章，驗證時不需查詢資料庫。"""
+    return current_app.extensions["session_serializer"]
+
+
+def issue_session_token(user):
+    return session_serializer().dumps({"uid": str(user["_id"]), "email": user["email"]})
+
+
+def _request_session_token(allow_query_token=False):
+    """讀取 Authorization: Bearer；allow_query_token 時（GET 下載 / 事件串流無法帶 header）才接受 ?token=。"""
+    auth = request.headers.get("Authorization", "")
+    if auth.startswith("Bearer "):
+        return auth[len("Bearer "):].strip()
+    if allow_query_token and request.method == "GET":
+        return request.args.get("token")
+    return None
+
+
+def login_required(view=None, *, allow_query_token=False):
+    """驗證 session token，並將登入者放在 g.user_id / g.user_email。
+
+    URL 中的 user_id 必須與 token 相同，避免冒用他人身分。
+    URL 中的 token 會留在存取記錄、瀏覽器歷史與 Referer，只有以 @login_required(allow_query_token=True)
+    標記的路由（匯出下載、SSE）才接受 ?token=。
+    """
+    if view is None:
+        return lambda v: login_required(v, allow_query_token=allow_query_token)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = _request_session_token(allow_query_token)
+        if not token:
+            return jsonify({"success": False, "message": "請先登入"}), 401
+        try:
+            data = session_serializer().loads(token, max_age=current_app.config['SESSION_TOKEN_MAX_AGE'])
+        except SignatureExpired:
+            return jsonify({"success": False, "message": "登入已過期，請重新登入"}), 401
+        except BadSignature:
+            return jsonify({"success": False, "message": "登入憑證無效，請重新登入"}), 401
+
+        g.user_id = data["uid"]
+        g.user_email = data["email"]
+        if "user_id" in kwargs and kwargs["user_id"] != g.user_id:
+            return jsonify({"success": False, "message": "沒有權限"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+# ---------------- 郵件佇列 ----------------
+# SMTP 設定由環境變數讀取（SMTP_HOST、SMTP_PORT、SMTP_USER、SMTP_PASS、FROM_EMAIL）；
+# 請求只把郵件寫入 mail_jobs，背景 worker 以重複使用的 SMTP 連線寄出並自動重試
+mail_queue = MailQueue(store.mail_jobs)
+
+
+@bp.before_app_request
+def _ensure_mail_worker():
+    # gunicorn fork 出的每個 worker 都需要自己的背景 thread，也讓重啟前未寄出的工作繼續寄送
+    mail_queue.ensure_worker()
+
+
 def send_reset_email(email, token):
-    """使用 smtplib 發送密碼重設郵件，包含一個帶有時間限制的連結。"""
+    """把密碼重設郵件（包含一個帶有時間限制的連結）放入寄信佇列，立即回傳。"""
     
     # 使用 url_for 根據路由名稱生成完整連結
     # _external=True 會根據 request 建立完整的 URL，但這裡我們強制使用 localhost:5000
-    reset_url = url_for('reset_password_page', token=token, _external=True)
+    reset_url = url_for('orders.reset_password_page', token=token, _external=True)
     
     # 如果部署在伺服器上，建議確保 reset_url 使用您的實際域名
     if "127.0.0.1:5000" in reset_url or "localhost:5000" in reset_url:
         reset_url = f"http://127.0.0.1:5000/reset_password/{token}"
     
-    print("========== 密碼重設連結 ==========")
-    print(f"寄給: {email}")
-    print(f"重設連結: {reset_url}")
-    print("=================================")
+    # 連結內含重設 token，只在 DEBUG 等級輸出（token 欄位會被遮蔽）
+    logger.debug("密碼重設連結", extra={"fields": {"to": email, "reset_token": token}})
 
-    if not all([SMTP_HOST, SMTP_USER, SMTP_PASS]):
-        print("⚠️ 警告：SMTP 環境變數未設定，重設郵件無法發送。請檢查 .env 或環境設定。")
+    if not mail_queue.settings.configured:
+        logger.warning("SMTP 環境變數未設定，重設郵件無法發送。請檢查 .env 或環境設定。")
         return False
 
-    msg = MIMEText(f"""
+    body = f"""
         您好，
         
         我們收到了您要求重設密碼的請求。請點擊以下連結重設您的密碼：
@@ -76,52 +324,111 @@ def send_reset_email(email, token):
         如果不是您本人操作，請忽略此郵件。
         
         謝謝。
-    """, 'plain', 'utf-8')
-    msg['Subject'] = '【重要】密碼重設請求 - 訂單管理系統'
-    msg['From'] = FROM_EMAIL
-    msg['To'] = email
+    """
+    # 同一個 email 只保留一封待寄的重設信（內容更新為最新的連結）
+    mail_queue.enqueue(email, '【重要】密碼重設請求 - 訂單管理系統', body, dedupe_key=f"reset:{email}")
+    return True
+
+# ---------------- Metrics ----------------
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus 格式的每個路由延遲、回應大小與 MongoDB round trip 次數。"""
+    expected = current_app.config.get('METRICS_TOKEN')
+    if expected:
+        header = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(header, f"Bearer {expected}"):
+            return jsonify({"success": False, "message": "未授權"}), 401
+    return Response(
+        request_metrics.render() + form_cache.render_metrics() + event_streams.render_metrics(),
+        mimetype="text/plain; version=0.0.4"
+    )
+
+
+class IndexCheck:
+    """worker 啟動後第一次 /healthz 時確認索引已由 create-indexes 建立（不在請求處理中建立索引）。
+
+    缺少 unique 索引時以 error 記錄並讓 /healthz 回 503，之後每次 /healthz 重新確認；
+    只缺少一般索引時記錄 warning（查詢會變慢但結果正確）。全部都在之後就不再檢查。
+    """
 
+    def __init__(self):
+        self.ready = False
+
+    def missing(self):
+        """回傳缺少的 unique 索引名稱；檢查本身失敗時只記錄 warning，不影響 /healthz。"""
+        if self.ready:
+            return []
+        try:
+            missing = store.missing_indexes()
+        except Exception as e:
+            logger.warning("索引檢查失敗", extra={"fields": {"backend": store.name, "error": str(e)}})
+            return []
+        unique = [name for name, is_unique in missing if is_unique]
+        if unique:
+            logger.error("缺少 unique 索引，請執行 flask --app app create-indexes（已有重複資料時加上 --dedupe）",
+                         extra={"fields": {"missing": unique}})
+        elif missing:
+            logger.warning("缺少索引，請執行 flask --app app create-indexes",
+                           extra={"fields": {"missing": [name for name, _ in missing]}})
+        self.ready = not unique
+        return unique
+
+
+index_check = IndexCheck()
+
+
+@bp.route("/healthz", methods=["GET"])
+def healthz():
+    """readiness 檢查：資料庫可以連線時回 200，否則回 503（負載平衡器暫時不把流量送到這個 worker）。
+
+    最多等待 HEALTHZ_TIMEOUT_SECONDS；process 是否存活不需要資料庫，可直接檢查 TCP 連線。
+    """
     try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()  # 使用 TLS 加密
-            server.login(SMTP_USER, SMTP_PASS)
-            server.sendmail(FROM_EMAIL, email, msg.as_string())
-        print("✅ 重設郵件發送成功")
-        return True
+        store.ping(timeout=current_app.config['HEALTHZ_TIMEOUT_SECONDS'])
     except Exception as e:
-        print(f"❌ 郵件發送失敗: {e}")
-        return False
+        logger.warning("資料庫連線失敗", extra={"fields": {"backend": store.name, "error": str(e)}})
+        return jsonify({"success": False, "backend": store.name, "message": "資料庫無法連線"}), 503
+    missing = index_check.missing()
+    if missing:
+        return jsonify({"success": False, "backend": store.name, "message": "缺少 unique 索引，請執行 create-indexes",
+                        "missing_indexes": missing}), 503
+    return jsonify({"success": True, "backend": store.name})
+
 
 # ---------------- Pages ----------------
-@app.route("/")
+@bp.route("/")
 def home():
     return redirect("/login")
 
-@app.route("/login", methods=["GET"])
+@bp.route("/login", methods=["GET"])
 def login_page():
     return render_template("login.html")
 
-@app.route("/register", methods=["GET"])
+@bp.route("/register", methods=["GET"])
 def register_page():
     return render_template("register.html")
 
-@app.route("/dashboard", methods=["GET"])
+@bp.route("/dashboard", methods=["GET"])
 def dashboard_page():
     return render_template("dashboard.html")
 
-@app.route("/create_form", methods=["GET"])
+@bp.route("/create_form", methods=["GET"])
 def create_form_page():
     return render_template("create_form.html")
 
-@app.route("/form", methods=["GET"])
+@bp.route("/form", methods=["GET"])
 def form_page():
-    return render_template("form.html")
+    return render_template("form.html", live_updates=current_app.config["LIVE_UPDATES"])
+
+@bp.route("/reports", methods=["GET"])
+def reports_page():
+    return render_template("reports.html")
 
-@app.route("/forgot-password", methods=["GET"])
+@bp.route("/forgot-password", methods=["GET"])
 def forgot_password_page():
     return render_template("forgot_password.html")
 
-@app.route("/reset-password/<token>")
+@bp.route("/reset-password/<token>")
 def reset_password_page(token):
     """
     接收重設連結的 token，並在前端渲染重設密碼表單。
@@ -129,10 +436,10 @@ def reset_password_page(token):
     """
     try:
         # 驗證 token 是否有效及是否過期 (1 小時 = 3600 秒)
-        email = serializer.loads(token, max_age=3600)
+        email = reset_serializer().loads(token, max_age=3600)
         
         # 再次檢查資料庫，確保使用者存在
-        if users.find_one({"email": email}):
+        if store.users.exists(email):
              return render_template("reset_password.html", token=token)
         else:
              return "無效的重設連結：使用者不存在。", 404
@@ -142,102 +449,108 @@ def reset_password_page(token):
     except BadTimeSignature:
         return "無效的密碼重設連結或格式錯誤。", 400
     except Exception as e:
-        print(f"重設頁面載入錯誤: {e}")
+        logger.warning("重設頁面載入錯誤", extra={"fields": {"error": str(e)}})
         return "無效的密碼重設連結。", 400
 
 
 # ---------------- Auth ----------------
-@app.route("/api/register", methods=["POST"])
+# 密碼雜湊在有上限的 thread pool 執行；佇列滿時回 503，不會拖住其他請求
+password_hasher = PasswordHasher()
+login_throttle = LoginThrottle()
+
+
+def hash_busy_response():
+    resp = jsonify({"success": False, "message": "系統忙碌中，請稍後再試"})
+    resp.headers["Retry-After"] = "1"
+    return resp, 503
+
+
+@bp.route("/api/register", methods=["POST"])
 def register():
     try:
         data = request.json
-        print("收到註冊資料:", data)
 
         username = data.get("username")
         email = data.get("email")
         password = data.get("password")
 
-        print("解析後:", username, email)
-
         if not username or not email or not password:
             return jsonify({"error": "缺少欄位"}), 400
         
-        # ⚠️ 修正重點：使用 generate_password_hash 雜湊密碼
-        hashed_password = generate_password_hash(password)
-
-        # 檢查 Email 是否已存在（建議新增，防止重複註冊）
-        if users.find_one({"email": email}):
-            return jsonify({"error": "該電子郵件已被註冊"}), 409 # Conflict
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HashPoolBusy:
+            return hash_busy_response()
 
-        result = users.insert_one({
-            "username": username,
-            "email": email,
+        # Email 重複由資料庫的 unique 索引擋下，不會有同時註冊的競態問題
+        try:
             # ✅ 存入雜湊後的密碼
-            "password": hashed_password 
-        })
+            user_id = store.users.create(username, email, hashed_password)
+        except DuplicateEmailError:
+            return jsonify({"error": "該電子郵件已被註冊"}), 409 # Conflict
 
-        print("insert result:", result.inserted_id)
+        logger.info("註冊成功", extra={"fields": {"user_id": user_id, "email": email}})
 
         return jsonify({"success": True, "message": "註冊成功"})
 
     except Exception as e:
-        print("註冊錯誤:", str(e))
+        logger.exception("註冊錯誤")
         return jsonify({"error": "伺服器錯誤"}), 500
         
-@app.route("/api/login", methods=["POST"])
+@bp.route("/api/login", methods=["POST"])
 def api_login():
     data = request.get_json()
     email = data.get("email")
     password = data.get("password")
-    
-    print("\n--- 收到登入請求 ---")
-    print(f"1. 接收到的 Email: {email}")
-    print(f"2. 接收到的 密碼 (明文): {password}")
-    
-    # 步驟 1: 查找用戶
-    user = users.find_one({"email": email})
-    
-    # 步驟 2: 檢查用戶是否存在
+    # 在反向代理之後時由 ProxyFix（TRUSTED_PROXY_COUNT）換成用戶端 IP
+    ip = request.remote_addr
+
+    # 同一個 email 或 IP 短時間內失敗太多次：在雜湊前就拒絕，不消耗 CPU
+    retry_after = login_throttle.retry_after(email, ip)
+    if retry_after:
+        logger.warning("登入失敗次數過多", extra={"fields": {"email": email, "ip": ip}})
+        resp = jsonify({"success": False, "message": "登入失敗次數過多，請稍後再試"})
+        resp.headers["Retry-After"] = str(retry_after)
+        return resp, 429
+
+    user = store.users.get_by_email(email)
     if not user:
-        print("3. 檢查結果: 用戶不存在 (Email 錯誤或未註冊)")
+        login_throttle.record_failure(email, ip)
+        logger.info("登入失敗：用戶不存在", extra={"fields": {"email": email}})
         return jsonify({"success": False, "message": "帳號或密碼錯誤"}), 401
-    
-    print("3. 檢查結果: 成功找到用戶")
-    
-    # 步驟 3: 提取資料庫中的雜湊密碼
-    hashed_password_in_db = user.get("password")
-    
-    print(f"4. 資料庫中儲存的雜湊值: {hashed_password_in_db}")
 
-    # 步驟 4: 驗證密碼
+    hashed_password = user.get("password")
     try:
-        password_verified = check_password_hash(hashed_password_in_db, password)
-    except ValueError as e:
-        print(f"5. 密碼比對錯誤: ValueError - 可能是資料庫中的密碼格式錯誤。錯誤訊息: {e}")
-        password_verified = False
-    except Exception as e:
-        print(f"5. 密碼比對發生其他錯誤: {e}")
-        password_verified = False
-
+        password_verified = password_hasher.verify(hashed_password, password)
+    except HashPoolBusy:
+        return hash_busy_response()
 
     if not password_verified:
-        print("6. 最終驗證結果: 密碼比對失敗")
+        login_throttle.record_failure(email, ip)
+        logger.info("登入失敗：密碼比對失敗", extra={"fields": {"email": email}})
         return jsonify({"success": False, "message": "帳號或密碼錯誤"}), 401
-    
-    # 步驟 5: 登入成功
-    print("6. 最終驗證結果: 登入成功！")
-    print("----------------------\n")
-    
+
+    login_throttle.reset(email)
+    # 舊雜湊的方法 / 成本與目前設定不同時，趁登入成功以新參數重新雜湊
+    if password_hasher.needs_rehash(hashed_password):
+        try:
+            store.users.set_password(user["_id"], password_hasher.hash(password), expected=hashed_password)
+        except HashPoolBusy:
+            pass
+
+    logger.info("登入成功", extra={"fields": {"user_id": user["_id"]}})
+
     return jsonify({
         "success": True, 
-        "user_id": str(user["_id"]), 
+        "user_id": user["_id"], 
         "username": user.get("username",""), 
-        "email": user["email"]
+        "email": user["email"],
+        "token": issue_session_token(user)
     })
 
 # ---------------- 忘記/重設密碼 API ----------------
 
-@app.route("/api/forgot-password", methods=["POST"])
+@bp.route("/api/forgot-password", methods=["POST"])
 def forgot_password_api():
     """處理前端提交的 Email，生成 **帶時間限制** 的 Token 並發送重設郵件。"""
     data = request.get_json()
@@ -246,32 +559,32 @@ def forgot_password_api():
     if not email:
         return jsonify({"success": False, "message": "請提供電子郵件。"})
 
-    user = users.find_one({"email": email})
+    user = store.users.get_by_email(email)
     
     # 安全策略：不論使用者是否存在，都回傳成功訊息，防止被猜測 Email
     if not user:
-        print(f"找不到使用者: {email}，但仍回傳成功訊息。")
+        logger.info("忘記密碼：找不到使用者，仍回傳成功訊息", extra={"fields": {"email": email}})
         return jsonify({"success": True, "message": "如果該信箱存在，我們已發送重設密碼連結。"})
 
     # 1. 產生帶有 Email 資訊和時間限制的 Token
     try:
         # Token 包含 email，並只在後端進行驗證
-        token = serializer.dumps(email)
+        token = reset_serializer().dumps(email)
     except Exception as e:
-        print(f"Token 生成失敗: {e}")
+        logger.exception("重設 token 生成失敗")
         return jsonify({'success': False, 'message': '系統錯誤，請稍後再試。'}), 500
 
-    # 2. 發送郵件
+    # 2. 放入寄信佇列（由背景 worker 寄出，不佔用這個請求）
     email_sent = send_reset_email(email, token)
 
     if email_sent:
         return jsonify({"success": True, "message": "密碼重設連結已寄出。請檢查您的信箱 (包含垃圾郵件)。"})
     else:
-        # 郵件發送失敗，但前端仍應顯示成功，以避免洩露 SMTP 狀態
+        # SMTP 未設定，但前端仍應顯示成功，以避免洩露 SMTP 狀態
         return jsonify({"success": True, "message": "重設請求已受理。但郵件發送失敗，請稍後重試或聯繫管理員。"}), 202
 
 
-@app.route("/api/reset-password", methods=["POST"])
+@bp.route("/api/reset-password", methods=["POST"])
 def reset_password_api():
     """接收 Token 和新密碼，驗證 Token 有效性並更新密碼。"""
     data = request.get_json()
@@ -283,50 +596,73 @@ def reset_password_api():
 
     # 1. 驗證 Token 並提取 Email
     try:
-        email = serializer.loads(token, max_age=3600)  # 1 小時過期驗證
+        email = reset_serializer().loads(token, max_age=3600)  # 1 小時過期驗證
     except SignatureExpired:
         return jsonify({'success': False, 'message': '密碼重設連結已過期，請重新發送請求。'}), 400
     except (BadTimeSignature, Exception):
         return jsonify({'success': False, 'message': '無效的密碼重設連結。'}), 400
 
     # 2. 查找使用者
-    user = users.find_one({"email": email})
+    user = store.users.get_by_email(email)
     if not user:
         return jsonify({"success": False, "message": "使用者不存在。"})
 
     # 3. 雜湊新密碼
-    hashed_password = generate_password_hash(new_password)
+    try:
+        hashed_password = password_hasher.hash(new_password)
+    except HashPoolBusy:
+        return hash_busy_response()
     
     # 4. 更新密碼
     # 由於我們使用 itsdangerous 的時間驗證，不需要在資料庫中儲存 token
-    users.update_one(
-        {"_id": user["_id"]},
-        {
-            "$set": {"password": hashed_password}, # ✅ 存入雜湊後的密碼
-        }
-    )
+    store.users.set_password(user["_id"], hashed_password) # ✅ 存入雜湊後的密碼
 
     return jsonify({"success": True, "message": "密碼已成功更新，請重新登入"})
 
 
-@app.route("/api/update_username", methods=["POST"])
+@bp.route("/api/update_username", methods=["POST"])
+@login_required
 def api_update_username():
     data = request.get_json()
-    user_id = data.get("user_id")
     username = data.get("username","")
-    if not user_id:
-        return jsonify({"success": False, "message":"缺少 user_id"}),400
-    users.update_one({"_id": ObjectId(user_id)}, {"$set": {"username": username}})
-    user = users.find_one({"_id": ObjectId(user_id)})
-    return jsonify({"success": True, "username": user.get("username","")})
+    store.users.set_username(g.user_id, username)
+    return jsonify({"success": True, "username": username})
+
+
+# ---------------- 即時事件 (SSE) ----------------
+# FORM_CACHE_BACKEND=memory（每個 process 各自的 LRU）、redis（多個 worker 共用）或 none
+form_cache = create_form_cache()
+
+# EVENT_BACKEND=memory（單一 process）或 mongo（多個 worker 共用 capped collection）
+form_events = create_event_backend(store.database if store.name == "mongo" else None)
+# 每個 process 同時開啟的 SSE 串流上限，其餘 thread 留給一般請求（應小於 GUNICORN_THREADS）
+event_streams = StreamLimiter(int(os.environ.get("EVENT_MAX_STREAMS", 4)))
+
+
+def publish_form_events(form_id, events):
+    """發布表單事件；發布失敗只記錄 log，不影響已完成的寫入。"""
+    for event in events:
+        try:
+            form_events.publish(form_id, event)
+        except Exception:
+            logger.exception("表單事件發布失敗")
+
+
+def format_sse(payload, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(payload, ensure_ascii=False, default=str))
+    return "\n".join(lines) + "\n\n"
 
 
 # ---------------- Form management ----------------
-@app.route("/api/create_form", methods=["POST"])
+@bp.route("/api/create_form", methods=["POST"])
+@login_required
 def api_create_form():
     data = request.get_json()
-    owner_id = data.get("owner_id")
-    owner_email = data.get("owner_email")
+    owner_id = g.user_id
+    owner_email = g.user_email
     title = data.get("title")
     description = data.get("description", "")    # 表單簡介
 
@@ -341,306 +677,1076 @@ def api_create_form():
     fields["item_price"] = True
     fields["item_total"] = True
 
-    doc = {
-        "title": title,
-        "description": description,
-        "owner_id": owner_id,
-        "owner_email": owner_email,
-        "allowed_viewers": [],
-        "fields": fields,
-        "rows": [],
-        "recent_buyers": []
-    }
-
-    res = forms.insert_one(doc)
-    return jsonify({"success": True, "form_id": str(res.inserted_id)})
+    form_id = store.forms.create(title, description, owner_id, owner_email, fields)
+    return jsonify({"success": True, "form_id": form_id})
 
 
-@app.route("/api/update_form_description", methods=["POST"])
+@bp.route("/api/update_form_description", methods=["POST"])
+@login_required
 def api_update_form_description():
     data = request.get_json()
     form_id = data.get("form_id")
     desc = data.get("description", "")
 
-    forms.update_one(
-        {"_id": ObjectId(form_id)},
-        {"$set": {"description": desc}}
-    )
+    if not store.forms.touch(form_id, description=desc, owner_id=g.user_id):
+        return jsonify({"success": False, "message": "找不到表單或沒有權限修改"}), 403
 
     return jsonify({"success": True})
 
 
-@app.route("/api/my_forms/<user_id>", methods=["GET"])
+FORM_LIST_MAX = 200
+
+
+@bp.route("/api/my_forms/<user_id>", methods=["GET"])
+@login_required
 def api_my_forms(user_id):
-    user = users.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        return jsonify({"owned": [], "viewable": []})
-    email = user["email"]
-    owned = list(forms.find({"owner_id": user_id}))
-    viewable = list(forms.find({"allowed_viewers": email}))
-    def conv(f):
-        f["_id"] = str(f["_id"])
-        return f
-    owned = [conv(f) for f in owned]
-    viewable = [conv(f) for f in viewable]
-    return jsonify({"owned": owned, "viewable": viewable})
-
-@app.route("/api/form/<form_id>/<user_id>", methods=["GET"])
-def api_get_form(form_id, user_id):
-    f = forms.find_one({"_id": ObjectId(form_id)})
+    """Dashboard 表單列表：以單一查詢取得自己建立與可檢視的表單。
+
+    支援 limit / cursor 分頁（依 _id 排序），未帶 limit 時回傳全部。
+    """
+    email = g.user_email
+    cursor_token = request.args.get("cursor")
+    try:
+        limit = parse_row_limit(request.args)
+    except RowQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    if limit is not None:
+        limit = min(limit, FORM_LIST_MAX)
+
+    def find_forms(versions_only=False):
+        # 多讀一筆用來判斷是否還有下一頁
+        return store.forms.list_for_user(
+            user_id, email, after_id=cursor_token,
+            limit=None if limit is None else limit + 1, versions_only=versions_only
+        )
+
+    def list_etag(found):
+        return make_etag(user_id, request_args_key(), *(f"{f['_id']}:{f.get('version', 0)}" for f in found))
+
+    # 帶 If-None-Match 時先只讀 _id / version；列表沒有變動就直接回 304
+    try:
+        if request.if_none_match:
+            etag = list_etag(find_forms(versions_only=True))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+
+        found = find_forms()
+    except RowQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    etag = list_etag(found)
+    next_cursor = None
+    if limit is not None and len(found) > limit:
+        found = found[:limit]
+        next_cursor = found[-1]["_id"]
+
+    owned, viewable = [], []
+    for f in found:
+        item = {
+            "_id": f["_id"],
+            "title": f.get("title"),
+            "description": f.get("description", ""),
+            "owner_id": f.get("owner_id"),
+            "owner_email": f.get("owner_email"),
+            "updated_at": f["updated_at"].isoformat() if f.get("updated_at") else None,
+        }
+        if f.get("owner_id") == user_id:
+            item["stats"] = dict(EMPTY_FORM_STATS, **(f.get("stats") or {}))
+            owned.append(item)
+        else:
+            # 整張表單的計數屬於賣家資訊，不提供給買家
+            viewable.append(item)
+    return with_etag(json_response({"owned": owned, "viewable": viewable, "next_cursor": next_cursor}), etag)
+
+
+# ---------------- 賣家報表（跨表單） ----------------
+REPORT_FORM_IDS_MAX = 100
+
+
+def parse_report_day(args, key):
+    """YYYY-MM-DD 日期參數（依訂單建立日、UTC）；未帶時回傳 None。"""
+    raw = args.get(key)
+    if not raw:
+        return None
+    try:
+        return datetime.strptime(raw, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise RowQueryError(f"{key} 必須是 YYYY-MM-DD 格式")
+
+
+def report_entry(entry):
+    """補上報表的衍生欄位：未匯款金額（outstanding）與未出貨筆數 / 金額。"""
+    entry["outstanding"] = entry["unpaid_total"]
+    entry["unshipped_count"] = entry["row_count"] - entry["shipped_count"]
+    entry["unshipped_total"] = entry["total"] - entry["shipped_total"]
+    return entry
+
+
+@bp.route("/api/reports/<user_id>", methods=["GET"])
+@login_required
+def api_seller_report(user_id):
+    """賣家跨表單報表：營收、未匯款金額、未出貨筆數，依買家 / 物品 / 月份分組。
+
+    參數 group_by（buyer / item / month，預設 buyer）、from / to（訂單建立日，YYYY-MM-DD，含當日）、
+    form_ids（以逗號分隔，只統計其中自己擁有的表單）。資料來自每日彙總，不會掃描每一筆訂單。
+    """
+    group_by = request.args.get("group_by", "buyer")
+    if group_by not in REPORT_GROUPS:
+        return jsonify({"success": False, "message": f"group_by 必須是 {' / '.join(REPORT_GROUPS)}"}), 400
+    form_ids = None
+    if request.args.get("form_ids"):
+        form_ids = [i for i in request.args["form_ids"].split(",") if i]
+        if len(form_ids) > REPORT_FORM_IDS_MAX:
+            return jsonify({"success": False, "message": f"form_ids 最多 {REPORT_FORM_IDS_MAX} 個"}), 400
+    try:
+        start_day = parse_report_day(request.args, "from")
+        end_day = parse_report_day(request.args, "to")
+    except RowQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    # 每次訂單異動都會遞增表單版本號，版本沒變時報表也不會變
+    versions = store.forms.list_for_user(user_id, g.user_email, versions_only=True)
+    etag = make_etag("report", user_id, request_args_key(), *(f"{f['_id']}:{f.get('version', 0)}" for f in versions))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    groups = [report_entry(e) for e in store.reports.seller_report(user_id, group_by, start_day, end_day, form_ids)]
+    totals = report_entry({k: sum(e[k] for e in groups) for k in SUMMARY_COUNTERS})
+    return with_etag(json_response({"success": True, "group_by": group_by, "groups": groups, "totals": totals}), etag)
+
+
+class FormAccessError(Exception):
+    """沒有權限讀取表單（或表單 / 使用者不存在）。"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def load_form_access(form_id, user_id, email):
+    """讀取表單基本資料並判斷身分，回傳 (form, email, is_owner, is_viewer)。
+
+    user_id / email 來自已驗證的 session token，不需再查詢 users。
+    必須是擁有者，或是被允許的檢視者，否則丟出 FormAccessError。
+    """
+
+    # 只判斷自己是否在檢視者名單中，不讀取整份名單
+    f = store.forms.get(form_id, viewer_email=email)
     if not f:
-        print(f"DEBUG: Form ID {form_id} not found.")
-        return jsonify({"success": False, "message": "找不到表單"}), 404
-    
-    user = users.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        print(f"DEBUG: User ID {user_id} not found.")
-        return jsonify({"success": False, "message": "找不到使用者"}), 404
-        
-    email = user["email"]
+        logger.debug("找不到表單", extra={"fields": {"form_id": form_id}})
+        raise FormAccessError("找不到表單", 404)
 
     # 判斷身分：賣家或買家
     is_owner = (f.get("owner_id") == user_id)
-    is_viewer = (email in f.get("allowed_viewers", []))
-    
-    print(f"\n--- DEBUG: api_get_form Start ({form_id}) ---")
-    print(f"DEBUG: User Email: {email}")
-    print(f"DEBUG: is_owner: {is_owner}, is_viewer: {is_viewer}")
-    print(f"DEBUG: Allowed Viewers: {f.get('allowed_viewers', [])}")
-    
-    # 權限檢查：必須是擁有者，或者被允許的檢視者 (且已登入)
+    is_viewer = f["is_viewer"]
+
     if not (is_owner or is_viewer):
-        print(f"DEBUG: Access denied for {email} (No Owner/Viewer status).")
-        return jsonify({"success": False, "message": "沒有權限檢視"}), 403
+        logger.debug("沒有權限檢視表單", extra={"fields": {"form_id": form_id, "email": email}})
+        raise FormAccessError("沒有權限檢視", 403)
+    return f, email, is_owner, is_viewer
+
+
+def form_not_modified(form_id, user_id):
+    """只讀版本號：帶 If-None-Match 且表單沒有變動時回傳 304 回應，否則回傳 None。
+
+    ETag 是含使用者 id 與版本號的 HMAC（見 make_etag），檢視者被移除時版本號也會遞增，不會沿用舊的結果。
+    """
+    if not request.if_none_match:
+        return None
+    current = store.forms.version(form_id)
+    if current is None:
+        return None
+    return not_modified(make_etag(form_id, current, user_id, request_args_key()))
+
+
+def load_form_read(form_id, user_id):
+    """訂單讀取 API（表單、搜尋、歷史訂單）共用：確認權限並以讀到的版本號產生 ETag。
+
+    回傳 (form, email, is_owner, is_viewer, etag)；沒有權限時丟出 FormAccessError。
+    先讀版本號再讀訂單：期間若有修改，只會讓下次請求多重新載入一次。
+    """
+    f, email, is_owner, is_viewer = load_form_access(form_id, user_id, g.user_email)
+    etag = make_etag(form_id, f.get("version", 0), user_id, request_args_key())
+    return f, email, is_owner, is_viewer, etag
+
+
+def parse_rows_query(args, buyer_email=None, default_limit=None):
+    """訂單讀取 API 共用的參數，回傳 (filters, limit, fields, rows_format)；不合法時丟出 RowQueryError。
+
+    buyer_email 有值時（檢視者/買家）只取這個買家的訂單，資料庫以 (form_id, buyer_email) 索引讀取。
+    """
+    filters = parse_row_filters(args)
+    if buyer_email is not None:
+        filters["buyer_email"] = buyer_email
+    return filters, parse_row_limit(args) or default_limit, parse_row_fields(args), parse_rows_format(args)
+
+
+def encode_rows(rows, fields, rows_format, is_owner):
+    """rows_format=columns 時轉成欄位式編碼；買家的欄位不含 buyer_social。"""
+    if rows_format != "columns":
+        return rows
+    columns = ROW_FIELDS if fields is None else [k for k in ROW_FIELDS if k in fields]
+    if not is_owner:
+        columns = [k for k in columns if k != "buyer_social"]
+    return columnar_rows(rows, ["_id", *columns, "version"])
+
+
+def rows_response(rows, next_cursor, fields, rows_format, is_owner, etag, **extra):
+    """搜尋與歷史訂單的回應：{success, ...extra, rows, next_cursor}，加上 ETag。"""
+    resp = {"success": True, **extra, "rows": encode_rows(rows, fields, rows_format, is_owner), "next_cursor": next_cursor}
+    return with_etag(json_response(resp), etag)
+
+
+def load_form_snapshot(form_id):
+    """讀取表單快取用的快照：檢視者名單、全部買家統計與訂單（超過 form_cache.max_rows 筆時 rows 為 None）。
+
+    呼叫前已讀到表單的版本號：期間若有修改，快照只會比版本號新，下次請求就會因版本號改變而重新讀取。
+    """
+    rows = list(islice(store.rows.iter_rows(form_id, {}), form_cache.max_rows + 1))
+    return {
+        "viewers": store.viewers.list(form_id),
+        "buyer_stats": store.rows.summaries(form_id),
+        "rows": rows if len(rows) <= form_cache.max_rows else None,
+    }
+
+
+def cached_form_snapshot(form_id, version):
+    """取得表單在 version 這個版本的快照：未命中時讀取資料庫並存入快取。"""
+    snapshot = form_cache.get(form_id, version)
+    if snapshot is None:
+        snapshot = load_form_snapshot(form_id)
+        form_cache.set(form_id, version, snapshot)
+    return snapshot
+
+
+@bp.route("/api/form/<form_id>/<user_id>", methods=["GET"])
+@login_required
+def api_get_form(form_id, user_id):
+    cached = form_not_modified(form_id, user_id)
+    if cached:
+        return cached
+
+    # 先確認權限，沒有權限的請求不會讀取訂單或快取
+    try:
+        f, email, is_owner, is_viewer, etag = load_form_read(form_id, user_id)
+    except FormAccessError as e:
+        return jsonify({"success": False, "message": e.message}), e.status
+
+    # 篩選 / 排序 / 分頁條件：有快照時在記憶體中執行，否則交給資料庫執行；
+    # 檢視者/買家只取自己的訂單，buyer_social 也不回傳
+    try:
+        filters, limit, fields, rows_format = parse_rows_query(request.args, None if is_owner else email)
+        sort_key, direction = parse_row_sort(request.args)
+    except RowQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    # 表單快取只用於賣家沒有篩選條件的讀取（整張表單）；
+    # 買家與有篩選條件的讀取由資料庫以索引只讀取需要的訂單
+    snapshot = None
+    if is_owner and not any(v is not None for v in filters.values()) and form_cache.enabled:
+        snapshot = cached_form_snapshot(form_id, f.get("version", 0))
+
+    if is_owner:
+        allowed_viewers = snapshot["viewers"] if snapshot is not None else store.viewers.list(form_id)
+    else:
+        allowed_viewers = []
+
+    try:
+        if snapshot is not None and snapshot["rows"] is not None:
+            rows, next_cursor = find_rows_page(
+                snapshot["rows"], filters, sort_key, direction, limit, request.args.get("cursor"),
+                include_social=is_owner, fields=fields
+            )
+        else:
+            rows, next_cursor = store.rows.find_page(
+                form_id, filters, sort_key, direction, limit, request.args.get("cursor"),
+                include_social=is_owner, fields=fields
+            )
+    except RowQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    # 逐筆 debug 訊息依 LOG_ROW_SAMPLE_RATE 抽樣，大表單不會因此變慢
+    sample_rate = current_app.config["LOG_ROW_SAMPLE_RATE"]
+    if sample_rate > 0 and logger.isEnabledFor(logging.DEBUG):
+        for row in rows:
+            log_sampled(logger, sample_rate, "form row", form_id=form_id, row_id=row.get("_id"), is_owner=is_owner)
 
-    # 建立回傳 rows
-    rows = []
-    
-    # 🚨 檢查 rows 總數
-    total_rows_in_db = len(f.get("rows", []))
-    print(f"DEBUG: Total rows in DB: {total_rows_in_db}")
-    
-    for i, r in enumerate(f.get("rows", [])):
-        row_copy = dict(r) # 複製訂單資料
-        
-        if is_owner:
-            # 擁有者：回傳所有訂單
-            rows.append(row_copy)
-            
-        elif is_viewer:
-            # 檢視者/買家：只回傳該買家自己 Email 匹配的訂單
-            buyer_email_in_row = row_copy.get("buyer_email")
-            
-            # 🚨 偵錯輸出：比對 Email
-            print(f"DEBUG: Row {i+1} Buyer Email: '{buyer_email_in_row}'")
-            print(f"DEBUG: Row {i+1} Match Check: {buyer_email_in_row == email} (Login Email: '{email}')")
-            
-            if buyer_email_in_row == email:
-                # 匹配成功，加入 rows
-                row_copy.pop("buyer_social", None) 
-                rows.append(row_copy)
-            # else: 匹配失敗，跳過該筆訂單
-
-    print(f"DEBUG: Filtered rows count: {len(rows)}")
-    print(f"--- DEBUG: api_get_form End ---")
-    
     # ---------------- 統計資料 (summary) ----------------
-    summary = {}
-    for r in f.get("rows", []):
-        name = r.get("buyer_name","")
-        total = float(r.get("item_total", 0) or 0)
-        summary[name] = summary.get(name, 0) + total
-    
+    # 直接讀取增量維護的買家統計，不需掃描訂單；買家只會拿到自己的統計
+    if snapshot is not None:
+        buyer_stats = snapshot["buyer_stats"]
+    else:
+        buyer_stats = store.rows.summaries(form_id, None if is_owner else email)
+    summary = summary_totals_by_name(buyer_stats)
+
     # ---------------- 回傳結果 ----------------
+    rows = encode_rows(rows, fields, rows_format, is_owner)
     resp = {
         "success": True,
         "form": {
-            "_id": str(f["_id"]),
+            "_id": f["_id"],
             "title": f.get("title"),
-            "description": f.get("description", ""),  
+            "description": f.get("description") or "",
             "owner_id": f.get("owner_id"),
             "owner_email": f.get("owner_email"),
-            "fields": f.get("fields", {}),
+            "fields": f.get("fields") or {},
             "rows": rows, # 這裡包含了篩選後的 rows
-            "allowed_viewers": f.get("allowed_viewers", []),
-            "recent_buyers": f.get("recent_buyers", [])
+            "allowed_viewers": allowed_viewers
         },
         "is_owner": is_owner,
         "is_viewer": is_viewer,
-        "summary_by_buyer": summary 
+        "summary_by_buyer": summary,
+        "buyer_stats": buyer_stats,
+        # 買家統計只含未封存的訂單；已封存的訂單見 /api/history 與賣家報表
+        "summary_scope": "active",
+        "next_cursor": next_cursor
     }
-    return jsonify(resp)
-@app.route("/api/add_viewer", methods=["POST"])
+    return with_etag(json_response(resp), etag)
+
+
+@bp.route("/api/search/<form_id>/<user_id>", methods=["GET"])
+@login_required
+def api_search_rows(form_id, user_id):
+    """搜尋表單中的訂單：q 比對買家名稱、email 與物品名稱（不分大小寫，包含即符合；一個字元時比對單字開頭）。
+
+    以搜尋索引查詢，不讀取整張表單；依建立順序分頁（limit 預設 SEARCH_PAGE_DEFAULT，cursor 為上一頁的 next_cursor）。
+    權限與 api_get_form 相同，買家只搜尋得到自己的訂單；remittance / shipped / fields / rows_format 參數也相同。
+    """
+    cached = form_not_modified(form_id, user_id)
+    if cached:
+        return cached
+    try:
+        f, email, is_owner, is_viewer, etag = load_form_read(form_id, user_id)
+    except FormAccessError as e:
+        return jsonify({"success": False, "message": e.message}), e.status
+
+    try:
+        text = parse_search_text(request.args)
+        filters, limit, fields, rows_format = parse_rows_query(
+            request.args, None if is_owner else email, SEARCH_PAGE_DEFAULT
+        )
+        rows, next_cursor = store.rows.search(
+            form_id, text, filters, limit, request.args.get("cursor"), include_social=is_owner, fields=fields
+        )
+    except RowQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return rows_response(rows, next_cursor, fields, rows_format, is_owner, etag, q=text)
+
+
+@bp.route("/api/history/<form_id>/<user_id>", methods=["GET"])
+@login_required
+def api_form_history(form_id, user_id):
+    """歷史訂單：已封存（已匯款、已出貨且超過 ARCHIVE_AFTER_DAYS 天）的訂單，依建立順序分頁。
+
+    limit 預設 SEARCH_PAGE_DEFAULT，cursor 為上一頁的 next_cursor。權限與 api_get_form 相同，
+    買家只讀得到自己的訂單；remittance / shipped / buyer_email / item_name / fields / rows_format 參數也相同。
+    """
+    cached = form_not_modified(form_id, user_id)
+    if cached:
+        return cached
+    # 封存會 touch 表單，版本號（ETag）也涵蓋封存資料的變動
+    try:
+        f, email, is_owner, is_viewer, etag = load_form_read(form_id, user_id)
+    except FormAccessError as e:
+        return jsonify({"success": False, "message": e.message}), e.status
+
+    try:
+        filters, limit, fields, rows_format = parse_rows_query(
+            request.args, None if is_owner else email, SEARCH_PAGE_DEFAULT
+        )
+        rows, next_cursor = store.archive.find_page(
+            form_id, filters, limit, request.args.get("cursor"), include_social=is_owner, fields=fields
+        )
+    except RowQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return rows_response(rows, next_cursor, fields, rows_format, is_owner, etag)
+
+
+EXPORT_MIMETYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+@bp.route("/api/export/<form_id>/<user_id>", methods=["GET"])
+@login_required(allow_query_token=True)
+def api_export_form(form_id, user_id):
+    """匯出訂單為 CSV 或 XLSX（?format=csv|xlsx），由 cursor 逐批串流輸出。
+
+    權限與 api_get_form 相同：賣家匯出全部訂單，買家只匯出自己的訂單。
+    篩選參數（remittance、shipped、buyer_email、item_name）與 api_get_form 相同。
+    預設包含已封存的訂單（排在目前的訂單之前）；archived=0 只匯出目前的訂單。
+    """
+    fmt = (request.args.get("format") or "csv").lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"success": False, "message": "format 參數不合法（支援 csv、xlsx）"}), 400
+
+    try:
+        f, email, is_owner, is_viewer = load_form_access(form_id, user_id, g.user_email)
+    except FormAccessError as e:
+        return jsonify({"success": False, "message": e.message}), e.status
+
+    try:
+        filters = parse_row_filters(request.args)
+        include_archived = _parse_bool_arg(request.args, "archived")
+    except RowQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    if not is_owner:
+        filters["buyer_email"] = email
+
+    columns = export_columns(f.get("fields", {}), is_owner)
+    cursor = store.rows.iter_rows(form_id, filters, include_social=is_owner)
+    if include_archived is not False:
+        # 先輸出封存的訂單再輸出目前的訂單（兩段各自依建立順序）
+        cursor = chain(store.archive.iter_rows(form_id, filters, include_social=is_owner), cursor)
+    writer = iter_xlsx_export if fmt == "xlsx" else iter_csv_export
+
+    filename = f"{f.get('title') or 'orders'}.{fmt}"
+    disposition = f"attachment; filename=\"orders.{fmt}\"; filename*=UTF-8''{quote(filename)}"
+    return Response(
+        stream_with_context(writer(cursor, columns)),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={"Content-Disposition": disposition}
+    )
+
+
+@bp.route("/api/events/<form_id>/<user_id>", methods=["GET"])
+@login_required(allow_query_token=True)
+def api_form_events(form_id, user_id):
+    """Server-Sent Events：推送訂單異動，買家只會收到自己 email 的訂單事件。
+
+    EventSource 無法帶 header，token 以 ?token= 傳入；重連時依 Last-Event-ID 補送錯過的事件。
+    連線最長 EVENT_STREAM_MAX_SECONDS 秒後由伺服器結束，瀏覽器會自動帶 Last-Event-ID 重連。
+    LIVE_UPDATES 關閉時回傳 404；同時開啟的串流達到 EVENT_MAX_STREAMS 時回傳 503 與 Retry-After，
+    前端改為切回頁面時重新載入。
+    """
+    if not current_app.config['LIVE_UPDATES']:
+        return jsonify({"success": False, "message": "未啟用即時更新"}), 404
+    try:
+        f, email, is_owner, is_viewer = load_form_access(form_id, user_id, g.user_email)
+    except FormAccessError as e:
+        return jsonify({"success": False, "message": e.message}), e.status
+    if not event_streams.try_acquire():
+        resp = jsonify({"success": False, "message": "即時更新連線數已滿，請稍後再試"})
+        resp.headers["Retry-After"] = str(current_app.config['EVENT_RETRY_AFTER_SECONDS'])
+        return resp, 503
+
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    # 先訂閱再補送，兩者之間發布的事件以 id 去除重複
+    sub = form_events.subscribe(form_id)
+    backlog = form_events.replay(form_id, last_id) if last_id else []
+    max_seconds = current_app.config['EVENT_STREAM_MAX_SECONDS']
+    keepalive = current_app.config['EVENT_KEEPALIVE_SECONDS']
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            if backlog is None:
+                # 錯過的事件已不在緩衝區：請用戶端重新載入整張表單
+                yield format_sse({"type": "reset"})
+                return
+            seen = set()
+            pending = list(backlog)
+            deadline = time.monotonic() + max_seconds
+            while True:
+                event = pending.pop(0) if pending else sub.get(timeout=keepalive)
+                if sub.overflowed:
+                    yield format_sse({"type": "reset"})
+                    return
+                if event is None:
+                    if time.monotonic() >= deadline:
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                if event["id"] in seen or not event_visible(event, email, is_owner):
+                    continue
+                seen.add(event["id"])
+                yield format_sse(event_payload(event, is_owner), event["id"])
+                if event["type"] in ("access_revoked", "form_deleted") and not is_owner:
+                    return
+                if time.monotonic() >= deadline:
+                    return
+        finally:
+            form_events.unsubscribe(sub)
+
+    resp = Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # 關閉 nginx 等反向代理的緩衝，事件才能即時送達
+        "X-Accel-Buffering": "no",
+    })
+    # 回應關閉時釋放名額（用戶端在串流開始前就斷線、generator 沒有執行時也會呼叫）
+    resp.call_on_close(event_streams.release)
+    return resp
+
+
+@bp.route("/api/add_viewer", methods=["POST"])
+@login_required
 def api_add_viewer():
     data = request.get_json()
     form_id = data.get("form_id")
-    owner_id = data.get("owner_id")
+    owner_id = g.user_id
     viewer_email = data.get("viewer_email")
     if not all([form_id, owner_id, viewer_email]):
         return jsonify({"success": False, "message": "缺少參數"}),400
-    f = forms.find_one({"_id": ObjectId(form_id)})
+    f = store.forms.get(form_id)
     if not f: return jsonify({"success": False, "message": "找不到表單"}),404
     if f.get("owner_id") != owner_id:
         return jsonify({"success": False, "message": "只有表單擁有者可以新增檢視者"}),403
-    viewer = users.find_one({"email": viewer_email})
-    if not viewer:
+    if not store.users.exists(viewer_email):
         return jsonify({"success": False, "message": "此 email 尚未註冊"}),400
-    forms.update_one({"_id": ObjectId(form_id)}, {"$addToSet": {"allowed_viewers": viewer_email}})
+    store.viewers.add(form_id, viewer_email)
     return jsonify({"success": True})
 
 
-@app.route("/api/remove_viewer", methods=["POST"])
+@bp.route("/api/remove_viewer", methods=["POST"])
+@login_required
 def api_remove_viewer():
     data = request.get_json()
     form_id = data.get("form_id")
-    owner_id = data.get("owner_id")
+    owner_id = g.user_id
     viewer_email = data.get("viewer_email")
     if not all([form_id, owner_id, viewer_email]):
         return jsonify({"success": False, "message": "缺少參數"}),400
-    f = forms.find_one({"_id": ObjectId(form_id)})
+    f = store.forms.get(form_id)
     if not f: return jsonify({"success": False, "message": "找不到表單"}),404
     if f.get("owner_id") != owner_id:
         return jsonify({"success": False, "message": "只有表單擁有者可以移除檢視者"}),403
-    forms.update_one({"_id": ObjectId(form_id)}, {"$pull": {"allowed_viewers": viewer_email}})
+    store.viewers.remove(form_id, viewer_email)
+    publish_form_events(form_id, [{"type": "access_revoked", "audience": [viewer_email]}])
     return jsonify({"success": True})
 
 
-@app.route("/api/add_row", methods=["POST"])
+@bp.route("/api/add_row", methods=["POST"])
+@login_required
 def api_add_row():
     data = request.get_json()
     form_id = data.get("form_id")
-    owner_id = data.get("owner_id")
-    f = forms.find_one({"_id": ObjectId(form_id)})
+    owner_id = g.user_id
+    f = store.forms.get(form_id)
     if not f: return jsonify({"success": False, "message":"找不到表單"}),404
     if f.get("owner_id") != owner_id: return jsonify({"success": False, "message":"沒有權限新增"}),403
 
     buyer_name = data.get("buyer_name")
     buyer_email = data.get("buyer_email")
     item_name = data.get("item_name")
-    item_qty = float(data.get("item_qty") or 0)
-    item_price = float(data.get("item_price") or 0)
-    item_total = item_qty * item_price
     remittance = bool(data.get("remittance", False))
     shipped = data.get("shipped")    # ISO string or None
-    shipping_fee = float(data.get("shipping_fee") or 0)
     buyer_social = data.get("buyer_social")
     merge_shipping = f.get("fields", {}).get("merge_shipping", False)
-
-    item_total = item_qty * item_price
-    if merge_shipping:
-        item_total += shipping_fee 
+    try:
+        amounts = parse_row_amounts(data, merge_shipping)
+    except ImportRowError as e:
+        return jsonify({"success": False, "message": str(e)}),400
 
     row = {
         "_id": str(ObjectId()),    # row id as string
         "buyer_name": buyer_name,
         "buyer_email": buyer_email,
         "item_name": item_name,
-        "item_qty": item_qty,
-        "item_price": item_price,
-        "item_total": item_total,
+        "item_qty": amounts["item_qty"],
+        "item_price": amounts["item_price"],
+        "item_total": amounts["item_total"],
         "remittance": remittance,
         "shipped": shipped,
-        "shipping_fee": shipping_fee,
-        "buyer_social": buyer_social
+        "shipping_fee": amounts["shipping_fee"],
+        "buyer_social": buyer_social,
+        "version": 1
     }
 
-    forms.update_one({"_id": ObjectId(form_id)}, {"$push": {"rows": row}})
-    forms.update_one({"_id": ObjectId(form_id)}, {"$addToSet": {"recent_buyers": buyer_email}})
+    store.rows.insert(form_id, row)
+    store.forms.touch(form_id, form_stats_delta(new_row=row))
+    store.buyers.record(owner_id, [row])
+    publish_form_events(form_id, row_events(new_row=row))
     return jsonify({"success": True, "row": row})
 
 
-@app.route("/api/update_row", methods=["POST"])
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_ERRORS = 1000
+
+
+@bp.route("/api/import_rows", methods=["POST"])
+@login_required
+def api_import_rows():
+    """批次匯入訂單：上傳 CSV 或 JSON Lines，逐行驗證並分批寫入。
+
+    參數 form_id（multipart 表單欄位或 query string）、format（選填，csv / jsonl）。
+    檔案以 multipart 欄位 file 上傳，或直接放在 request body。
+    """
+    form_id = request.values.get("form_id")
+    owner_id = g.user_id
+    if not form_id:
+        return jsonify({"success": False, "message": "缺少參數"}), 400
+    f = store.forms.get(form_id)
+    if not f: return jsonify({"success": False, "message":"找不到表單"}),404
+    if f.get("owner_id") != owner_id: return jsonify({"success": False, "message":"沒有權限新增"}),403
+
+    upload = request.files.get("file")
+    try:
+        if upload:
+            fmt = detect_import_format(upload.filename, upload.mimetype, request.values.get("format"))
+            stream = upload.stream
+        else:
+            fmt = detect_import_format(None, request.mimetype, request.values.get("format"))
+            stream = request.stream
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    merge_shipping = bool(f.get("fields", {}).get("merge_shipping", False))
+    inserted = 0
+    failed = 0
+    errors = []
+    batch = []
+
+    def flush():
+        store.rows.insert_many(form_id, batch)
+        inc = {}
+        for r in batch:
+            form_stats_delta(new_row=r, inc=inc)
+        emails = sorted({r["buyer_email"] for r in batch})
+        store.forms.touch(form_id, inc)
+        store.buyers.record(owner_id, batch)
+        # 批次匯入只送一個事件，收到的用戶端重新載入即可
+        publish_form_events(form_id, [{"type": "rows_imported", "audience": emails, "count": len(batch)}])
+        batch.clear()
+
+    for line_no, record in iter_import_records(stream, fmt):
+        try:
+            if isinstance(record, ImportRowError):
+                raise record
+            row = build_import_row(record, merge_shipping)
+        except ImportRowError as e:
+            failed += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({"line": line_no, "error": str(e)})
+            continue
+
+        row["_id"] = str(ObjectId())
+        row["version"] = 1
+        batch.append(row)
+        inserted += 1
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush()
+
+    if batch:
+        flush()
+
+    return jsonify({
+        "success": True,
+        "inserted": inserted,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors)
+    })
+
+
+@bp.route("/api/update_row", methods=["POST"])
+@login_required
 def api_update_row():
     data = request.get_json()
     form_id = data.get("form_id")
-    owner_id = data.get("owner_id")
-    index = int(data.get("index"))
-    f = forms.find_one({"_id": ObjectId(form_id)})
+    owner_id = g.user_id
+    f = store.forms.get(form_id)
     if not f: return jsonify({"success": False, "message":"找不到表單"}),404
     if f.get("owner_id") != owner_id: return jsonify({"success": False, "message":"沒有權限修改"}),403
-    rows = f.get("rows", [])
-    if index < 0 or index >= len(rows): return jsonify({"success": False, "message":"index 不合法"}),400
-
-    item_qty = float(data.get("item_qty") or 0)
-    item_price = float(data.get("item_price") or 0)
-    shipping_fee = float(data.get("shipping_fee") or 0)
+    row_id = resolve_row_id(form_id, data)
+    if row_id is None: return jsonify({"success": False, "message":"找不到訂單"}),404
+    try:
+        version = parse_row_version(data)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message":"version 不合法"}),400
 
-    # 後端依表單設定決定是否併入運費
-    # 注意：這裡的 key 應該是 fields.merge_shipping，但為了保持與您程式碼的邏輯一致，
-    # 我使用 shipping_fee_included，如果您的 fields 裡是 merge_shipping，請調整
-    shipping_included = bool(f.get("fields", {}).get("merge_shipping", False)) 
-    
-    if shipping_included:
-        item_total = item_qty * item_price + shipping_fee
-    else:
-        item_total = item_qty * item_price
+    # 後端依表單設定 (fields.merge_shipping) 決定是否併入運費
+    shipping_included = bool(f.get("fields", {}).get("merge_shipping", False))
+    try:
+        amounts = parse_row_amounts(data, shipping_included)
+    except ImportRowError as e:
+        return jsonify({"success": False, "message": str(e)}),400
 
-    new_row = {
-        "_id": rows[index].get("_id", str(ObjectId())),
+    changes = {
         "buyer_name": data.get("buyer_name"),
         "buyer_email": data.get("buyer_email"),
         "item_name": data.get("item_name"),
-        "item_qty": item_qty,
-        "item_price": item_price,
-        "item_total": item_total,
+        "item_qty": amounts["item_qty"],
+        "item_price": amounts["item_price"],
+        "item_total": amounts["item_total"],
         "remittance": bool(data.get("remittance", False)),
         "shipped": data.get("shipped"),
-        "shipping_fee": shipping_fee,
+        "shipping_fee": amounts["shipping_fee"],
         "buyer_social": data.get("buyer_social")
     }
 
-    rows[index] = new_row
-    forms.update_one({"_id": ObjectId(form_id)}, {"$set": {"rows": rows}})
-    forms.update_one({"_id": ObjectId(form_id)}, {"$addToSet": {"recent_buyers": new_row.get("buyer_email")}})
+    # 只更新這一筆訂單，並以 version 做樂觀鎖，避免同時編輯互相覆蓋
+    updated = store.rows.update(form_id, row_id, version, changes)
+    if not updated: return row_conflict_response(form_id, row_id)
+    old_row, new_row = updated
+    store.forms.touch(form_id, form_stats_delta(old_row=old_row, new_row=new_row))
+    # 只修改數量、狀態等欄位時不算一次新的下單，買家名錄不變
+    if any(old_row.get(k) != new_row.get(k) for k in ("buyer_email", "buyer_name", "buyer_social")):
+        store.buyers.record(owner_id, [new_row])
+    publish_form_events(form_id, row_events(old_row=old_row, new_row=new_row))
     return jsonify({"success": True, "row": new_row})
 
 
-@app.route("/api/delete_row", methods=["POST"])
+# 單次批次更新最多可帶的訂單數
+BATCH_UPDATE_MAX = 500
+
+
+def parse_batch_rows(data):
+    """批次更新的訂單清單：rows=[{row_id, version}]，或只帶 row_ids=[...]（不做衝突檢查）。
+
+    回傳去除重複後的 [(row_id, version)]；格式不合法時丟出 ValueError。
+    """
+    if data.get("rows") is not None:
+        items = data.get("rows")
+        if not isinstance(items, list):
+            raise ValueError("rows 必須是陣列")
+    else:
+        items = data.get("row_ids")
+        if not isinstance(items, list):
+            raise ValueError("缺少 row_ids")
+        items = [{"row_id": row_id} for row_id in items]
+
+    updates = []
+    seen = set()
+    for item in items:
+        if not isinstance(item, dict) or not item.get("row_id"):
+            raise ValueError("row_id 不合法")
+        row_id = str(item["row_id"])
+        if row_id in seen:
+            continue
+        seen.add(row_id)
+        try:
+            version = parse_row_version(item)
+        except (TypeError, ValueError):
+            raise ValueError("version 不合法")
+        updates.append((row_id, version))
+    if not updates:
+        raise ValueError("沒有要更新的訂單")
+    if len(updates) > BATCH_UPDATE_MAX:
+        raise ValueError(f"一次最多更新 {BATCH_UPDATE_MAX} 筆訂單")
+    return updates
+
+
+def parse_row_patch(data):
+    """批次更新的欄位：remittance（true / false）、shipped（出貨日期字串，null 或空字串表示未出貨）。"""
+    patch = data.get("patch")
+    if not isinstance(patch, dict) or not patch:
+        raise ValueError("缺少 patch")
+    unknown = set(patch) - set(BATCH_PATCH_FIELDS)
+    if unknown:
+        raise ValueError(f"patch 只能包含 {' / '.join(BATCH_PATCH_FIELDS)}")
+    changes = {}
+    if "remittance" in patch:
+        if not isinstance(patch["remittance"], bool):
+            raise ValueError("remittance 必須是 true 或 false")
+        changes["remittance"] = patch["remittance"]
+    if "shipped" in patch:
+        shipped = patch["shipped"]
+        if shipped is not None and not isinstance(shipped, str):
+            raise ValueError("shipped 必須是日期字串或 null")
+        changes["shipped"] = shipped or None
+    return changes
+
+
+@bp.route("/api/batch_update_rows", methods=["POST"])
+@login_required
+def api_batch_update_rows():
+    """一次修改多筆訂單的出貨 / 匯款狀態。
+
+    body：{form_id, rows: [{row_id, version}] 或 row_ids: [...], patch: {shipped, remittance}}。
+    所有訂單以一次批次寫入更新，表單計數器與事件也只更新 / 發布一次；
+    回傳每筆訂單的結果（updated / conflict / not_found）。
+    """
+    data = request.get_json()
+    form_id = data.get("form_id")
+    owner_id = g.user_id
+    f = store.forms.get(form_id)
+    if not f: return jsonify({"success": False, "message":"找不到表單"}),404
+    if f.get("owner_id") != owner_id: return jsonify({"success": False, "message":"沒有權限修改"}),403
+    try:
+        updates = parse_batch_rows(data)
+        patch = parse_row_patch(data)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    updated, conflicts, missing = store.rows.update_many(form_id, updates, patch)
+    if updated:
+        inc = {}
+        for old_row, new_row in updated:
+            form_stats_delta(old_row=old_row, new_row=new_row, inc=inc)
+        store.forms.touch(form_id, inc)
+        # 只送一個事件，收到的用戶端重新載入即可
+        emails = sorted({new_row.get("buyer_email") for _, new_row in updated})
+        publish_form_events(form_id, [{"type": "rows_updated", "audience": emails, "count": len(updated)}])
+
+    results = {row_id: {"row_id": row_id, "status": "not_found"} for row_id in missing}
+    for _, new_row in updated:
+        results[new_row["_id"]] = {"row_id": new_row["_id"], "status": "updated", "row": new_row}
+    for row in conflicts:
+        results[row["_id"]] = {"row_id": row["_id"], "status": "conflict", "row": row}
+    return jsonify({
+        "success": True,
+        "updated": len(updated),
+        "conflicts": len(conflicts),
+        "not_found": len(missing),
+        "results": [results[row_id] for row_id, _ in updates]
+    })
+
+
+@bp.route("/api/delete_row", methods=["POST"])
+@login_required
 def api_delete_row():
     data = request.get_json()
     form_id = data.get("form_id")
-    owner_id = data.get("owner_id")
-    index = int(data.get("index"))
-    f = forms.find_one({"_id": ObjectId(form_id)})
+    owner_id = g.user_id
+    f = store.forms.get(form_id)
     if not f: return jsonify({"success": False, "message":"找不到表單"}),404
     if f.get("owner_id") != owner_id: return jsonify({"success": False, "message":"沒有權限刪除"}),403
-    rows = f.get("rows", [])
-    if index < 0 or index >= len(rows): return jsonify({"success": False, "message":"index 不合法"}),400
-    rows.pop(index)
-    forms.update_one({"_id": ObjectId(form_id)}, {"$set": {"rows": rows}})
+    row_id = resolve_row_id(form_id, data)
+    if row_id is None: return jsonify({"success": False, "message":"找不到訂單"}),404
+    try:
+        version = parse_row_version(data)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message":"version 不合法"}),400
+    old_row = store.rows.delete(form_id, row_id, version)
+    if not old_row: return row_conflict_response(form_id, row_id)
+    store.forms.touch(form_id, form_stats_delta(old_row=old_row))
+    publish_form_events(form_id, row_events(old_row=old_row))
     return jsonify({"success": True})
 
 
-@app.route("/api/clear_form", methods=["POST"])
+@bp.route("/api/clear_form", methods=["POST"])
+@login_required
 def api_clear_form():
     data = request.get_json()
     form_id = data.get("form_id")
-    owner_id = data.get("owner_id")
-    f = forms.find_one({"_id": ObjectId(form_id)})
+    owner_id = g.user_id
+    f = store.forms.get(form_id)
     if not f: return jsonify({"success": False, "message":"找不到表單"}),404
     if f.get("owner_id") != owner_id: return jsonify({"success": False, "message":"沒有權限清空"}),403
-    forms.update_one({"_id": ObjectId(form_id)}, {"$set": {"rows": []}})
+    store.rows.clear(form_id)
+    store.forms.touch(form_id, reset_stats=True)
+    publish_form_events(form_id, [{"type": "form_cleared", "audience": None}])
     return jsonify({"success": True})
 
 
-@app.route("/api/recent_buyers/<form_id>", methods=["GET"])
-def api_recent_buyers(form_id):
-    f = forms.find_one({"_id": ObjectId(form_id)})
-    if not f: return jsonify({"success": False, "recent_buyers": []})
-    return jsonify({"success": True, "recent_buyers": f.get("recent_buyers", [])})
+@bp.route("/api/buyer_suggestions", methods=["GET"])
+@login_required
+def api_buyer_suggestions():
+    """新增訂單時的買家自動完成：登入賣家的買家名錄中 email 或名稱以 q 開頭的買家。
+
+    依下單次數與最近下單時間的排名分數排序，回傳前 limit 筆（預設 BUYER_SUGGEST_DEFAULT，
+    上限 BUYER_SUGGEST_MAX），每筆含 email / name / social / uses；q 為空時回傳排名最高的買家。
+    """
+    prefix = str(request.args.get("q") or "").strip()
+    if len(prefix) > SEARCH_QUERY_MAX:
+        return jsonify({"success": False, "message": f"搜尋文字最多 {SEARCH_QUERY_MAX} 個字"}), 400
+    try:
+        limit = parse_suggest_limit(request.args)
+    except RowQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "buyers": store.buyers.suggest(g.user_id, prefix, limit)})
 
 
-@app.route("/api/delete_form", methods=["POST"])
+@bp.route("/api/delete_form", methods=["POST"])
+@login_required
 def api_delete_form():
     data = request.get_json()
     form_id = data.get("form_id")
-    owner_id = data.get("owner_id")
-    f = forms.find_one({"_id": ObjectId(form_id)})
+    owner_id = g.user_id
+    f = store.forms.get(form_id)
     if not f: return jsonify({"success": False, "message": "找不到表單"}), 404
     if f.get("owner_id") != owner_id:
         return jsonify({"success": False, "message": "沒有權限刪除"}), 403
-    forms.delete_one({"_id": ObjectId(form_id)})
+    store.forms.delete(form_id)
+    publish_form_events(form_id, [{"type": "form_deleted", "audience": None}])
     return jsonify({"success": True})
 
+
+# ---------------- CLI ----------------
+@bp.cli.command("migrate-rows")
+def migrate_rows_command():
+    """一次性搬移：把 forms.rows 內嵌陣列搬到 order_rows collection（僅 MongoDB）。
+
+    使用方式：flask --app app migrate-rows
+    以 upsert 寫入，重複執行不會產生重複訂單。
+    """
+    if not hasattr(store, "migrate_embedded_rows"):
+        print("❌ migrate-rows 只適用於 STORAGE_BACKEND=mongo")
+        raise SystemExit(1)
+    store.ensure_indexes()
+    moved_forms, moved_rows = store.migrate_embedded_rows()
+    print(f"✅ 已搬移 {moved_forms} 張表單、共 {moved_rows} 筆訂單到 order_rows")
+    store.rows.rebuild_summaries()
+    store.rows.rebuild_search()
+    store.reports.rebuild()
+    store.forms.rebuild_stats()
+    store.buyers.rebuild()
+
+
+@bp.cli.command("rebuild-summaries")
+@click.option("--form-id", default=None, help="只重建指定表單（預設重建全部）")
+def rebuild_summaries_command(form_id):
+    """由訂單重新計算買家統計、每日彙總、搜尋索引與表單計數器，修正增量統計的誤差。"""
+    count = store.rows.rebuild_summaries(form_id)
+    rollup_count = store.reports.rebuild(form_id)
+    search_count = store.rows.rebuild_search(form_id)
+    form_count = store.forms.rebuild_stats(form_id)
+    print(f"✅ 已重建 {count} 筆買家統計、{rollup_count} 筆每日彙總、{search_count} 筆訂單的搜尋索引、"
+          f"{form_count} 張表單的計數器")
+
+
+@bp.cli.command("rebuild-buyers")
+@click.option("--owner-id", default=None, help="只重建指定賣家（預設重建全部）")
+def rebuild_buyers_command(owner_id):
+    """由訂單重新建立賣家的買家名錄（取代舊版表單上的最近買家清單），每位賣家保留排名最高的買家。"""
+    count = store.buyers.rebuild(owner_id)
+    print(f"✅ 已重建 {count} 筆買家名錄")
+
+
+def archive_completed_rows(form_id=None, older_than_days=None):
+    """把超過 older_than_days 天（預設 ARCHIVE_AFTER_DAYS）且已匯款、已出貨的訂單搬到封存區，回傳搬移筆數。
+
+    每張表單每次最多搬移 ARCHIVE_BATCH_ROWS 筆，搬完一批就更新表單計數器並通知開著的頁面重新載入。
+    """
+    if older_than_days is None:
+        older_than_days = current_app.config["ARCHIVE_AFTER_DAYS"]
+    cutoff = archive_cutoff_id(older_than_days)
+    total = 0
+    for fid in ([form_id] if form_id else store.forms.ids()):
+        while True:
+            rows = store.archive.archive(fid, cutoff, ARCHIVE_BATCH_ROWS)
+            if not rows:
+                break
+            inc = {}
+            for row in rows:
+                form_stats_delta(old_row=row, inc=inc)
+            store.forms.touch(fid, inc)
+            publish_form_events(fid, [{"type": "rows_archived", "audience": None, "count": len(rows)}])
+            total += len(rows)
+    return total
+
+
+@bp.cli.command("archive-rows")
+@click.option("--form-id", default=None, help="只封存指定表單（預設全部表單）")
+@click.option("--older-than-days", type=int, default=None, help="封存超過幾天的訂單（預設 ARCHIVE_AFTER_DAYS）")
+@click.option("--every", type=int, default=None, help="每隔幾秒執行一次（預設只執行一次）")
+def archive_rows_command(form_id, older_than_days, every):
+    """把已匯款、已出貨的舊訂單搬到封存區（order_archive），表單只讀取近期的訂單。
+
+    同時只能有一個封存 process（以 cron 定期執行，或 --every 常駐）：兩個 process 同時改寫同一份封存資料會互相覆蓋。
+    """
+    while True:
+        count = archive_completed_rows(form_id, older_than_days)
+        print(f"✅ 已封存 {count} 筆訂單")
+        if not every:
+            return
+        try:
+            time.sleep(every)
+        except KeyboardInterrupt:
+            return
+
+
+@bp.cli.command("create-indexes")
+@click.option("--dedupe", is_flag=True, help="先合併會讓 unique 索引無法建立的重複資料（例如重複 email）")
+def create_indexes_command(dedupe):
+    """建立所有索引（MongoDB 見 indexes.py，SQLite 見 storage/sqlite.py；可重複執行，建議放在部署流程）。"""
+    if dedupe:
+        fixed = store.dedupe_unique_keys()
+        print("✅ 重複資料已處理: " + (", ".join(f"{k} {v}" for k, v in fixed.items()) or "無"))
+    try:
+        created = store.ensure_indexes()
+    except (OperationFailure, sqlite3.IntegrityError) as e:
+        # 例如 users 已有重複 email，無法建立 unique 索引
+        print(f"❌ 索引建立失敗: {e}")
+        print("   已有重複資料時以 create-indexes --dedupe 合併後再建立")
+        raise SystemExit(1)
+    print("✅ 索引已就緒: " + ", ".join(created))
+
+
+@bp.cli.command("check-indexes")
+def check_indexes_command():
+    """檢查常用查詢的執行計畫（MongoDB explain / SQLite EXPLAIN QUERY PLAN），任何一個查詢全表掃描即失敗。"""
+    failed = 0
+    for description, ok, stages in store.check_indexes():
+        mark = "✅" if ok else "❌"
+        print(f"{mark} {description}: {' > '.join(stages)}")
+        if not ok:
+            failed += 1
+    if failed:
+        print(f"❌ {failed} 個查詢沒有使用索引")
+        raise SystemExit(1)
+
+
+
+@bp.cli.command("mail-worker")
+def mail_worker_command():
+    """在獨立 process 寄送 mail_jobs（搭配 MAIL_WORKER_IN_PROCESS=0 使用）。"""
+    if not mail_queue.settings.configured:
+        print("❌ SMTP 環境變數未設定")
+        raise SystemExit(1)
+    print("✅ 寄信 worker 已啟動，按 Ctrl+C 結束")
+    try:
+        mail_queue.run()
+    except KeyboardInterrupt:
+        pass
+
+
+# ---------------- Application factory ----------------
+def create_app(overrides=None):
+    """建立並設定 Flask app；overrides 覆寫由環境變數讀取的設定。
+
+    不連線資料庫，可以在 gunicorn --preload 的 master process 呼叫；
+    gunicorn 'app:create_app()' 或 'app:app'（import 時建立的預設 app）都可以使用。
+    """
+    app = Flask(__name__, static_folder="static", template_folder="templates")
+    app.config.update(
+        SECRET_KEY=os.environ.get("SECRET_KEY", "your_production_secret_here"),
+        # 用於密碼重設 token 的額外安全鹽值
+        SECURITY_PASSWORD_SALT=os.environ.get("SECURITY_PASSWORD_SALT", "a_unique_salt_for_password_reset"),
+        SESSION_TOKEN_MAX_AGE=int(os.environ.get("SESSION_TOKEN_MAX_AGE", 7 * 24 * 3600)),
+        # 設定後 /metrics 需帶 Authorization: Bearer <METRICS_TOKEN>
+        METRICS_TOKEN=os.environ.get("METRICS_TOKEN"),
+        # 回應壓縮（gzip），小於 COMPRESS_MIN_BYTES 的回應不壓縮
+        COMPRESS_MIN_BYTES=int(os.environ.get("COMPRESS_MIN_BYTES", 1024)),
+        COMPRESS_LEVEL=int(os.environ.get("COMPRESS_LEVEL", 6)),
+        # 即時更新（SSE）：關閉時表單頁面不建立連線，只在載入與操作後重新讀取
+        LIVE_UPDATES=os.environ.get("LIVE_UPDATES", "1") != "0",
+        EVENT_RETRY_AFTER_SECONDS=int(os.environ.get("EVENT_RETRY_AFTER_SECONDS", 60)),
+        EVENT_STREAM_MAX_SECONDS=int(os.environ.get("EVENT_STREAM_MAX_SECONDS", 300)),
+        EVENT_KEEPALIVE_SECONDS=int(os.environ.get("EVENT_KEEPALIVE_SECONDS", 15)),
+        HEALTHZ_TIMEOUT_SECONDS=float(os.environ.get("HEALTHZ_TIMEOUT_SECONDS", 2)),
+        # 前面有幾層反向代理（nginx、負載平衡器）；0 表示直接對外，request.remote_addr 即為用戶端 IP
+        TRUSTED_PROXY_COUNT=int(os.environ.get("TRUSTED_PROXY_COUNT", 0)),
+        # archive-rows 封存超過幾天（依建立時間）且已匯款、已出貨的訂單
+        ARCHIVE_AFTER_DAYS=int(os.environ.get("ARCHIVE_AFTER_DAYS", 90)),
+    )
+    app.config.update(overrides or {})
+    CORS(app)
+    if app.config["TRUSTED_PROXY_COUNT"] > 0:
+        # 只採信最後 TRUSTED_PROXY_COUNT 層代理加上的 X-Forwarded-For / -Proto，
+        # 登入限制依真正的用戶端 IP 計算，不會因為所有請求都來自代理而一起被擋
+        proxies = app.config["TRUSTED_PROXY_COUNT"]
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+
+    configure_logging(app)
+    init_request_metrics(app, logger, request_metrics, mongo_counter)
+    init_compression(app)
+
+    app.extensions["reset_serializer"] = URLSafeTimedSerializer(
+        app.config['SECRET_KEY'], salt=app.config['SECURITY_PASSWORD_SALT'])
+    app.extensions["session_serializer"] = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt="session-token")
+
+    app.register_blueprint(bp)
+    return app
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
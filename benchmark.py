@@ -0,0 +1,475 @@
+"""API 基準測試：建立合成資料，以多個並行用戶端呼叫主要 API，輸出 JSON 報告。
+
+    python benchmark.py --mongo-uri mongodb://localhost:27017 --output bench.json
+    python benchmark.py --mongo-uri mongomock --sizes 10,1000 --output bench.json
+    python benchmark.py --mongo-uri mongodb://localhost:27017 --compare baseline.json
+    python benchmark.py --sqlite bench.sqlite3 --output bench-sqlite.json
+    python benchmark.py --startup --mongo-uri mongodb://localhost:27017 --output startup.json
+
+- 資料寫入 MONGO_DB_NAME（預設 datasys114_bench），開始前會整個清空，不要指向正式資料庫。
+- --mongo-uri mongomock 使用 process 內的 mongomock（需另外安裝），不需要 MongoDB，
+  但沒有 CommandListener 事件，mongo_round_trips 會是 null；mongomock 也不是 thread-safe，
+  並行請求可能出現錯誤，請搭配 --concurrency 1，數字只適合同一環境前後比較。
+- --sqlite PATH 改用 SQLite 儲存（STORAGE_BACKEND=sqlite），檔案開始前同樣會清空。
+- 請求以 Flask test client 在 process 內執行，量測的是應用程式 + MongoDB 的時間，不含網路與 gunicorn。
+- --compare 與舊報告比較，p95 變慢超過 --threshold（預設 20%）時以非 0 結束，方便放在 CI。
+- --startup 只量測 worker 啟動時間：以全新的 Python process 重複 import app 並送出第一個 /healthz，
+  不建立資料；--compare 時比較啟動時間的中位數。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+BENCH_PASSWORD = "bench-password"
+# --startup 以這個參數啟動子 process，在子 process 內量測
+STARTUP_PROBE = "--startup-probe"
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--mongo-uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017"),
+                   help="MongoDB URI，或 mongomock 使用 process 內的替代品")
+    p.add_argument("--sqlite", metavar="PATH", help="改用 SQLite 儲存（指定資料庫檔案）")
+    p.add_argument("--db-name", default=os.environ.get("BENCH_DB_NAME", "datasys114_bench"))
+    p.add_argument("--sizes", default="10,1000,20000", help="每張表單的訂單數（逗號分隔）")
+    p.add_argument("--sellers", type=int, default=20, help="額外的賣家數（各有一張 10 筆訂單的小表單）")
+    p.add_argument("--buyers", type=int, default=200, help="買家數")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--requests", type=int, default=200, help="每個情境的請求數")
+    p.add_argument("--seed", type=int, default=114)
+    p.add_argument("--output", help="JSON 報告輸出路徑（預設輸出到 stdout）")
+    p.add_argument("--compare", help="與舊的 JSON 報告比較")
+    p.add_argument("--threshold", type=float, default=0.2, help="p95 允許變慢的比例")
+    p.add_argument("--startup", action="store_true", help="只量測啟動時間（import app 與第一個 /healthz）")
+    p.add_argument("--startup-runs", type=int, default=10, help="--startup 重複啟動的次數")
+    p.add_argument(STARTUP_PROBE, action="store_true", help=argparse.SUPPRESS)
+    return p.parse_args(argv)
+
+
+def load_app(args):
+    """設定環境變數後再 import app，讓 app 連到基準測試專用的資料庫。"""
+    os.environ["MONGO_DB_NAME"] = args.db_name
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("MAIL_WORKER_IN_PROCESS", "0")
+    os.environ["LOGIN_MAX_FAILURES_PER_IP"] = str(10 ** 9)
+    if args.sqlite:
+        os.environ["STORAGE_BACKEND"] = "sqlite"
+        os.environ["SQLITE_PATH"] = args.sqlite
+    elif args.mongo_uri == "mongomock":
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("--mongo-uri mongomock 需要先安裝 mongomock")
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+        _patch_mongomock_elem_match()
+        if args.concurrency > 1:
+            print("⚠️ mongomock 不是 thread-safe，建議使用 --concurrency 1", file=sys.stderr)
+        os.environ["MONGO_URI"] = "mongodb://localhost"
+    else:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    import app as app_module
+    return app_module
+
+
+def _patch_mongomock_elem_match():
+    """mongomock 不支援對純量陣列使用 {"$elemMatch": {"$eq": ...}} projection（MongoDB 支援），補上這個情況。"""
+    import mongomock.collection as mc
+
+    original = mc.filter_applies
+
+    def filter_applies(search_filter, document):
+        if isinstance(search_filter, dict) and set(search_filter) <= {"$eq", "$in"} and not isinstance(document, dict):
+            if "$eq" in search_filter:
+                return document == search_filter["$eq"]
+            return document in search_filter["$in"]
+        return original(search_filter, document)
+
+    mc.filter_applies = filter_applies
+
+
+# ---------------- 合成資料 ----------------
+def make_row(rng, buyer_email, buyer_name, merge_shipping):
+    from bson.objectid import ObjectId
+    from order_io import compute_item_total
+
+    qty = float(rng.randint(1, 5))
+    price = float(rng.choice([80, 120, 199, 350, 990]))
+    fee = float(rng.choice([0, 60]))
+    return {
+        "_id": str(ObjectId()),
+        "buyer_name": buyer_name,
+        "buyer_email": buyer_email,
+        "item_name": rng.choice(["抹茶", "手霜", "零錢包", "T-shirt", "保溫瓶"]),
+        "item_qty": qty,
+        "item_price": price,
+        "item_total": compute_item_total(qty, price, fee, merge_shipping),
+        "remittance": rng.random() < 0.6,
+        "shipped": "2024-05-01" if rng.random() < 0.3 else None,
+        "shipping_fee": fee,
+        "buyer_social": "@" + buyer_name,
+        "version": 1,
+    }
+
+
+def backend_name(args):
+    if args.sqlite:
+        return "sqlite"
+    return "mongomock" if args.mongo_uri == "mongomock" else "mongodb"
+
+
+def seed(app_module, args):
+    """清空並經由 storage 建立賣家、買家、表單與訂單；回傳各情境需要的 id 與 token。"""
+    from storage import ASCENDING
+
+    rng = random.Random(args.seed)
+    store = app_module.store
+    store.drop_all()
+    store.ensure_indexes()
+
+    # 所有帳號共用一個雜湊，建立資料時不需要逐一計算
+    hashed = app_module.password_hasher.hash(BENCH_PASSWORD)
+
+    def create_user(name):
+        user = {"username": name, "email": f"{name}@bench.test"}
+        user["_id"] = store.users.create(user["username"], user["email"], hashed)
+        return user
+
+    buyers = [create_user(f"buyer{i}") for i in range(args.buyers)]
+    sellers = [create_user(f"seller{i}") for i in range(args.sellers + 1)]
+
+    fields = {"buyer_name": True, "buyer_email": True, "item_name": True, "item_qty": True,
+              "item_price": True, "item_total": True, "remittance": True, "shipped": True,
+              "shipping_fee": True, "merge_shipping": True, "buyer_social": True}
+    main_seller = sellers[0]
+    viewer_emails = [b["email"] for b in buyers]
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    def create_form(seller, title, n_rows):
+        form_id = store.forms.create(title, "benchmark", seller["_id"], seller["email"], fields)
+        for email in viewer_emails:
+            store.viewers.add(form_id, email)
+        batch = []
+        for _ in range(n_rows):
+            b = rng.choice(buyers)
+            batch.append(make_row(rng, b["email"], b["username"], True))
+            if len(batch) >= 1000:
+                store.rows.insert_many(form_id, batch)
+                batch = []
+        if batch:
+            store.rows.insert_many(form_id, batch)
+        return form_id
+
+    forms_by_size = {n: create_form(main_seller, f"bench-{n}", n) for n in sizes}
+    for s in sellers[1:]:
+        create_form(s, "bench-small", 10)
+    store.rows.rebuild_summaries()
+    store.forms.rebuild_stats()
+    store.buyers.rebuild()
+
+    # 每張表單挑一個確實有訂單的買家
+    buyer_for_form = {}
+    for n, fid in forms_by_size.items():
+        rows, _ = store.rows.find_page(fid, None, "_id", ASCENDING, 1)
+        email = rows[0]["buyer_email"] if rows else buyers[0]["email"]
+        buyer_for_form[n] = next(b for b in buyers if b["email"] == email)
+
+    return {
+        "seller": main_seller,
+        "buyers": buyers,
+        "forms_by_size": forms_by_size,
+        "buyer_for_form": buyer_for_form,
+        "token": lambda user: _session_token(app_module, user),
+    }
+
+
+def _session_token(app_module, user):
+    # token 以 app 設定的 SECRET_KEY 簽章，需要 app context
+    with app_module.app.app_context():
+        return app_module.issue_session_token(user)
+
+
+# ---------------- 執行與統計 ----------------
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_scenario(app_module, name, make_request, args, form_rows=None):
+    """以 concurrency 個 thread（各自一個 test client）送出 args.requests 個請求。"""
+    flask_app = app_module.app
+    counter = app_module.mongo_counter
+    lock = threading.Lock()
+    next_index = [0]
+    latencies, sizes, round_trips = [], [], []
+    errors = [0]
+
+    def worker():
+        client = flask_app.test_client()
+        while True:
+            with lock:
+                i = next_index[0]
+                if i >= args.requests:
+                    return
+                next_index[0] += 1
+            started = time.perf_counter()
+            resp = make_request(client, i)
+            elapsed = time.perf_counter() - started
+            body = resp.get_data()
+            ops = counter.count
+            with lock:
+                latencies.append(elapsed * 1000)
+                sizes.append(len(body))
+                round_trips.append(ops)
+                if resp.status_code >= 400:
+                    errors[0] += 1
+
+    wall = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall
+
+    latencies.sort()
+    # mongomock 沒有 CommandListener 事件；SQLite 不經過 MongoDB
+    stand_in = backend_name(args) != "mongodb"
+    return {
+        "scenario": name,
+        "form_rows": form_rows,
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "errors": errors[0],
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "bytes_per_request": round(statistics.mean(sizes), 1),
+        "mongo_round_trips": None if stand_in else round(statistics.mean(round_trips), 2),
+    }
+
+
+def build_scenarios(app_module, data):
+    from storage import ASCENDING
+
+    seller = data["seller"]
+    seller_id = str(seller["_id"])
+    seller_auth = {"Authorization": "Bearer " + data["token"](seller)}
+    scenarios = []
+
+    for n, form_id in sorted(data["forms_by_size"].items()):
+        buyer = data["buyer_for_form"][n]
+        buyer_auth = {"Authorization": "Bearer " + data["token"](buyer)}
+        buyer_id = str(buyer["_id"])
+        row_ids = [r["_id"] for r in app_module.store.rows.find_page(form_id, None, "_id", ASCENDING, 1000)[0]]
+
+        def get_owner(client, i, form_id=form_id):
+            return client.get(f"/api/form/{form_id}/{seller_id}?limit=100", headers=seller_auth)
+
+        def get_owner_all(client, i, form_id=form_id):
+            return client.get(f"/api/form/{form_id}/{seller_id}", headers=seller_auth)
+
+        def get_owner_compact(client, i, form_id=form_id):
+            # 與前端相同：欄位式編碼 + 壓縮（bytes_per_request 為壓縮後大小）
+            return client.get(f"/api/form/{form_id}/{seller_id}?rows_format=columns",
+                              headers=dict(seller_auth, **{"Accept-Encoding": "br, gzip"}))
+
+        def get_buyer(client, i, form_id=form_id, buyer_id=buyer_id, buyer_auth=buyer_auth):
+            return client.get(f"/api/form/{form_id}/{buyer_id}", headers=buyer_auth)
+
+        def add_row(client, i, form_id=form_id):
+            return client.post("/api/add_row", headers=seller_auth, json={
+                "form_id": form_id, "buyer_name": "bench", "buyer_email": "buyer0@bench.test",
+                "item_name": "bench", "item_qty": 1, "item_price": 100,
+            })
+
+        def update_row(client, i, form_id=form_id, row_ids=row_ids):
+            # 不帶 version：量測的是寫入本身，而不是衝突處理
+            return client.post("/api/update_row", headers=seller_auth, json={
+                "form_id": form_id, "row_id": row_ids[i % len(row_ids)], "buyer_name": "bench",
+                "buyer_email": "buyer0@bench.test", "item_name": "bench", "item_qty": 2,
+                "item_price": 100, "remittance": bool(i % 2),
+            })
+
+        scenarios += [
+            ("api_get_form owner limit=100", get_owner, n),
+            ("api_get_form owner all rows", get_owner_all, n),
+            ("api_get_form owner all rows columnar+compressed", get_owner_compact, n),
+            ("api_get_form buyer", get_buyer, n),
+            ("api_add_row", add_row, n),
+        ]
+        if row_ids:
+            scenarios.append(("api_update_row", update_row, n))
+
+    def my_forms(client, i):
+        return client.get(f"/api/my_forms/{seller_id}", headers=seller_auth)
+
+    buyers = data["buyers"]
+
+    def my_forms_buyer(client, i):
+        b = buyers[i % len(buyers)]
+        return client.get(f"/api/my_forms/{b['_id']}",
+                          headers={"Authorization": "Bearer " + data["token"](b)})
+
+    def login(client, i):
+        b = buyers[i % len(buyers)]
+        return client.post("/api/login", json={"email": b["email"], "password": BENCH_PASSWORD})
+
+    def buyer_suggestions(client, i):
+        return client.get(f"/api/buyer_suggestions?q=buyer{i % 10}", headers=seller_auth)
+
+    scenarios += [
+        ("api_my_forms seller", my_forms, None),
+        ("api_my_forms buyer", my_forms_buyer, None),
+        ("api_login", login, None),
+        ("api_buyer_suggestions", buyer_suggestions, None),
+    ]
+    return scenarios
+
+
+def startup_probe(args):
+    """子 process：量測 import app 與第一個 /healthz 請求的時間，以一行 JSON 輸出。"""
+    started = time.perf_counter()
+    app_module = load_app(args)
+    imported = time.perf_counter()
+    response = app_module.app.test_client().get("/healthz")
+    finished = time.perf_counter()
+    print(json.dumps({
+        "import_ms": round((imported - started) * 1000, 2),
+        "first_healthz_ms": round((finished - imported) * 1000, 2),
+        "healthz_status": response.status_code,
+    }))
+
+
+def measure_startup(args, argv):
+    """重複啟動全新的 Python process；total_ms 另外包含直譯器啟動與 import benchmark.py 的時間。"""
+    command = [sys.executable, os.path.abspath(__file__), STARTUP_PROBE, *[a for a in argv if a != "--startup"]]
+    samples = []
+    for _ in range(args.startup_runs):
+        started = time.perf_counter()
+        proc = subprocess.run(command, capture_output=True, text=True)
+        total_ms = (time.perf_counter() - started) * 1000
+        if proc.returncode != 0:
+            sys.exit(f"啟動量測失敗：\n{proc.stderr}")
+        sample = json.loads(proc.stdout.strip().splitlines()[-1])
+        sample["total_ms"] = round(total_ms, 2)
+        samples.append(sample)
+        print(f"startup import={sample['import_ms']:.1f}ms healthz={sample['first_healthz_ms']:.1f}ms "
+              f"({sample['healthz_status']}) total={sample['total_ms']:.1f}ms", file=sys.stderr)
+
+    def summary(key):
+        values = sorted(s[key] for s in samples)
+        return {"p50_ms": round(percentile(values, 50), 2), "max_ms": round(values[-1], 2)}
+
+    return {
+        "runs": len(samples),
+        "import": summary("import_ms"),
+        "first_healthz": summary("first_healthz_ms"),
+        "total": summary("total_ms"),
+        "healthz_statuses": sorted({s["healthz_status"] for s in samples}),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline_path, threshold):
+    """回傳 p95 變慢超過 threshold 的情境清單。"""
+    with open(baseline_path, encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    old = {(r["scenario"], r["form_rows"]): r for r in baseline.get("results", [])}
+    regressions = []
+    if report.get("startup") and baseline.get("startup"):
+        before, after = baseline["startup"]["total"]["p50_ms"], report["startup"]["total"]["p50_ms"]
+        change = (after - before) / before
+        if change > threshold:
+            regressions.append({"scenario": "startup", "form_rows": None, "p50_before_ms": before,
+                                "p50_after_ms": after, "change": round(change, 3)})
+    for r in report.get("results", []):
+        before = old.get((r["scenario"], r["form_rows"]))
+        if not before or not before.get("p95_ms"):
+            continue
+        change = (r["p95_ms"] - before["p95_ms"]) / before["p95_ms"]
+        if change > threshold:
+            regressions.append({
+                "scenario": r["scenario"], "form_rows": r["form_rows"],
+                "p95_before_ms": before["p95_ms"], "p95_after_ms": r["p95_ms"],
+                "change": round(change, 3),
+            })
+    return regressions
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    args = parse_args(argv)
+    if args.startup_probe:
+        startup_probe(args)
+        return 0
+
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "backend": backend_name(args),
+    }
+    if args.startup:
+        report = {"meta": meta, "startup": measure_startup(args, argv)}
+    else:
+        app_module = load_app(args)
+        started = time.perf_counter()
+        data = seed(app_module, args)
+        seed_seconds = time.perf_counter() - started
+
+        results = []
+        for name, make_request, rows in build_scenarios(app_module, data):
+            result = run_scenario(app_module, name, make_request, args, rows)
+            results.append(result)
+            print(f"{name:<32} rows={rows!s:<6} p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms "
+                  f"rps={result['throughput_rps']} errors={result['errors']}", file=sys.stderr)
+
+        meta.update({
+            "sizes": args.sizes,
+            "buyers": args.buyers,
+            "sellers": args.sellers,
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "seed": args.seed,
+            "seed_seconds": round(seed_seconds, 2),
+        })
+        report = {"meta": meta, "results": results}
+
+    exit_code = 0
+    if args.compare:
+        report["regressions"] = compare(report, args.compare, args.threshold)
+        if report["regressions"]:
+            exit_code = 1
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,33 @@
-from pymongo import MongoClient
+"""資料庫設定（由環境變數讀取，不在 import 時建立連線）。
 
-# 本機 MongoDB 範例（如果你用 Atlas，請改成你的連線字串）
-client = MongoClient("mongodb://localhost:27017/")
+STORAGE_BACKEND=mongo：MongoDB（MONGO_URI，例如 Atlas 的連線字串；MONGO_DB_NAME 資料庫名稱）
+STORAGE_BACKEND=sqlite：本機 SQLite 檔案（SQLITE_PATH），不需要資料庫伺服器
 
-db = client['nosql_assignment_db']
-collection = db['forms']   # 後面會放 form documents
-users = db['users']       # 儲存使用者
+MongoClient 的連線池、逾時與 read preference 也由環境變數設定；未設定的項目使用下列預設值，
+逾時比 pymongo 預設（選擇伺服器 30 秒、建立連線 20 秒）短，資料庫無法連線時請求很快失敗。
+"""
+import os
+
+
+def _int_env(name, default=None):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo").lower()
+
+MONGO_URI = os.environ.get("MONGO_URI")
+# MONGO_DB_NAME 讓基準測試等工具使用獨立的資料庫
+MONGO_DB_NAME = os.environ.get("MONGO_DB_NAME", "datasys114")
+
+# 每個 worker process 的連線池大小
+MONGO_MAX_POOL_SIZE = _int_env("MONGO_MAX_POOL_SIZE", 100)
+MONGO_MIN_POOL_SIZE = _int_env("MONGO_MIN_POOL_SIZE", 0)
+# 逾時（毫秒）；MONGO_SOCKET_TIMEOUT_MS 未設定時不限制單一指令的時間
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _int_env("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+MONGO_CONNECT_TIMEOUT_MS = _int_env("MONGO_CONNECT_TIMEOUT_MS", 5000)
+MONGO_SOCKET_TIMEOUT_MS = _int_env("MONGO_SOCKET_TIMEOUT_MS")
+# primary / primaryPreferred / secondary / secondaryPreferred / nearest
+MONGO_READ_PREFERENCE = os.environ.get("MONGO_READ_PREFERENCE", "primary")
+
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "orders.sqlite3")
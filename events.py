@@ -0,0 +1,262 @@
+"""表單即時事件（Server-Sent Events）的發布 / 訂閱。
+
+訂單異動的 API 呼叫 publish()，/api/events 的串流以 subscribe() 接收並依買家 email 過濾。
+每個事件帶有遞增的 id，斷線重連時瀏覽器會送 Last-Event-ID，由 replay() 補送錯過的事件；
+太舊、已不在緩衝區內的 id 會收到 reset 事件，前端改為重新載入整張表單。
+
+- MemoryEventBackend：單一 process 內的 pub/sub（開發或單 worker 部署）。
+- MongoEventBackend：事件寫入 capped collection，各 worker 以 tailable cursor 讀取，
+  多個 gunicorn worker 之間也能互相收到事件。
+
+以 EVENT_BACKEND=memory|mongo 選擇（mongo 需搭配 STORAGE_BACKEND=mongo）。
+每個 process 同時開啟的串流數由 StreamLimiter 限制（EVENT_MAX_STREAMS），超過時 /api/events 回傳 503。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from bson.objectid import ObjectId
+from pymongo import CursorType
+
+logger = logging.getLogger("order_app")
+
+# 每張表單保留在記憶體中、供重連補送的事件數
+REPLAY_BUFFER = 500
+
+
+class Subscription:
+    """單一 SSE 連線的事件佇列；佇列滿（用戶端太慢）時標記 overflowed，改送 reset。"""
+
+    def __init__(self, form_id, maxsize=1000):
+        self.form_id = form_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class MemoryEventBackend:
+    """process 內的 pub/sub，事件 id 為遞增整數（字串形式）。"""
+
+    def __init__(self, replay_buffer=REPLAY_BUFFER):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._buffers = {}
+        self._subscribers = {}
+        self.replay_buffer = replay_buffer
+
+    def publish(self, form_id, event):
+        with self._lock:
+            self._seq += 1
+            event = dict(event, id=str(self._seq), form_id=form_id)
+        self._deliver(event)
+        return event["id"]
+
+    def _deliver(self, event):
+        """放入重連緩衝區並轉送給這張表單的訂閱者。"""
+        with self._lock:
+            self._buffers.setdefault(event["form_id"], deque(maxlen=self.replay_buffer)).append(event)
+            subscribers = list(self._subscribers.get(event["form_id"], ()))
+        for sub in subscribers:
+            sub.put(event)
+
+    def subscribe(self, form_id):
+        sub = Subscription(form_id)
+        with self._lock:
+            self._subscribers.setdefault(form_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.form_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.form_id]
+
+    def replay(self, form_id, last_id):
+        """回傳 last_id 之後的事件；last_id 已不在緩衝區時回傳 None（需要 reset）。"""
+        with self._lock:
+            buffered = list(self._buffers.get(form_id, ()))
+        if not buffered:
+            return []
+        ids = [e["id"] for e in buffered]
+        if last_id in ids:
+            return buffered[ids.index(last_id) + 1:]
+        if self._is_older(last_id, ids[0]):
+            return None
+        return []
+
+    def _is_older(self, last_id, oldest_id):
+        try:
+            return int(last_id) < int(oldest_id)
+        except ValueError:
+            return True
+
+
+class MongoEventBackend(MemoryEventBackend):
+    """事件寫入 capped collection，背景 thread 以 tailable cursor 轉送給本 process 的訂閱者。
+
+    事件 id 為 ObjectId 字串；重連時直接查詢 collection 補送，不受記憶體緩衝區限制。
+    """
+
+    def __init__(self, db, collection="form_events", size_bytes=16 * 1024 * 1024):
+        super().__init__()
+        # 建立時不連線；capped collection 在第一次 publish / subscribe 時才確認存在
+        self.db = db
+        self.collection = collection
+        self.size_bytes = size_bytes
+        self.events = db[collection]
+        self._collection_ready = False
+        self._thread = None
+        self._pid = None
+
+    def _ensure_collection(self):
+        if self._collection_ready:
+            return
+        if self.collection not in self.db.list_collection_names():
+            try:
+                self.db.create_collection(self.collection, capped=True, size=self.size_bytes)
+            except Exception:
+                # 其他 worker 同時建立了 collection
+                pass
+        self._collection_ready = True
+
+    def publish(self, form_id, event):
+        self._ensure_collection()
+        doc = dict(event, _id=ObjectId(), form_id=form_id)
+        self.events.insert_one(doc)
+        self._ensure_tailer()
+        return str(doc["_id"])
+
+    def subscribe(self, form_id):
+        self._ensure_collection()
+        self._ensure_tailer()
+        return super().subscribe(form_id)
+
+    def replay(self, form_id, last_id):
+        self._ensure_collection()
+        try:
+            oid = ObjectId(last_id)
+        except Exception:
+            return None
+        oldest = self.events.find_one({}, {"_id": 1}, sort=[("$natural", 1)])
+        if oldest and oid < oldest["_id"]:
+            return None
+        return [self._to_event(d) for d in self.events.find({"form_id": form_id, "_id": {"$gt": oid}}).sort("$natural", 1)]
+
+    def _to_event(self, doc):
+        doc = dict(doc)
+        doc["id"] = str(doc.pop("_id"))
+        return doc
+
+    def _ensure_tailer(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._tail, name="form-events", daemon=True)
+            self._thread.start()
+
+    def _tail(self):
+        last = ObjectId()
+        while True:
+            try:
+                cursor = self.events.find({"_id": {"$gt": last}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    for doc in cursor:
+                        last = doc["_id"]
+                        self._deliver(self._to_event(doc))
+            except Exception:
+                logger.exception("表單事件 tailable cursor 中斷，稍後重試")
+            time.sleep(1)
+
+
+class StreamLimiter:
+    """限制一個 process 同時開啟的 SSE 串流數：每條串流佔用一個 worker thread，不能讓串流佔滿所有 thread。"""
+
+    def __init__(self, max_streams):
+        self.max_streams = max_streams
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.active >= self.max_streams:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def render_metrics(self):
+        return (
+            "# TYPE event_streams_active gauge\n"
+            f"event_streams_active {self.active}\n"
+            "# TYPE event_streams_rejected_total counter\n"
+            f"event_streams_rejected_total {self.rejected}\n"
+        )
+
+
+def create_event_backend(db=None):
+    """db 為 MongoDB database（storage 的 MongoDatabase，建立時不連線）；使用 SQLite 儲存時為 None，只能使用 memory。"""
+    name = os.environ.get("EVENT_BACKEND", "memory").lower()
+    if name == "mongo":
+        if db is None:
+            logger.warning("EVENT_BACKEND=mongo 需要 MongoDB 儲存，改用 memory")
+            return MemoryEventBackend()
+        return MongoEventBackend(db)
+    return MemoryEventBackend()
+
+
+# ---------------- 事件內容 ----------------
+def row_events(old_row=None, new_row=None):
+    """把一筆訂單的異動轉成事件；買家 email 改變時，舊買家收到 row_deleted、新買家收到 row_added。"""
+    def clean(row):
+        return {k: v for k, v in row.items() if k != "form_id"}
+
+    if old_row is None:
+        return [{"type": "row_added", "audience": [new_row.get("buyer_email")], "row": clean(new_row)}]
+    if new_row is None:
+        return [{"type": "row_deleted", "audience": [old_row.get("buyer_email")], "row_id": old_row["_id"]}]
+    if old_row.get("buyer_email") != new_row.get("buyer_email"):
+        return [
+            {"type": "row_deleted", "audience": [old_row.get("buyer_email")], "row_id": old_row["_id"]},
+            {"type": "row_added", "audience": [new_row.get("buyer_email")], "row": clean(new_row)},
+        ]
+    return [{"type": "row_updated", "audience": [new_row.get("buyer_email")], "row": clean(new_row)}]
+
+
+def event_visible(event, email, is_owner):
+    """賣家收到所有事件；買家只收到 audience 含自己 email 的事件（audience 為 None 代表所有人）。"""
+    if is_owner:
+        return True
+    audience = event.get("audience")
+    return audience is None or email in audience
+
+
+def event_payload(event, is_owner):
+    """送給用戶端的內容：去掉 audience，買家看不到 buyer_social。"""
+    payload = {k: v for k, v in event.items() if k not in ("audience", "id", "form_id")}
+    if not is_owner and "row" in payload:
+        payload["row"] = {k: v for k, v in payload["row"].items() if k != "buyer_social"}
+    return payload
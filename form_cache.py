@@ -0,0 +1,189 @@
+"""表單讀取快取：賣家在 api_get_form 讀取整張表單時所需的內容依 (表單 id, 版本號) 快取。
+
+賣家管理訂單時會反覆重新整理、排序與切換分頁。
+每個會改變表單內容的 API 都經過 forms.touch 或 viewers.add / remove 遞增版本號，
+讀取時以權限檢查讀到的版本號查詢，版本不同即為未命中，不需要另外清除。
+
+每筆快取是一個版本的表單快照：檢視者名單、買家統計與全部訂單。
+沒有篩選條件時的排序與分頁都在 process 內由快照產生，所以同一個版本只需要讀一次資料庫；
+買家與有篩選條件的讀取不使用快取，由資料庫以索引只讀取需要的訂單。
+訂單超過 FORM_CACHE_MAX_ROWS 筆的表單只快取訂單以外的部分（rows 為 None）。
+
+- MemoryFormCache：process 內的 LRU，總大小上限 FORM_CACHE_MAX_BYTES（以序列化後的大小估算）、存活時間 FORM_CACHE_TTL_SECONDS。
+- RedisFormCache：多個 gunicorn worker 共用（需安裝 redis 套件，連線字串 REDIS_URL），
+  快照序列化後存入，每筆以 FORM_CACHE_TTL_SECONDS 過期，總大小由 Redis 的 maxmemory 設定限制。
+
+以 FORM_CACHE_BACKEND=memory|redis|none 選擇；命中 / 未命中次數由 /metrics 輸出。
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # 未安裝時只能使用 memory
+    redis = None
+
+from responses import dumps, loads
+
+logger = logging.getLogger("order_app")
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 60
+DEFAULT_MAX_ROWS = 5000
+# 單筆超過總大小的這個比例就不快取，避免一個大表單把其他表單全部擠出去
+MAX_ITEM_FRACTION = 16
+
+
+class _CacheCounters:
+    # 快照最多包含的訂單數；超過時只快取訂單以外的部分
+    max_rows = DEFAULT_MAX_ROWS
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def render_metrics(self):
+        """輸出 Prometheus 文字格式（接在 RequestMetrics.render() 之後）。"""
+        return "\n".join([
+            "# TYPE form_cache_requests_total counter",
+            f'form_cache_requests_total{{backend="{self.name}",result="hit"}} {self.hits}',
+            f'form_cache_requests_total{{backend="{self.name}",result="miss"}} {self.misses}',
+            "# TYPE form_cache_evictions_total counter",
+            f'form_cache_evictions_total{{backend="{self.name}"}} {self.evictions}',
+        ]) + "\n"
+
+
+class NullFormCache(_CacheCounters):
+    """FORM_CACHE_BACKEND=none：不快取。"""
+
+    name = "none"
+    enabled = False
+
+    def get(self, form_id, version):
+        return None
+
+    def set(self, form_id, version, snapshot):
+        pass
+
+
+class MemoryFormCache(_CacheCounters):
+    """process 內的 LRU：每張表單只保留一個版本的快照，寫入新版本即取代舊版本。
+
+    快照以物件保存（命中時不需反序列化），呼叫端不可修改取出的內容。
+    """
+
+    name = "memory"
+    enabled = True
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL_SECONDS):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, form_id, version):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(form_id)
+            if entry is not None and entry[0] == version and entry[1] > now:
+                self._entries.move_to_end(form_id)
+                self.hits += 1
+                return entry[2]
+            if entry is not None and (entry[0] < version or entry[1] <= now):
+                # 較新的版本不移除：讀到舊版本號的請求可能比寫入新快照的請求晚到
+                self._remove(form_id)
+            self.misses += 1
+        return None
+
+    def set(self, form_id, version, snapshot):
+        size = len(dumps(snapshot))
+        if size > self.max_bytes // MAX_ITEM_FRACTION:
+            return
+        with self._lock:
+            entry = self._entries.get(form_id)
+            if entry is not None and entry[0] > version:
+                return
+            self._remove(form_id)
+            self._entries[form_id] = (version, time.monotonic() + self.ttl, snapshot, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, form_id):
+        entry = self._entries.pop(form_id, None)
+        if entry is not None:
+            self.bytes -= entry[3]
+
+    def render_metrics(self):
+        return super().render_metrics() + (
+            "# TYPE form_cache_bytes gauge\n"
+            f'form_cache_bytes{{backend="memory"}} {self.bytes}\n'
+        )
+
+
+class RedisFormCache(_CacheCounters):
+    """多個 worker 共用的快取：key 含版本號，舊版本不需刪除，過期後由 Redis 回收。
+
+    Redis 無法連線時視為未命中（請求照常查詢資料庫），並記錄 warning。
+    """
+
+    name = "redis"
+    enabled = True
+
+    def __init__(self, url, ttl=DEFAULT_TTL_SECONDS, prefix="form_cache:"):
+        super().__init__()
+        # 建立時不連線；redis-py 的連線池在 fork 後會重新建立連線
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, form_id, version):
+        return f"{self.prefix}{form_id}:{version}"
+
+    def get(self, form_id, version):
+        try:
+            value = self.client.get(self._key(form_id, version))
+        except redis.RedisError as e:
+            logger.warning("表單快取讀取失敗", extra={"fields": {"backend": "redis", "error": str(e)}})
+            value = None
+        self.count(value is not None)
+        return loads(value) if value is not None else None
+
+    def set(self, form_id, version, snapshot):
+        try:
+            self.client.set(self._key(form_id, version), dumps(snapshot), ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning("表單快取寫入失敗", extra={"fields": {"backend": "redis", "error": str(e)}})
+
+
+def create_form_cache():
+    """依 FORM_CACHE_BACKEND 建立快取（預設 memory）；redis 未安裝或未設定 REDIS_URL 時改用 memory。"""
+    name = os.environ.get("FORM_CACHE_BACKEND", "memory").lower()
+    ttl = int(os.environ.get("FORM_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+    if name == "none" or ttl <= 0:
+        return NullFormCache()
+    cache = None
+    if name == "redis":
+        url = os.environ.get("REDIS_URL")
+        if redis is not None and url:
+            cache = RedisFormCache(url, ttl)
+        else:
+            logger.warning("FORM_CACHE_BACKEND=redis 需要安裝 redis 套件並設定 REDIS_URL，改用 memory")
+    if cache is None:
+        cache = MemoryFormCache(int(os.environ.get("FORM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)), ttl)
+    cache.max_rows = int(os.environ.get("FORM_CACHE_MAX_ROWS", DEFAULT_MAX_ROWS))
+    return cache
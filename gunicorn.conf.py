@@ -0,0 +1,19 @@
+"""gunicorn 設定（gunicorn 會自動讀取目前目錄的 gunicorn.conf.py）。
+
+    gunicorn app:app
+
+- preload_app：master import 一次 app 再 fork 出 worker，worker 啟動不需要重新 import。
+  import app 不會連線資料庫，MongoClient / SQLite 連線在各 worker 第一次使用時才建立。
+- gthread worker：SSE 串流（/api/events）每條連線佔用一個 thread；每個 worker 最多 EVENT_MAX_STREAMS 條，
+  其餘 thread 留給一般請求，EVENT_MAX_STREAMS 應小於 GUNICORN_THREADS。
+- 部署平台的 readiness probe 指向 /healthz（資料庫無法連線或缺少 unique 索引時回 503）。
+"""
+import os
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+# 關閉時等待進行中的請求；SSE 串流會在 EVENT_STREAM_MAX_SECONDS 內結束並由瀏覽器重連
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
@@ -0,0 +1,155 @@
+"""MongoDB 索引定義、建立與檢查。
+
+部署時執行 `flask --app app create-indexes` 建立索引（可重複執行）；索引不在請求處理中建立，
+大型 collection 建立索引需要時間，建立失敗也不應讓所有讀寫跟著失敗。
+已有重複資料（例如舊版註冊的競態留下的重複 email）時 unique 索引無法建立，
+先以 `create-indexes --dedupe` 合併重複資料再建立。
+
+`flask --app app check-indexes` 會對每個常用查詢執行 explain()，
+只要有任何一個查詢使用 COLLSCAN（全表掃描）就以非 0 結束，方便放在 CI / 部署流程。
+/healthz 以 missing_indexes 確認索引已建立：缺少 unique 索引時回 503。
+"""
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+# collection 名稱 -> 需要的索引
+INDEXES = {
+    "users": [
+        # 登入、註冊、忘記密碼都以 email 查詢；unique 讓重複註冊由資料庫擋下
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "forms": [
+        IndexModel([("owner_id", ASCENDING), ("_id", ASCENDING)], name="owner_id_id"),
+        IndexModel([("allowed_viewers", ASCENDING), ("_id", ASCENDING)], name="allowed_viewers_id"),
+    ],
+    "order_rows": [
+        IndexModel([("form_id", ASCENDING), ("_id", ASCENDING)], name="form_id_row_id"),
+        IndexModel(
+            [("form_id", ASCENDING), ("buyer_email", ASCENDING), ("_id", ASCENDING)],
+            name="form_id_buyer_email_row_id"
+        ),
+        # 訂單搜尋：search_keys 為陣列（multikey 索引），以 $all 比對搜尋字串的每個片段
+        IndexModel([("form_id", ASCENDING), ("search_keys", ASCENDING)], name="form_id_search_keys"),
+    ],
+    "order_archive": [
+        # 封存資料依 last_id 排序且互不重疊：歷史訂單分頁與封存時找出重疊的資料都走這個索引
+        IndexModel([("form_id", ASCENDING), ("last_id", ASCENDING)], name="form_id_last_id"),
+    ],
+    "buyer_summaries": [
+        IndexModel(
+            [("form_id", ASCENDING), ("buyer_name", ASCENDING), ("buyer_email", ASCENDING)],
+            name="form_id_buyer", unique=True
+        ),
+    ],
+    "daily_rollups": [
+        # 賣家報表以 form_id $in + day 範圍查詢；唯一鍵也是增量 $inc upsert 的條件
+        IndexModel(
+            [("form_id", ASCENDING), ("day", ASCENDING), ("buyer_name", ASCENDING),
+             ("buyer_email", ASCENDING), ("item_name", ASCENDING)],
+            name="form_id_day_buyer_item", unique=True
+        ),
+    ],
+    "buyer_directory": [
+        IndexModel([("owner_id", ASCENDING), ("email", ASCENDING)], name="owner_id_email", unique=True),
+        # 自動完成與超過上限時的刪除都依排名由高到低讀取
+        IndexModel([("owner_id", ASCENDING), ("score", DESCENDING)], name="owner_id_score"),
+    ],
+    "mail_jobs": [
+        # 寄信 worker 依狀態與下次寄送時間領取工作
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt"),
+        IndexModel([("status", ASCENDING), ("locked_until", ASCENDING)], name="status_locked_until"),
+        # 同一個 dedupe_key 只能有一筆 pending 工作；沒有 dedupe_key 的工作不列入（缺少的欄位在 unique 索引中視為 null）
+        IndexModel(
+            [("dedupe_key", ASCENDING)], name="pending_dedupe_key", unique=True,
+            partialFilterExpression={"status": "pending", "dedupe_key": {"$exists": True}}
+        ),
+    ],
+}
+
+# 已改名或改變條件的舊索引：create-indexes 時刪除（同名但選項不同的索引無法直接重建）
+OBSOLETE_INDEXES = {
+    "mail_jobs": ["dedupe_key_pending"],
+}
+
+_SAMPLE_ID = ObjectId()
+_SAMPLE_EMAIL = "index-check@example.com"
+
+# (說明, collection, filter, sort) —— app.py 中最常執行的查詢
+HOT_QUERIES = [
+    ("登入 / 註冊：users by email", "users", {"email": _SAMPLE_EMAIL}, None),
+    ("Dashboard：forms by owner_id", "forms", {"owner_id": str(_SAMPLE_ID)}, [("_id", ASCENDING)]),
+    ("Dashboard：forms by allowed_viewers", "forms", {"allowed_viewers": _SAMPLE_EMAIL}, [("_id", ASCENDING)]),
+    ("Dashboard：owned 或 viewable ($or)", "forms",
+     {"$or": [{"owner_id": str(_SAMPLE_ID)}, {"allowed_viewers": _SAMPLE_EMAIL}]}, [("_id", ASCENDING)]),
+    ("賣家讀取訂單", "order_rows", {"form_id": str(_SAMPLE_ID)}, [("_id", ASCENDING)]),
+    ("買家讀取自己的訂單", "order_rows",
+     {"form_id": str(_SAMPLE_ID), "buyer_email": _SAMPLE_EMAIL}, [("_id", ASCENDING)]),
+    ("訂單搜尋：search_keys", "order_rows",
+     {"form_id": str(_SAMPLE_ID), "search_keys": {"$all": ["ab", "bc"]}}, [("_id", ASCENDING)]),
+    ("買家統計", "buyer_summaries", {"form_id": str(_SAMPLE_ID)}, None),
+    ("買家名錄：buyer_directory by owner_id / score", "buyer_directory",
+     {"owner_id": str(_SAMPLE_ID), "$or": [{"email": {"$regex": "^ab", "$options": "i"}},
+                                           {"name": {"$regex": "^ab", "$options": "i"}}]},
+     [("score", DESCENDING)]),
+    ("歷史訂單：order_archive by form_id / last_id", "order_archive",
+     {"form_id": str(_SAMPLE_ID), "last_id": {"$gt": ""}}, [("last_id", ASCENDING)]),
+    ("賣家報表：daily_rollups by form_id / day", "daily_rollups",
+     {"form_id": {"$in": [str(_SAMPLE_ID)]}, "day": {"$gte": "2000-01-01"}}, None),
+    ("寄信 worker 領取工作", "mail_jobs",
+     {"$or": [{"status": "pending", "next_attempt_at": {"$lte": datetime(2000, 1, 1)}},
+              {"status": "sending", "locked_until": {"$lte": datetime(2000, 1, 1)}}]},
+     [("next_attempt_at", ASCENDING)]),
+]
+
+
+def ensure_indexes(db):
+    """建立所有宣告的索引；索引已存在時 create_indexes 不會重建。"""
+    for name, obsolete in OBSOLETE_INDEXES.items():
+        existing = db[name].index_information()
+        for idx in obsolete:
+            if idx in existing:
+                db[name].drop_index(idx)
+    created = []
+    for name, models in INDEXES.items():
+        created.extend(f"{name}.{idx}" for idx in db[name].create_indexes(models))
+    return created
+
+
+def missing_indexes(db):
+    """回傳尚未建立的索引 [(collection.索引名稱, 是否為 unique)]；只讀取 index_information，不建立索引。"""
+    missing = []
+    for name, models in INDEXES.items():
+        existing = db[name].index_information()
+        for model in models:
+            if model.document["name"] not in existing:
+                missing.append((f"{name}.{model.document['name']}", bool(model.document.get("unique"))))
+    return missing
+
+
+def _plan_stages(plan):
+    """遞迴收集 explain 結果中所有的 stage 名稱。"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+def check_indexes(db):
+    """對每個常用查詢執行 explain()，回傳 [(說明, 是否通過, stages)]。"""
+    results = []
+    for description, collection, query, sort in HOT_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = _plan_stages(plan)
+        results.append((description, "COLLSCAN" not in stages, stages))
+    return results
@@ -0,0 +1,186 @@
+"""寄信佇列：請求只負責把郵件寫入資料庫的 mail_jobs，由背景 worker 寄出。
+
+- worker 持有一條已 STARTTLS + login 的 SMTP 連線重複使用，閒置太久或斷線才重連。
+- 寄送失敗以指數退避重試，超過 MAIL_MAX_ATTEMPTS 次標記為 failed。
+- 工作保存在資料庫，重新啟動後未完成（pending，或 sending 但鎖已過期）的工作會繼續寄出；
+  多個 gunicorn worker 原子地領取工作，不會重複寄送（MongoDB / SQLite 的工作保存方式
+  在 storage 的 mail_jobs，見 storage/mongo.py、storage/sqlite.py）。
+- 同一個 dedupe_key（例如同一個 email 的重設密碼信）只保留一筆 pending 工作，
+  連續大量請求不會讓佇列無限成長。
+"""
+import logging
+import os
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+
+logger = logging.getLogger("order_app")
+
+class SMTPSettings:
+    """SMTP 連線設定，預設讀取環境變數。"""
+
+    def __init__(self, host=None, port=None, user=None, password=None, from_email=None, use_tls=None):
+        self.host = host or os.environ.get("SMTP_HOST", "smtp.gmail.com")
+        self.port = int(port or os.environ.get("SMTP_PORT", 587))
+        self.user = user if user is not None else os.environ.get("SMTP_USER")
+        self.password = password if password is not None else os.environ.get("SMTP_PASS")
+        self.from_email = from_email or os.environ.get("FROM_EMAIL", self.user)
+        if use_tls is None:
+            use_tls = os.environ.get("SMTP_STARTTLS", "1") != "0"
+        self.use_tls = use_tls
+
+    @property
+    def configured(self):
+        # 本機測試用的 SMTP 不需要帳號密碼，只要有寄件者即可
+        return bool(self.host and self.from_email)
+
+
+class PooledSMTP:
+    """重複使用同一條 SMTP 連線；閒置超過 idle_seconds 先以 NOOP 確認仍可用。"""
+
+    def __init__(self, settings, idle_seconds=60, timeout=10):
+        self.settings = settings
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        self._conn = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        s = self.settings
+        conn = smtplib.SMTP(s.host, s.port, timeout=self.timeout)
+        if s.use_tls:
+            conn.starttls()
+        if s.user and s.password:
+            conn.login(s.user, s.password)
+        return conn
+
+    def _connection(self):
+        if self._conn is not None and time.monotonic() - self._last_used > self.idle_seconds:
+            try:
+                if self._conn.noop()[0] != 250:
+                    self.close()
+            except smtplib.SMTPException:
+                self.close()
+            except OSError:
+                self.close()
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def send(self, to, subject, body):
+        msg = MIMEText(body, "plain", "utf-8")
+        msg["Subject"] = subject
+        msg["From"] = self.settings.from_email
+        msg["To"] = to
+        try:
+            self._connection().sendmail(self.settings.from_email, [to], msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # 伺服器已關閉閒置連線：重連一次再寄
+            self.close()
+            self._connection().sendmail(self.settings.from_email, [to], msg.as_string())
+        except smtplib.SMTPException:
+            # SMTPException 也是 OSError：伺服器拒收（4xx / 5xx）交給佇列退避重試，不重寄
+            raise
+        except OSError:
+            # 連線層錯誤（連線被重設等）：重連一次再寄
+            self.close()
+            self._connection().sendmail(self.settings.from_email, [to], msg.as_string())
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._conn = None
+
+
+class MailQueue:
+    """寄信佇列與背景 worker；jobs 為 storage 的 mail_jobs（enqueue / claim / mark_*）。"""
+
+    def __init__(self, jobs, settings=None, max_attempts=None, base_delay=None,
+                 poll_seconds=None, lock_seconds=120, in_process=None):
+        self.jobs = jobs
+        self.settings = settings or SMTPSettings()
+        self.max_attempts = int(max_attempts or os.environ.get("MAIL_MAX_ATTEMPTS", 6))
+        self.base_delay = float(base_delay or os.environ.get("MAIL_RETRY_BASE_SECONDS", 5))
+        self.poll_seconds = float(poll_seconds or os.environ.get("MAIL_POLL_SECONDS", 5))
+        self.lock_seconds = lock_seconds
+        # MAIL_WORKER_IN_PROCESS=0：只寫入佇列，由 `flask mail-worker` 另外寄送
+        if in_process is None:
+            in_process = os.environ.get("MAIL_WORKER_IN_PROCESS", "1") != "0"
+        self.in_process = in_process
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # ---------------- 寫入 ----------------
+    def enqueue(self, to, subject, body, dedupe_key=None):
+        """寫入一筆待寄郵件並喚醒 worker；有相同 dedupe_key 的 pending 工作時改為更新內容。"""
+        self.jobs.enqueue(to, subject, body, dedupe_key=dedupe_key)
+        self.ensure_worker()
+        self._wakeup.set()
+
+    # ---------------- 領取與寄送 ----------------
+    def _retry_delay(self, attempts):
+        return self.base_delay * (2 ** (attempts - 1))
+
+    def process_one(self, smtp):
+        """領取並寄出一筆工作；沒有可寄的工作時回傳 False。"""
+        job = self.jobs.claim(self.lock_seconds)
+        if not job:
+            return False
+        try:
+            smtp.send(job["to"], job["subject"], job["body"])
+        except Exception as e:
+            attempts = job.get("attempts", 1)
+            if attempts >= self.max_attempts:
+                self.jobs.mark_failed(job["_id"], str(e))
+                logger.error("郵件寄送失敗，已停止重試", extra={"fields": {"to": job["to"], "attempts": attempts, "error": str(e)}})
+            else:
+                delay = self._retry_delay(attempts)
+                self.jobs.mark_retry(job["_id"], str(e), delay)
+                logger.warning("郵件寄送失敗，稍後重試", extra={"fields": {"to": job["to"], "attempts": attempts, "retry_in": delay, "error": str(e)}})
+            return True
+
+        self.jobs.mark_sent(job["_id"])
+        logger.info("郵件寄送成功", extra={"fields": {"to": job["to"]}})
+        return True
+
+    def run(self, stop=None):
+        """worker 主迴圈：有工作就一直寄，沒有就等 enqueue 喚醒或 poll_seconds 逾時。"""
+        stop = stop or self._stop
+        smtp = PooledSMTP(self.settings)
+        try:
+            while not stop.is_set():
+                try:
+                    busy = self.process_one(smtp)
+                except Exception:
+                    logger.exception("寄信 worker 發生錯誤")
+                    busy = False
+                if not busy:
+                    self._wakeup.wait(self.poll_seconds)
+                    self._wakeup.clear()
+        finally:
+            smtp.close()
+
+    def ensure_worker(self):
+        """在目前的 process 啟動背景 thread（fork 後的子 process 會重新啟動自己的 thread）。"""
+        if not (self.in_process and self.settings.configured):
+            return
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.run, name="mail-queue", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
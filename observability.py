@@ -0,0 +1,216 @@
+"""結構化 logging 與 /metrics 所需的請求統計。
+
+- logging：以 JSON 一行一筆輸出，等級由 LOG_LEVEL 控制；密碼、token、雜湊值等欄位
+  一律遮蔽。逐筆訂單的 debug 訊息依 LOG_ROW_SAMPLE_RATE 抽樣，避免大表單拖慢請求。
+- metrics：每個路由的延遲 histogram、回應大小，以及透過 pymongo CommandListener
+  計算的每個請求 MongoDB round trip 次數，以 Prometheus 文字格式輸出。
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from pymongo import monitoring
+
+# 會被遮蔽的欄位名稱（比對時不分大小寫、只要包含即可）
+SECRET_KEYS = ("password", "passwd", "secret", "token", "hash", "authorization", "smtp_pass")
+REDACTED = "***"
+
+# 延遲 histogram 的上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# 每個請求 MongoDB round trip 次數的上界
+MONGO_OP_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def redact(value):
+    """遞迴遮蔽 dict / list 中名稱看起來像密碼或 token 的欄位。"""
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if any(s in str(k).lower() for s in SECRET_KEYS) else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """把 log 輸出成一行 JSON；extra={"fields": {...}} 會併入輸出並遮蔽機密欄位。"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(redact(fields))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(app):
+    """依 LOG_LEVEL 設定 app logger（預設 INFO），輸出到 stderr。"""
+    level = os.environ.get("LOG_LEVEL", "INFO").upper()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger("order_app")
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    app.config.setdefault("LOG_ROW_SAMPLE_RATE", float(os.environ.get("LOG_ROW_SAMPLE_RATE", 0.01)))
+    app.config.setdefault("SLOW_REQUEST_SECONDS", float(os.environ.get("SLOW_REQUEST_SECONDS", 1.0)))
+    return logger
+
+
+def log_sampled(logger, rate, msg, **fields):
+    """逐筆資料的 debug 訊息：未開啟 DEBUG 時完全不產生字串，開啟時也只抽樣 rate 比例。"""
+    if rate <= 0 or not logger.isEnabledFor(logging.DEBUG):
+        return
+    if rate >= 1 or random.random() < rate:
+        logger.debug(msg, extra={"fields": fields})
+
+
+# ---------------- MongoDB round trip 計數 ----------------
+class MongoCommandCounter(monitoring.CommandListener):
+    """以 thread-local 計數目前請求送出的 MongoDB 指令數。
+
+    同步版 pymongo 會在執行指令的 thread 上呼叫 listener，
+    因此 gunicorn sync / gthread worker 下每個請求的計數互不干擾。
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, "count", 0)
+
+    def started(self, event):
+        self._local.count = self.count + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# ---------------- 統計 ----------------
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class RequestMetrics:
+    """依 (method, 路由) 累計延遲、回應大小、MongoDB round trip 與狀態碼。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, method, route, status, seconds, response_bytes, mongo_ops):
+        key = (method, route)
+        with self._lock:
+            stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = {
+                    "latency": _Histogram(LATENCY_BUCKETS),
+                    "mongo_ops": _Histogram(MONGO_OP_BUCKETS),
+                    "bytes": 0,
+                    "status": {},
+                }
+            stats["latency"].observe(seconds)
+            stats["mongo_ops"].observe(mongo_ops)
+            stats["bytes"] += response_bytes
+            stats["status"][status] = stats["status"].get(status, 0) + 1
+
+    def render(self):
+        """輸出 Prometheus 文字格式。"""
+        lines = [
+            "# TYPE http_request_duration_seconds histogram",
+            "# TYPE http_request_mongo_ops histogram",
+            "# TYPE http_response_bytes_total counter",
+            "# TYPE http_requests_total counter",
+        ]
+        with self._lock:
+            items = sorted(self._routes.items())
+            for (method, route), stats in items:
+                labels = f'method="{method}",route="{route}"'
+                lines.extend(_render_histogram("http_request_duration_seconds", labels, stats["latency"]))
+                lines.extend(_render_histogram("http_request_mongo_ops", labels, stats["mongo_ops"]))
+                lines.append(f"http_response_bytes_total{{{labels}}} {stats['bytes']}")
+                for status, count in sorted(stats["status"].items()):
+                    lines.append(f'http_requests_total{{{labels},status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _render_histogram(name, labels, hist):
+    lines = [
+        f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+        for bound, count in zip(hist.buckets, hist.counts)
+    ]
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+    lines.append(f"{name}_sum{{{labels}}} {hist.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {hist.count}")
+    return lines
+
+
+def init_request_metrics(app, logger, metrics, mongo_counter):
+    """註冊 before/after_request hook：計時、計數 MongoDB 指令，並記錄慢請求。
+
+    串流回應（匯出）只計算到 headers 送出為止，body 大小以 Content-Length 為準（未知時為 0）。
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g._request_started = time.perf_counter()
+        mongo_counter.reset()
+
+    @app.after_request
+    def _record_request_metrics(response):
+        started = g.pop("_request_started", None)
+        if started is None:
+            return response
+        seconds = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        # calculate_content_length() 會把串流回應整個讀進記憶體（SSE 會卡到串流結束），串流只看 Content-Length
+        size = (response.content_length if response.is_streamed else response.calculate_content_length()) or 0
+        mongo_ops = mongo_counter.count
+        metrics.observe(request.method, route, response.status_code, seconds, size, mongo_ops)
+
+        fields = {
+            "method": request.method,
+            "route": route,
+            "status": response.status_code,
+            "duration_ms": round(seconds * 1000, 2),
+            "bytes": size,
+            "mongo_ops": mongo_ops,
+            "form_id": (request.view_args or {}).get("form_id"),
+        }
+        if seconds >= app.config["SLOW_REQUEST_SECONDS"]:
+            logger.warning("slow request", extra={"fields": fields})
+        else:
+            logger.debug("request", extra={"fields": fields})
+        return response
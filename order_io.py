@@ -0,0 +1,325 @@
+"""訂單匯入 / 匯出共用的欄位定義與解析函式。
+
+匯入時逐行讀取上傳內容（CSV 或 JSON Lines），匯出時由 MongoDB cursor 逐批產生
+CSV / XLSX 內容，兩者都不會把整份資料載入記憶體。
+"""
+import csv
+import io
+import json
+import math
+import zipfile
+from xml.sax.saxutils import escape
+
+# 訂單欄位與表單頁面上顯示的中文標題（匯入時兩者都接受）
+ROW_COLUMNS = [
+    ("buyer_name", "買家"),
+    ("buyer_email", "買家 Email"),
+    ("item_name", "物品名稱"),
+    ("item_qty", "數量"),
+    ("item_price", "單價"),
+    ("item_total", "須匯款金額"),
+    ("remittance", "已匯款"),
+    ("shipped", "出貨日期"),
+    ("shipping_fee", "運費"),
+    ("buyer_social", "買家社群"),
+]
+
+HEADER_ALIASES = {label: key for key, label in ROW_COLUMNS}
+HEADER_ALIASES.update({key: key for key, _ in ROW_COLUMNS})
+
+IMPORT_FORMATS = ("csv", "jsonl")
+EXPORT_FORMATS = ("csv", "xlsx")
+
+# 匯出時每累積多少筆訂單就送出一個 chunk
+EXPORT_CHUNK_ROWS = 200
+
+_TRUE_TEXT = {"1", "true", "yes", "y", "v", "✓", "是", "已匯款"}
+_FALSE_TEXT = {"", "0", "false", "no", "n", "x", "✗", "否", "未匯款"}
+
+
+class ImportRowError(ValueError):
+    """單行資料不合法，訊息會回傳給前端的逐行錯誤報告。"""
+
+
+def compute_item_total(item_qty, item_price, shipping_fee, merge_shipping):
+    """須匯款金額 = 數量 × 單價，表單設定併入運費時再加上運費。"""
+    item_total = item_qty * item_price
+    if merge_shipping:
+        item_total += shipping_fee
+    return item_total
+
+
+def detect_import_format(filename=None, content_type=None, requested=None):
+    """依參數、副檔名或 Content-Type 判斷上傳格式，無法判斷時預設為 CSV。"""
+    if requested:
+        fmt = requested.lower()
+        if fmt in ("json", "ndjson"):
+            fmt = "jsonl"
+        if fmt not in IMPORT_FORMATS:
+            raise ValueError("format 參數不合法（支援 csv、jsonl）")
+        return fmt
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    if "json" in (content_type or ""):
+        return "jsonl"
+    return "csv"
+
+
+def _iter_text_lines(stream):
+    """逐行讀取二進位串流並解碼（utf-8-sig 會去掉 Excel 加上的 BOM）。"""
+    for raw in iter(stream.readline, b""):
+        yield raw.decode("utf-8-sig")
+
+
+def iter_import_records(stream, fmt):
+    """逐行產生 (行號, dict)；無法解析的行以 ImportRowError 代替 dict。"""
+    text = _iter_text_lines(stream)
+    if fmt == "jsonl":
+        for line_no, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_no, ImportRowError("JSON 格式錯誤")
+                continue
+            if not isinstance(record, dict):
+                yield line_no, ImportRowError("每一行必須是 JSON 物件")
+                continue
+            yield line_no, record
+        return
+
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    keys = [HEADER_ALIASES.get(h.strip()) for h in header]
+    for values in reader:
+        if not any(v.strip() for v in values):
+            continue
+        record = {k: v for k, v in zip(keys, values) if k}
+        # 第 1 行是標題列
+        yield reader.line_num, record
+
+
+def _parse_number(record, key, default=0.0):
+    raw = record.get(key)
+    if raw is None or (isinstance(raw, str) and not raw.strip()):
+        return default
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        raise ImportRowError(f"{key} 必須是數字")
+    if not math.isfinite(value):
+        raise ImportRowError(f"{key} 必須是數字")
+    return value
+
+
+def parse_row_amounts(record, merge_shipping):
+    """數量、單價、運費與須匯款金額；新增、修改與匯入訂單共用同一套規則。
+
+    空白視為 0；不是數字或為負數時丟出 ImportRowError。
+    """
+    amounts = {key: _parse_number(record, key) for key in ("item_qty", "item_price", "shipping_fee")}
+    for key, value in amounts.items():
+        if value < 0:
+            raise ImportRowError(f"{key} 不可為負數")
+    amounts["item_total"] = compute_item_total(
+        amounts["item_qty"], amounts["item_price"], amounts["shipping_fee"], merge_shipping
+    )
+    return amounts
+
+
+def _parse_remittance(raw):
+    if isinstance(raw, bool):
+        return raw
+    if raw is None:
+        return False
+    text = str(raw).strip().lower()
+    if text in _TRUE_TEXT:
+        return True
+    if text in _FALSE_TEXT:
+        return False
+    raise ImportRowError("remittance 無法辨識")
+
+
+def _parse_text(record, key):
+    raw = record.get(key)
+    if raw is None:
+        return None
+    text = str(raw).strip()
+    return text or None
+
+
+def build_import_row(record, merge_shipping):
+    """驗證一行匯入資料並轉成訂單欄位（不含 _id）；規則與 api_add_row 相同。"""
+    buyer_name = _parse_text(record, "buyer_name")
+    buyer_email = _parse_text(record, "buyer_email")
+    item_name = _parse_text(record, "item_name")
+    missing = [k for k, v in (("buyer_name", buyer_name), ("buyer_email", buyer_email), ("item_name", item_name)) if not v]
+    if missing:
+        raise ImportRowError("缺少欄位: " + ", ".join(missing))
+
+    amounts = parse_row_amounts(record, merge_shipping)
+
+    return {
+        "buyer_name": buyer_name,
+        "buyer_email": buyer_email,
+        "item_name": item_name,
+        "item_qty": amounts["item_qty"],
+        "item_price": amounts["item_price"],
+        "item_total": amounts["item_total"],
+        "remittance": _parse_remittance(record.get("remittance")),
+        "shipped": _parse_text(record, "shipped"),
+        "shipping_fee": amounts["shipping_fee"],
+        "buyer_social": _parse_text(record, "buyer_social"),
+    }
+
+
+# ---------------- 匯出 ----------------
+def export_columns(fields, is_owner):
+    """依表單 fields 設定決定匯出欄位，規則與 form.html 的表格欄位相同。"""
+    keys = ["buyer_name", "buyer_email", "item_name", "item_qty", "item_price", "item_total"]
+    if fields.get("remittance"):
+        keys.append("remittance")
+    if fields.get("shipped"):
+        keys.append("shipped")
+    if fields.get("shipping_fee"):
+        keys.append("shipping_fee")
+    if fields.get("buyer_social") and is_owner:
+        keys.append("buyer_social")
+    labels = dict(ROW_COLUMNS)
+    return [(k, labels[k]) for k in keys]
+
+
+def _export_value(row, key):
+    value = row.get(key)
+    if key == "remittance":
+        return "✓" if value else "✗"
+    if value is None:
+        return ""
+    return value
+
+
+# 試算表會把這些字元開頭的儲存格當成公式執行（CSV injection）
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_safe(value):
+    """買家填寫的文字（例如 =HYPERLINK(...)）前面加上 '，試算表只會當成文字顯示；數字不變。"""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv_export(rows, columns):
+    """逐批產生 CSV 內容（含 BOM，Excel 才能正確顯示中文）。
+
+    XLSX 的儲存格一律是文字（inlineStr），不會被當成公式；CSV 則以 _csv_safe 處理。
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")
+    writer.writerow([label for _, label in columns])
+    for i, row in enumerate(rows, start=1):
+        writer.writerow([_csv_safe(_export_value(row, k)) for k, _ in columns])
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """只能寫入、不可 seek 的輸出，讓 zipfile 以串流模式寫 XLSX。"""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+_XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="訂單" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, float)):
+        return f"<c><v>{value}</v></c>"
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(str(value))}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return "<row>" + "".join(_xlsx_cell(v) for v in values) + "</row>"
+
+
+def iter_xlsx_export(rows, columns):
+    """以最精簡的 XLSX 結構（inline string、單一工作表）逐批產生檔案內容。"""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, xml in _XLSX_STATIC_PARTS.items():
+            zf.writestr(name, xml)
+        yield sink.drain()
+
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + _xlsx_row([label for _, label in columns])
+            ).encode("utf-8"))
+            for i, row in enumerate(rows, start=1):
+                sheet.write(_xlsx_row([_export_value(row, k) for k, _ in columns]).encode("utf-8"))
+                if i % EXPORT_CHUNK_ROWS == 0:
+                    yield sink.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
@@ -0,0 +1,127 @@
+"""密碼雜湊：在有上限的 thread pool 執行，並限制登入失敗次數。
+
+- 雜湊刻意耗費 CPU；hashlib 的 pbkdf2 / scrypt 計算期間會釋放 GIL，
+  因此交給固定大小的 thread pool 執行，排隊數超過上限時丟出 HashPoolBusy（API 回 503），
+  不會讓大量登入請求拖住讀取訂單的 worker。
+- 雜湊方法與成本由 PASSWORD_HASH_METHOD 設定（werkzeug 格式，例如 pbkdf2:sha256:260000）；
+  登入成功時若舊雜湊的參數與目前設定不同，會以新參數重新雜湊。
+- LoginThrottle 依 email 與 IP 計算一段時間內的失敗次數，超過上限時在雜湊前就拒絕。
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_HASH_METHOD = "pbkdf2:sha256:260000"
+# LoginThrottle 追蹤的 key 超過此數量時清掉已過期的紀錄
+MAX_TRACKED_KEYS = 10000
+
+
+def _setting(value, name, default, cast):
+    """參數為 None 時改讀環境變數（0 等明確傳入的值照樣使用）。"""
+    if value is None:
+        value = os.environ.get(name, default)
+    return cast(value)
+
+
+class HashPoolBusy(Exception):
+    """雜湊佇列已滿或等待逾時，請稍後再試。"""
+
+
+class PasswordHasher:
+    def __init__(self, method=None, salt_length=None, max_workers=None, max_pending=None, timeout=None):
+        self.method = _setting(method, "PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD, str)
+        self.salt_length = _setting(salt_length, "PASSWORD_SALT_LENGTH", 16, int)
+        workers = _setting(max_workers, "PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1), int)
+        # 執行中 + 排隊中的工作上限
+        pending = _setting(max_pending, "PASSWORD_HASH_QUEUE", workers * 4, int)
+        self.timeout = _setting(timeout, "PASSWORD_HASH_TIMEOUT", 10, float)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(pending)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashPoolBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashPoolBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, hashed, password):
+        """比對密碼；資料庫中的雜湊格式錯誤時視為比對失敗。"""
+        if not hashed or password is None:
+            return False
+        try:
+            return self._run(check_password_hash, hashed, password)
+        except (ValueError, TypeError):
+            return False
+
+    def needs_rehash(self, hashed):
+        """舊雜湊的方法 / 成本與目前設定不同時回傳 True。"""
+        if not hashed or hashed.count("$") < 2:
+            return True
+        method, salt, _ = hashed.split("$", 2)
+        return method != self.method or len(salt) != self.salt_length
+
+
+class LoginThrottle:
+    """滑動時間窗內的登入失敗計數（per process），依 email 與 IP 分別限制；上限為 0 表示不限制該項。"""
+
+    def __init__(self, max_per_email=None, max_per_ip=None, window_seconds=None):
+        self.max_per_email = _setting(max_per_email, "LOGIN_MAX_FAILURES_PER_EMAIL", 5, int)
+        self.max_per_ip = _setting(max_per_ip, "LOGIN_MAX_FAILURES_PER_IP", 20, int)
+        self.window = _setting(window_seconds, "LOGIN_FAILURE_WINDOW_SECONDS", 300, float)
+        self._lock = threading.Lock()
+        self._failures = {}
+
+    def _recent(self, key, now):
+        q = self._failures.get(key)
+        if q is None:
+            return 0
+        while q and q[0] <= now - self.window:
+            q.popleft()
+        if not q:
+            del self._failures[key]
+            return 0
+        return len(q)
+
+    def _limits(self, email, ip):
+        limits = ((("email", email), self.max_per_email), (("ip", ip), self.max_per_ip))
+        return [(key, limit) for key, limit in limits if limit > 0]
+
+    def retry_after(self, email, ip):
+        """被限制時回傳需等待的秒數，否則回傳 0。"""
+        now = time.monotonic()
+        with self._lock:
+            waits = []
+            for key, limit in self._limits(email, ip):
+                if self._recent(key, now) >= limit:
+                    waits.append(self._failures[key][0] + self.window - now)
+            return int(max(waits)) + 1 if waits else 0
+
+    def record_failure(self, email, ip):
+        now = time.monotonic()
+        with self._lock:
+            # 每個 key 只需保留最近 limit 筆失敗時間
+            for key, limit in self._limits(email, ip):
+                self._failures.setdefault(key, deque(maxlen=limit)).append(now)
+            if len(self._failures) > MAX_TRACKED_KEYS:
+                for key in list(self._failures):
+                    self._recent(key, now)
+
+    def reset(self, email):
+        with self._lock:
+            self._failures.pop(("email", email), None)
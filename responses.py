@@ -0,0 +1,74 @@
+"""大型 JSON 回應的序列化、欄位精簡與壓縮。
+
+- json_response()：有安裝 orjson 時以 orjson 序列化（比標準 json 快數倍），否則使用標準 json；
+  兩者都輸出不含空白的 UTF-8 JSON。
+- columnar_rows()：訂單改以 {"columns": [...], "values": [[...], ...]} 傳送，欄位名稱只出現一次。
+- init_compression()：用戶端接受 gzip 時壓縮超過 COMPRESS_MIN_BYTES 的 JSON / HTML 回應；串流回應（匯出、SSE）不壓縮。
+"""
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:  # 未安裝時退回標準 json
+    orjson = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html"}
+
+
+def dumps(payload):
+    """序列化成 UTF-8 bytes；無法直接序列化的值（例如舊資料中的 ObjectId）以 str() 轉換。"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_response(payload, status=200):
+    return raw_json_response(dumps(payload), status)
+
+
+def raw_json_response(body, status=200):
+    """以已序列化的 JSON bytes 建立回應（例如表單快取中的回應）。"""
+    from flask import current_app
+    return current_app.response_class(body, status=status, mimetype="application/json")
+
+
+def columnar_rows(rows, columns):
+    """把訂單 list 轉成欄位式編碼；缺少的欄位為 null。"""
+    return {"columns": list(columns), "values": [[row.get(c) for c in columns] for row in rows]}
+
+
+def init_compression(app):
+    """註冊 after_request hook 壓縮回應。
+
+    設定：COMPRESS_MIN_BYTES（小於此大小不壓縮）、COMPRESS_LEVEL（gzip 1-9）。
+    ETag 一律是 weak ETag，壓縮前後可共用。
+    """
+    from flask import request
+
+    @app.after_request
+    def _compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or not 200 <= response.status_code < 300
+        ):
+            return response
+        data = response.get_data()
+        if len(data) < app.config["COMPRESS_MIN_BYTES"]:
+            return response
+        if request.accept_encodings.quality("gzip") <= 0:
+            return response
+        response.set_data(gzip.compress(data, compresslevel=app.config["COMPRESS_LEVEL"], mtime=0))
+        response.headers["Content-Encoding"] = "gzip"
+        return response
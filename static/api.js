@@ -1,8 +1,27 @@
 const API_BASE = "htAPI_BASEtp://127.0.0.1:5000";
 
+// 登入後取得的 session token，所有 API 請求都以 Authorization header 帶上
+function sessionToken(){
+  return localStorage.getItem("session_token");
+}
+
+async function apiFetch(url, options){
+  const opts = Object.assign({}, options);
+  opts.headers = Object.assign({}, opts.headers);
+  const token = sessionToken();
+  if (token) opts.headers["Authorization"] = `Bearer ${token}`;
+  const res = await fetch(url, opts);
+  if (res.status === 401 && token) {
+    // token 過期或無效：清除登入資訊並回到登入頁
+    localStorage.removeItem("session_token");
+    window.location.href = "/login";
+  }
+  return res;
+}
+
 // Auth
 async function apiRegister(username, email, password) {
-  const res = await fetch("/api/register", {
+  const res = await apiFetch("/api/register", {
     method: "POST",
     headers: {
       "Content-Type": "application/json"
@@ -13,7 +32,7 @@ async function apiRegister(username, email, password) {
 }
 
 async function apiLogin(email, password){
-  const res = await fetch(`/api/login`, {
+  const res = await apiFetch(`/api/login`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
     body: JSON.stringify({email, password})
@@ -21,16 +40,17 @@ async function apiLogin(email, password){
   return res.json();
 }
 
-async function apiUpdateUsername(user_id, username){
-  const res = await fetch(`/api/update_username`, {
+async function apiUpdateUsername(username){
+  const res = await apiFetch(`/api/update_username`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
-    body: JSON.stringify({user_id, username})
+    body: JSON.stringify({username})
   });
   return res.json();
 }
 
 function logout(){
+  localStorage.removeItem("session_token");
   localStorage.removeItem("user_id");
   localStorage.removeItem("username");
   localStorage.removeItem("email");
@@ -39,9 +59,9 @@ function logout(){
 
 
 // Forms
-async function apiCreateForm(owner_id, owner_email, title, description, fields){
-  const body = { owner_id, owner_email, title, description, fields };
-  const res = await fetch(`/api/create_form`, {
+async function apiCreateForm(title, description, fields){
+  const body = { title, description, fields };
+  const res = await apiFetch(`/api/create_form`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
     body: JSON.stringify(body)
@@ -50,24 +70,107 @@ async function apiCreateForm(owner_id, owner_email, title, description, fields){
 }
 
 
-async function apiGetMyForms(user_id){
-  const res = await fetch(`/api/my_forms/${user_id}`);
+async function apiGetMyForms(user_id, params){
+  // params：{limit, cursor}，未帶 limit 時回傳全部表單
+  const qs = new URLSearchParams();
+  Object.entries(params || {}).forEach(([k, v]) => {
+    if (v !== undefined && v !== null && v !== "") qs.append(k, v);
+  });
+  const res = await apiFetch(`/api/my_forms/${user_id}` + (qs.toString() ? `?${qs}` : ""));
   return res.json();
 }
 
-async function apiGetForm(formId, userId) {
+// rows_format=columns 的回應：{columns: [...], values: [[...]]} 轉回物件陣列
+function decodeColumnarRows(rows) {
+    if (!rows || Array.isArray(rows)) return rows;
+    return rows.values.map(values => {
+        const row = {};
+        rows.columns.forEach((c, i) => { row[c] = values[i]; });
+        return row;
+    });
+}
+
+async function apiGetForm(formId, userId, params) {
     // 確保這裡的 URL 變數名是正確的： formId 和 userId
-    const url = `/api/form/${formId}/${userId}`; 
+    // params：{limit, cursor, remittance, shipped, buyer_email, item_name, sort, fields}，未帶的條件不會送出
+    // 訂單一律以欄位式編碼傳輸（欄位名稱只出現一次），回傳前轉回物件陣列
+    const qs = new URLSearchParams({rows_format: "columns"});
+    Object.entries(params || {}).forEach(([k, v]) => {
+        if (v !== undefined && v !== null && v !== "") qs.set(k, v);
+    });
+    const url = `/api/form/${formId}/${userId}?${qs}`;
     try {
-        const response = await fetch(url);
-        return await response.json();
+        const response = await apiFetch(url);
+        const data = await response.json();
+        if (data.form) data.form.rows = decodeColumnarRows(data.form.rows);
+        return data;
     } catch (error) {
         console.error('Error fetching form data:', error);
         return { success: false, message: '連線錯誤，無法載入表單資料' };
     }
 }
+// 搜尋訂單（買家名稱 / email / 物品名稱）：params 為 {q, limit, cursor, remittance, shipped}
+async function apiSearchRows(formId, userId, params) {
+    const qs = new URLSearchParams({rows_format: "columns"});
+    Object.entries(params || {}).forEach(([k, v]) => {
+        if (v !== undefined && v !== null && v !== "") qs.set(k, v);
+    });
+    try {
+        const response = await apiFetch(`/api/search/${formId}/${userId}?${qs}`);
+        const data = await response.json();
+        if (data.rows) data.rows = decodeColumnarRows(data.rows);
+        return data;
+    } catch (error) {
+        console.error('Error searching rows:', error);
+        return { success: false, message: '連線錯誤，無法搜尋訂單' };
+    }
+}
+
+// 歷史訂單（已封存）：params 為 {limit, cursor, remittance, shipped}
+async function apiFormHistory(formId, userId, params) {
+    const qs = new URLSearchParams({rows_format: "columns"});
+    Object.entries(params || {}).forEach(([k, v]) => {
+        if (v !== undefined && v !== null && v !== "") qs.set(k, v);
+    });
+    try {
+        const response = await apiFetch(`/api/history/${formId}/${userId}?${qs}`);
+        const data = await response.json();
+        if (data.rows) data.rows = decodeColumnarRows(data.rows);
+        return data;
+    } catch (error) {
+        console.error('Error fetching history:', error);
+        return { success: false, message: '連線錯誤，無法載入歷史訂單' };
+    }
+}
+
+// 賣家跨表單報表：params 為 {group_by, from, to, form_ids}
+async function apiSellerReport(userId, params) {
+    const qs = new URLSearchParams();
+    Object.entries(params || {}).forEach(([k, v]) => {
+        if (v !== undefined && v !== null && v !== "") qs.append(k, v);
+    });
+    const res = await apiFetch(`/api/reports/${userId}` + (qs.toString() ? `?${qs}` : ""));
+    return res.json();
+}
+
+// 匯出網址（format: "csv" 或 "xlsx"），params 與 apiGetForm 的篩選條件相同
+function exportFormUrl(formId, userId, format, params) {
+    // 下載連結無法帶 Authorization header，改以 query string 傳 token
+    const qs = new URLSearchParams({format, token: sessionToken() || ""});
+    Object.entries(params || {}).forEach(([k, v]) => {
+        if (v !== undefined && v !== null && v !== "") qs.append(k, v);
+    });
+    return `/api/export/${formId}/${userId}?${qs}`;
+}
+
+// 即時事件串流網址（EventSource 無法帶 Authorization header，改以 query string 傳 token）
+function formEventsUrl(formId, userId) {
+    const qs = new URLSearchParams({token: sessionToken() || ""});
+    return `/api/events/${formId}/${userId}?${qs}`;
+}
+
 async function apiRequestPasswordReset(email){
-  const res = await fetch(`/api/request_password_reset`, {
+  const res = await apiFetch(`/api/request_password_reset`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
     body: JSON.stringify({email})
@@ -76,7 +179,7 @@ async function apiRequestPasswordReset(email){
 }
 
 async function apiForgotPassword(email){
-  const res = await fetch(`/api/forgot_password`, {
+  const res = await apiFetch(`/api/forgot_password`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
     body: JSON.stringify({ email })
@@ -86,7 +189,7 @@ async function apiForgotPassword(email){
 
 
 async function apiAddViewer(form_id, owner_id, viewer_email){
-  const res = await fetch(`/api/add_viewer`, {
+  const res = await apiFetch(`/api/add_viewer`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
     body: JSON.stringify({form_id, owner_id, viewer_email})
@@ -95,7 +198,7 @@ async function apiAddViewer(form_id, owner_id, viewer_email){
 }
 
 async function apiRemoveViewer(form_id, owner_id, viewer_email){
-  const res = await fetch(`/api/remove_viewer`, {
+  const res = await apiFetch(`/api/remove_viewer`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
     body: JSON.stringify({form_id, owner_id, viewer_email})
@@ -106,7 +209,7 @@ async function apiRemoveViewer(form_id, owner_id, viewer_email){
 // Rows
 async function apiAddRow(form_id, owner_id, row){
   const body = Object.assign({form_id, owner_id}, row);
-  const res = await fetch(`/api/add_row`, {
+  const res = await apiFetch(`/api/add_row`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
     body: JSON.stringify(body)
@@ -114,9 +217,22 @@ async function apiAddRow(form_id, owner_id, row){
   return res.json();
 }
 
-async function apiUpdateRow(form_id, owner_id, index, row){
-  const body = Object.assign({form_id, owner_id, index}, row);
-  const res = await fetch(`/api/update_row`, {
+// 批次匯入：file 為 CSV 或 JSON Lines 檔案
+async function apiImportRows(form_id, owner_id, file){
+  const fd = new FormData();
+  fd.append("form_id", form_id);
+  fd.append("owner_id", owner_id);
+  fd.append("file", file);
+  const res = await apiFetch(`/api/import_rows`, {
+    method: "POST",
+    body: fd
+  });
+  return res.json();
+}
+
+async function apiUpdateRow(form_id, owner_id, row_id, row){
+  const body = Object.assign({form_id, owner_id, row_id}, row);
+  const res = await apiFetch(`/api/update_row`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
     body: JSON.stringify(body)
@@ -124,17 +240,37 @@ async function apiUpdateRow(form_id, owner_id, index, row){
   return res.json();
 }
 
-async function apiDeleteRow(form_id, owner_id, index){
-  const res = await fetch(`/api/delete_row`, {
+// 批次修改出貨 / 匯款狀態：rows 為 [{row_id, version}]，patch 為 {shipped, remittance}
+async function apiBatchUpdateRows(form_id, rows, patch){
+  const res = await apiFetch(`/api/batch_update_rows`, {
+    method: "POST",
+    headers: {"Content-Type":"application/json"},
+    body: JSON.stringify({form_id, rows, patch})
+  });
+  return res.json();
+}
+
+// version：讀取訂單時拿到的版本，後端版本不符時回傳 409 (conflict)
+async function apiDeleteRow(form_id, owner_id, row_id, version){
+  const res = await apiFetch(`/api/delete_row`, {
+    method: "POST",
+    headers: {"Content-Type":"application/json"},
+    body: JSON.stringify({form_id, owner_id, row_id, version})
+  });
+  return res.json();
+}
+
+async function apiDeleteForm(form_id){
+  const res = await apiFetch(`/api/delete_form`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
-    body: JSON.stringify({form_id, owner_id, index})
+    body: JSON.stringify({form_id})
   });
   return res.json();
 }
 
 async function apiClearForm(form_id, owner_id){
-  const res = await fetch(`/api/clear_form`, {
+  const res = await apiFetch(`/api/clear_form`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
     body: JSON.stringify({form_id, owner_id})
@@ -144,7 +280,7 @@ async function apiClearForm(form_id, owner_id){
 
 // 👍 最終正確版本（沒有重複）
 async function apiUpdateFormDescription(form_id, description){
-  const res = await fetch(`/api/update_form_description`, {
+  const res = await apiFetch(`/api/update_form_description`, {
     method: "POST",
     headers: {"Content-Type":"application/json"},
     body: JSON.stringify({form_id, description})
@@ -152,13 +288,21 @@ async function apiUpdateFormDescription(form_id, description){
   return res.json();
 }
 
-async function apiRecentBuyers(form_id){
-  const res = await fetch(`/api/recent_buyers/${form_id}`);
-  return res.json();
+// 買家自動完成：q 為 email 或名稱的開頭，回傳 {success, buyers: [{email, name, social, uses}]}
+async function apiBuyerSuggestions(q, limit){
+  const qs = new URLSearchParams({q: q || ""});
+  if(limit) qs.set("limit", limit);
+  try {
+    const res = await apiFetch(`/api/buyer_suggestions?${qs}`);
+    return res.json();
+  } catch (error) {
+    console.error('Error loading buyer suggestions:', error);
+    return { success: false, buyers: [] };
+  }
 }
 
 async function apiGetFormRows(form_id, viewer_email){
-  const res = await fetch(`/api/form_rows?form_id=${form_id}&viewer_email=${viewer_email}`);
+  const res = await apiFetch(`/api/form_rows?form_id=${form_id}&viewer_email=${viewer_email}`);
   return res.json();
 
 }
@@ -0,0 +1,48 @@
+"""資料存取層：app.py 只透過 Storage 的 users / forms / viewers / rows / archive / reports / buyers 讀寫資料。
+
+- STORAGE_BACKEND=mongo（預設）：MongoDB，連線字串 MONGO_URI、資料庫 MONGO_DB_NAME。
+- STORAGE_BACKEND=sqlite：內嵌的 SQLite 檔案（SQLITE_PATH，預設 orders.sqlite3），
+  不需要資料庫伺服器，適合單一賣家的小型部署；SQLITE_PATH=:memory: 可在測試時使用。
+
+兩種實作的方法與回傳格式相同（id 一律為字串），各自在 storage/mongo.py、storage/sqlite.py。
+"""
+from storage.base import (
+    ASCENDING, DESCENDING, ROW_SORT_KEYS, ROW_FIELDS, SUMMARY_COUNTERS, EMPTY_FORM_STATS, BATCH_PATCH_FIELDS,
+    REPORT_GROUPS, SEARCH_QUERY_MAX, BUYER_SUGGEST_DEFAULT, BUYER_SUGGEST_MAX, ARCHIVE_BATCH_ROWS,
+    DuplicateEmailError, RowQueryError, form_stats_delta, normalize_search, archive_cutoff_id, find_rows_page,
+)
+
+BACKENDS = ("mongo", "sqlite")
+READ_PREFERENCES = ("primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest")
+
+
+def mongo_client_options(settings):
+    """settings 中的 MONGO_* 連線池 / 逾時 / read preference 轉成 MongoClient 參數（未設定的項目不傳）。"""
+    read_preference = getattr(settings, "MONGO_READ_PREFERENCE", "primary")
+    if read_preference not in READ_PREFERENCES:
+        raise ValueError(f"MONGO_READ_PREFERENCE 必須是 {' / '.join(READ_PREFERENCES)}，目前為 {read_preference!r}")
+    options = {
+        "maxPoolSize": getattr(settings, "MONGO_MAX_POOL_SIZE", None),
+        "minPoolSize": getattr(settings, "MONGO_MIN_POOL_SIZE", None),
+        "serverSelectionTimeoutMS": getattr(settings, "MONGO_SERVER_SELECTION_TIMEOUT_MS", None),
+        "connectTimeoutMS": getattr(settings, "MONGO_CONNECT_TIMEOUT_MS", None),
+        "socketTimeoutMS": getattr(settings, "MONGO_SOCKET_TIMEOUT_MS", None),
+        "readPreference": read_preference,
+    }
+    return {k: v for k, v in options.items() if v is not None}
+
+
+def create_storage(settings, event_listeners=None):
+    """依 settings.STORAGE_BACKEND 建立 Storage（settings 通常是 config 模組）。
+
+    建立時不連線資料庫：MongoDB 在第一次存取時才建立 client，SQLite 在每個 thread 第一次使用時開啟連線。
+    """
+    backend = settings.STORAGE_BACKEND
+    if backend == "sqlite":
+        from storage.sqlite import SQLiteStorage
+        return SQLiteStorage(settings.SQLITE_PATH)
+    if backend == "mongo":
+        from storage.mongo import MongoStorage
+        return MongoStorage(settings.MONGO_URI, settings.MONGO_DB_NAME, event_listeners=event_listeners,
+                            **mongo_client_options(settings))
+    raise ValueError(f"STORAGE_BACKEND 必須是 {' / '.join(BACKENDS)}，目前為 {backend!r}")
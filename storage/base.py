@@ -0,0 +1,361 @@
+"""各資料庫實作共用的常數、例外與純函式（不依賴任何資料庫）。"""
+import base64
+import json
+import re
+import zlib
+from datetime import datetime, timedelta, timezone
+
+ASCENDING = 1
+DESCENDING = -1
+
+# 可排序的訂單欄位；_id 即建立順序
+ROW_SORT_KEYS = {"_id", "buyer_name", "buyer_email", "item_name", "item_total", "remittance", "shipped"}
+
+# 訂單欄位（不含 _id、form_id、version）
+ROW_FIELDS = (
+    "buyer_name", "buyer_email", "item_name", "item_qty", "item_price", "item_total",
+    "remittance", "shipped", "shipping_fee", "buyer_social",
+)
+
+# 每個 (form_id, buyer_name, buyer_email) 的買家統計欄位
+SUMMARY_COUNTERS = (
+    "row_count", "total",
+    "paid_count", "paid_total",
+    "unpaid_count", "unpaid_total",
+    "shipped_count", "shipped_total",
+)
+
+# 批次更新（/api/batch_update_rows）可修改的欄位：只有出貨與匯款狀態
+BATCH_PATCH_FIELDS = ("remittance", "shipped")
+
+# 賣家報表（跨表單）的分組方式：買家 / 物品 / 月份
+REPORT_GROUPS = ("buyer", "item", "month")
+
+# 訂單搜尋（/api/search）比對的欄位與搜尋字串長度上限
+SEARCH_FIELDS = ("buyer_name", "buyer_email", "item_name")
+SEARCH_QUERY_MAX = 64
+
+# 賣家的買家名錄（新增訂單時自動填入買家資料）：每位賣家最多保留 BUYER_DIRECTORY_MAX 位買家，
+# 超過 BUYER_DIRECTORY_MAX + BUYER_DIRECTORY_SLACK 時一次刪除排名最後的買家
+BUYER_DIRECTORY_MAX = 500
+BUYER_DIRECTORY_SLACK = 50
+# 排名分數：每次下單加上 2 ** (距 BUYER_SCORE_EPOCH 的天數 / BUYER_SCORE_HALF_LIFE_DAYS)，
+# 等同於每經過半衰期，舊訂單的權重減半；分數只增不減，可以直接以 $inc / 加法累加並建立索引排序
+BUYER_SCORE_HALF_LIFE_DAYS = 30
+BUYER_SCORE_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+BUYER_SUGGEST_DEFAULT = 8
+BUYER_SUGGEST_MAX = 20
+
+# 封存（archive-rows）：已匯款且已出貨、建立超過指定天數的訂單搬出 order_rows。
+# 每張表單每個月份（依建立時間）的訂單依建立順序切成最多 ARCHIVE_CHUNK_ROWS 筆一份，
+# 以欄位式 JSON（欄位名稱只出現一次）經 zlib 壓縮後儲存；每次最多搬移 ARCHIVE_BATCH_ROWS 筆
+ARCHIVE_CHUNK_ROWS = 500
+ARCHIVE_BATCH_ROWS = 1000
+ARCHIVE_COLUMNS = ("_id", *ROW_FIELDS, "version")
+
+# 表單計數器（給 Dashboard 列表使用）
+EMPTY_FORM_STATS = {"row_count": 0, "unpaid_count": 0, "unshipped_count": 0}
+
+
+class DuplicateEmailError(Exception):
+    """註冊的 email 已存在。"""
+
+
+class RowQueryError(ValueError):
+    """查詢參數不合法（回傳 400）。"""
+
+
+def row_summary_delta(row, sign=1):
+    """計算一筆訂單對買家統計的增減量（sign=-1 表示移除）。"""
+    total = float(row.get("item_total", 0) or 0)
+    paid = "paid" if row.get("remittance") else "unpaid"
+    delta = {
+        "row_count": sign,
+        "total": sign * total,
+        f"{paid}_count": sign,
+        f"{paid}_total": sign * total,
+    }
+    if row.get("shipped"):
+        delta["shipped_count"] = sign
+        delta["shipped_total"] = sign * total
+    return delta
+
+
+def row_timestamp(row_id):
+    """訂單建立時間（UTC 秒數）：取自 ObjectId 字串前 8 碼；不是 ObjectId 時回傳 None。"""
+    row_id = str(row_id)
+    if len(row_id) != 24:
+        return None
+    try:
+        return int(row_id[:8], 16)
+    except ValueError:
+        return None
+
+
+def archive_cutoff_id(days, now=None):
+    """建立時間早於 days 天前的訂單 _id 都小於回傳值（ObjectId 字串的前 8 碼是建立秒數）。"""
+    now = now or datetime.now(timezone.utc)
+    return "%08x" % int((now - timedelta(days=days)).timestamp()) + "0" * 16
+
+
+def row_day(row_id):
+    """訂單建立日期（UTC，YYYY-MM-DD）；不是 ObjectId 時回傳空字串。"""
+    seconds = row_timestamp(row_id)
+    if seconds is None:
+        return ""
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d")
+
+
+def row_month(row_id):
+    """訂單建立月份（UTC，YYYY-MM）；不是 ObjectId 時回傳空字串。"""
+    return row_day(row_id)[:7]
+
+
+def buyer_score_weight(seconds=None):
+    """一次下單對買家排名分數的貢獻；seconds 為下單時間（UTC 秒數），None 表示現在。"""
+    if seconds is None:
+        seconds = datetime.now(timezone.utc).timestamp()
+    days = (seconds - BUYER_SCORE_EPOCH.timestamp()) / 86400
+    return 2.0 ** (days / BUYER_SCORE_HALF_LIFE_DAYS)
+
+
+def buyer_entries(rows, seconds=None):
+    """把訂單轉成買家名錄的更新：[{email, name, social, uses, score, last_used}]，同一 email 合併為一筆。
+
+    名稱與社群帳號取最後一筆有值的訂單；seconds（UTC 秒數）為 None 時以各訂單 _id 的建立時間計算分數
+    （沒有建立時間的訂單視為現在）。last_used 為最後一次下單的 UTC 秒數。
+    """
+    now = datetime.now(timezone.utc).timestamp()
+    entries = {}
+    for row in rows:
+        email = row.get("buyer_email")
+        if not email:
+            continue
+        when = seconds if seconds is not None else row_timestamp(row.get("_id"))
+        when = now if when is None else when
+        entry = entries.setdefault(email, {
+            "email": email, "name": None, "social": None, "uses": 0, "score": 0.0, "last_used": when,
+        })
+        entry["uses"] += 1
+        entry["score"] += buyer_score_weight(when)
+        entry["last_used"] = max(entry["last_used"], when)
+        if row.get("buyer_name"):
+            entry["name"] = row["buyer_name"]
+        if row.get("buyer_social"):
+            entry["social"] = row["buyer_social"]
+    return list(entries.values())
+
+
+_WORD_SEPARATORS = re.compile(r"[\s@._+\-/]+")
+
+
+def normalize_search(text):
+    """搜尋字串與欄位值都轉成小寫比對（不分大小寫）。"""
+    return str(text).strip().lower() if text is not None else ""
+
+
+def row_search_keys(row):
+    """訂單的搜尋索引鍵：SEARCH_FIELDS 各欄位（小寫）中所有相鄰兩個字元，以及每個單字的第一個字元加上 "^"。
+
+    兩字元以上的搜尋字串，其所有相鄰兩字元都必須出現（再比對實際內容排除誤判）；
+    一個字元的搜尋只比對單字開頭（email 以 @ . 等符號分成單字）。
+    """
+    keys = set()
+    for field in SEARCH_FIELDS:
+        value = normalize_search(row.get(field))
+        keys.update(value[i:i + 2] for i in range(len(value) - 1))
+        keys.update("^" + word[0] for word in _WORD_SEPARATORS.split(value) if word)
+    return sorted(keys)
+
+
+def search_matches(text, row):
+    """訂單是否符合搜尋字串（已 normalize_search）：兩個字元以上為包含，一個字元為單字開頭。"""
+    for field in SEARCH_FIELDS:
+        value = normalize_search(row.get(field))
+        if len(text) > 1:
+            if text in value:
+                return True
+        elif any(word.startswith(text) for word in _WORD_SEPARATORS.split(value)):
+            return True
+    return False
+
+
+def search_query_keys(text):
+    """搜尋字串（已 normalize_search）需要的索引鍵，每一個都必須出現。"""
+    if len(text) == 1:
+        return ["^" + text]
+    return sorted({text[i:i + 2] for i in range(len(text) - 1)})
+
+
+def form_stats_delta(old_row=None, new_row=None, inc=None):
+    """計算訂單變動對表單計數器的增減量（可傳入 inc 累加多筆）。"""
+    inc = {} if inc is None else inc
+    for row, sign in ((old_row, -1), (new_row, 1)):
+        if row is None:
+            continue
+        keys = ["row_count"]
+        if not row.get("remittance"):
+            keys.append("unpaid_count")
+        if not row.get("shipped"):
+            keys.append("unshipped_count")
+        for k in keys:
+            inc[k] = inc.get(k, 0) + sign
+    return inc
+
+
+def projected_fields(fields, sort_key, include_social=True):
+    """fields= 投影要讀取的訂單欄位（依 ROW_FIELDS 順序）；分頁 cursor 需要排序欄位，一併讀取。
+
+    fields 為 None 時回傳 None（讀取全部欄位）；_id 與 version 永遠會讀取。
+    """
+    if fields is None:
+        return None
+    wanted = set(fields)
+    if sort_key != "_id":
+        wanted.add(sort_key)
+    if not include_social:
+        wanted.discard("buyer_social")
+    return tuple(k for k in ROW_FIELDS if k in wanted)
+
+
+def plan_batch_update(current, updates, patch):
+    """依讀到的訂單規劃批次更新。
+
+    current 為 {row_id: row}，updates 為 [(row_id, version)]（version 為 None 時不檢查）。
+    回傳 (planned, conflicts, missing)：planned 為 [(old_row, new_row)]，
+    conflicts 為版本不符的目前內容，missing 為找不到的 row_id。
+    """
+    planned, conflicts, missing = [], [], []
+    for row_id, version in updates:
+        old_row = current.get(row_id)
+        if old_row is None:
+            missing.append(row_id)
+        elif version is not None and old_row.get("version") != version:
+            conflicts.append(old_row)
+        else:
+            new_row = dict(old_row, **patch)
+            new_row["version"] = old_row.get("version", 0) + 1
+            planned.append((old_row, new_row))
+    return planned, conflicts, missing
+
+
+def pack_rows(rows):
+    """封存的訂單編碼成 zlib 壓縮的欄位式 JSON。"""
+    payload = {"columns": list(ARCHIVE_COLUMNS), "values": [[r.get(c) for c in ARCHIVE_COLUMNS] for r in rows]}
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def unpack_rows(data):
+    payload = json.loads(zlib.decompress(data))
+    columns = payload["columns"]
+    return [dict(zip(columns, values)) for values in payload["values"]]
+
+
+def archive_chunks(existing, added=(), removed=()):
+    """合併同一張表單、同一個月份的封存訂單後重新切份：回傳 [[row, ...], ...]，依 _id 排序、互不重疊。
+
+    existing 為既有的訂單，added 中 _id 相同的訂單會取代既有的（重新執行封存時不會重複），removed 為要移除的 _id。
+    """
+    merged = {r["_id"]: r for r in existing}
+    merged.update((r["_id"], r) for r in added)
+    for row_id in removed:
+        merged.pop(row_id, None)
+    rows = [merged[k] for k in sorted(merged)]
+    return [rows[i:i + ARCHIVE_CHUNK_ROWS] for i in range(0, len(rows), ARCHIVE_CHUNK_ROWS)]
+
+
+def archive_chunk_info(rows):
+    """一份封存資料的索引欄位：月份、第一筆與最後一筆 _id、筆數與買家 email（買家查詢歷史訂單時用來略過）。"""
+    return {
+        "month": row_month(rows[0]["_id"]),
+        "first_id": rows[0]["_id"],
+        "last_id": rows[-1]["_id"],
+        "row_count": len(rows),
+        "buyer_emails": sorted({r["buyer_email"] for r in rows if r.get("buyer_email")}),
+    }
+
+
+def row_matches_filters(row, filters):
+    """在記憶體中套用 api_get_form 的篩選條件（封存的訂單沒有欄位索引）。"""
+    filters = filters or {}
+    if filters.get("remittance") is not None and bool(row.get("remittance")) != filters["remittance"]:
+        return False
+    if filters.get("shipped") is not None and bool(row.get("shipped")) != filters["shipped"]:
+        return False
+    if filters.get("buyer_email") and row.get("buyer_email") != filters["buyer_email"]:
+        return False
+    if filters.get("item_name") and filters["item_name"].lower() not in str(row.get("item_name") or "").lower():
+        return False
+    return True
+
+
+def iter_archived_rows(chunks, filters, after_id=None, include_social=True, fields=None):
+    """由依序排列的封存資料（壓縮後的 bytes）逐筆產生符合條件的訂單；after_id 之前（含）的略過。"""
+    columns = projected_fields(fields, "_id", include_social)
+    for data in chunks:
+        for row in unpack_rows(data):
+            if after_id is not None and row["_id"] <= after_id:
+                continue
+            if not row_matches_filters(row, filters):
+                continue
+            if columns is not None:
+                row = {k: row.get(k) for k in ("_id", *columns, "version")}
+            elif not include_social:
+                row.pop("buyer_social", None)
+            yield row
+
+
+def take_row_page(rows, limit):
+    """由依 _id 排序的訂單取出一頁，回傳 (rows, next_cursor)。"""
+    page = []
+    for row in rows:
+        if len(page) == limit:
+            return page, encode_row_cursor("_id", page[-1])
+        page.append(row)
+    return page, None
+
+
+def _row_position(row, sort_key):
+    """排序位置：與 SQLite / MongoDB 相同，null 排在最小，值相同時依 _id。"""
+    value = row.get(sort_key)
+    return (value is not None, value if value is not None else 0), row["_id"]
+
+
+def find_rows_page(rows, filters, sort_key, direction, limit, cursor_token=None, include_social=True, fields=None):
+    """在記憶體中對一張表單的全部訂單執行與 rows.find_page 相同的篩選 / 排序 / 分頁，回傳 (rows, next_cursor)。"""
+    descending = direction != ASCENDING
+    matched = [r for r in rows if row_matches_filters(r, filters)]
+    if cursor_token:
+        value, row_id = decode_row_cursor(cursor_token, sort_key)
+        after = _row_position({sort_key: value, "_id": row_id}, sort_key)
+        matched = [r for r in matched if (_row_position(r, sort_key) < after if descending else _row_position(r, sort_key) > after)]
+    matched.sort(key=lambda r: _row_position(r, sort_key), reverse=descending)
+
+    next_cursor = None
+    if limit is not None and len(matched) > limit:
+        matched = matched[:limit]
+        next_cursor = encode_row_cursor(sort_key, matched[-1])
+    columns = projected_fields(fields, sort_key, include_social)
+    if columns is not None:
+        page = [{k: r.get(k) for k in ("_id", *columns, "version")} for r in matched]
+    elif not include_social:
+        page = [{k: v for k, v in r.items() if k != "buyer_social"} for r in matched]
+    else:
+        page = [dict(r) for r in matched]
+    return page, next_cursor
+
+
+def encode_row_cursor(sort_key, row):
+    payload = json.dumps([sort_key, row.get(sort_key), row["_id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_row_cursor(token, sort_key):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        key, value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise RowQueryError("cursor 不合法")
+    if key != sort_key:
+        raise RowQueryError("cursor 與 sort 參數不一致")
+    return value, row_id
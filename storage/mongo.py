@@ -0,0 +1,1090 @@
+"""MongoDB 實作：users / forms / order_rows / order_archive / buyer_summaries / daily_rollups / buyer_directory / mail_jobs collection。
+
+- 每筆訂單是一份 order_rows document（_id 為字串），以 form_id 關聯表單。
+- 買家統計存在 buyer_summaries，新增 / 修改 / 刪除訂單時以 $inc 增量維護。
+- daily_rollups 是每張表單、每天（訂單建立日）、每個買家與物品一筆的彙總，同樣以 $inc 維護，
+  賣家跨表單報表只彙總這些 document，不需要掃描所有訂單。
+- 封存的訂單（已匯款且已出貨的舊訂單）搬到 order_archive，每張表單每個月份切成數份壓縮的 document；
+  買家統計不再計入，每日彙總（賣家報表）照常計入。
+- 檢視者名單是 forms document 中的陣列。
+- 賣家的買家名錄 buyer_directory 每位賣家、每個買家一份 document，以 (owner_id, score) 索引依排名讀取，筆數有上限。
+- 訂單搜尋以 order_rows.search_keys（買家名稱、email、物品名稱的兩字元片段）的 multikey 索引查詢，
+  寫入訂單時一併維護。
+- MongoClient 在第一次存取資料時才建立，fork 出的子 process（gunicorn --preload 的 worker）會重新建立自己的 client。
+"""
+import os
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+import pymongo
+from pymongo import DeleteOne, MongoClient, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from indexes import ensure_indexes, check_indexes, missing_indexes
+from storage.base import (
+    ASCENDING, DESCENDING, BUYER_DIRECTORY_MAX, BUYER_DIRECTORY_SLACK, EMPTY_FORM_STATS, SEARCH_FIELDS,
+    SUMMARY_COUNTERS, DuplicateEmailError, RowQueryError, buyer_entries, row_day, row_month, pack_rows, unpack_rows,
+    archive_chunks, archive_chunk_info, iter_archived_rows, take_row_page, row_summary_delta, row_search_keys, search_query_keys, projected_fields, plan_batch_update, encode_row_cursor, decode_row_cursor,
+)
+
+# 回傳給前端的訂單欄位（不含內部使用的 form_id、搜尋索引鍵與批次更新標記）
+ROW_PROJECTION = {"form_id": 0, "search_keys": 0, "batch_token": 0}
+# 買家看不到賣家記錄的買家社群帳號
+BUYER_ROW_PROJECTION = {"form_id": 0, "search_keys": 0, "batch_token": 0, "buyer_social": 0}
+# 讀取表單基本資料時不載入檢視者名單
+FORM_INFO_PROJECTION = {"title": 1, "description": 1, "owner_id": 1, "owner_email": 1, "fields": 1, "version": 1}
+# Dashboard 列表只需要的欄位（不含訂單與檢視者名單）
+FORM_LIST_PROJECTION = {"title": 1, "description": 1, "owner_id": 1, "owner_email": 1, "stats": 1, "updated_at": 1, "version": 1}
+# 未帶 version 的訂單更新（修改搜尋欄位時需先讀後寫）遇到同時修改時重試的次數
+UPDATE_RETRIES = 5
+
+
+def _oid(value):
+    """字串轉 ObjectId；格式不合法時回傳 None（視為找不到）。"""
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _form_doc(f):
+    f = dict(f)
+    f["_id"] = str(f["_id"])
+    return f
+
+
+class MongoUserRepository:
+    def __init__(self, collection):
+        self.users = collection
+
+    def get_by_email(self, email):
+        user = self.users.find_one({"email": email})
+        if user:
+            user["_id"] = str(user["_id"])
+        return user
+
+    def exists(self, email):
+        return self.users.find_one({"email": email}, {"_id": 1}) is not None
+
+    def create(self, username, email, password):
+        # Email 重複由 users.email 的 unique 索引擋下，不會有同時註冊的競態問題
+        try:
+            result = self.users.insert_one({"username": username, "email": email, "password": password})
+        except DuplicateKeyError:
+            raise DuplicateEmailError(email)
+        return str(result.inserted_id)
+
+    def set_password(self, user_id, password, expected=None):
+        """更新密碼雜湊；expected 有值時只在目前的雜湊相符時才更新（compare-and-set）。"""
+        query = {"_id": _oid(user_id)}
+        if expected is not None:
+            query["password"] = expected
+        return self.users.update_one(query, {"$set": {"password": password}}).matched_count > 0
+
+    def set_username(self, user_id, username):
+        self.users.update_one({"_id": _oid(user_id)}, {"$set": {"username": username}})
+
+
+class MongoFormRepository:
+    def __init__(self, db):
+        self.forms = db["forms"]
+        self.order_rows = db["order_rows"]
+        self.order_archive = db["order_archive"]
+        self.buyer_summaries = db["buyer_summaries"]
+        self.daily_rollups = db["daily_rollups"]
+
+    def create(self, title, description, owner_id, owner_email, fields):
+        res = self.forms.insert_one({
+            "title": title,
+            "description": description,
+            "owner_id": owner_id,
+            "owner_email": owner_email,
+            "allowed_viewers": [],
+            "fields": fields,
+            "stats": dict(EMPTY_FORM_STATS),
+            "version": 1,
+            "updated_at": datetime.utcnow()
+        })
+        return str(res.inserted_id)
+
+    def get(self, form_id, viewer_email=None):
+        """讀取表單基本資料；viewer_email 有值時另外回傳 is_viewer。
+
+        只取出檢視者名單中與 viewer_email 相符的那一筆，避免把整份名單讀進記憶體。
+        """
+        oid = _oid(form_id)
+        if oid is None:
+            return None
+        projection = FORM_INFO_PROJECTION
+        if viewer_email is not None:
+            projection = dict(FORM_INFO_PROJECTION, allowed_viewers={"$elemMatch": {"$eq": viewer_email}})
+        f = self.forms.find_one({"_id": oid}, projection)
+        if not f:
+            return None
+        f = _form_doc(f)
+        if viewer_email is not None:
+            f["is_viewer"] = bool(f.pop("allowed_viewers", None))
+        return f
+
+    def version(self, form_id):
+        oid = _oid(form_id)
+        f = self.forms.find_one({"_id": oid}, {"version": 1}) if oid else None
+        return f.get("version", 0) if f else None
+
+    def ids(self):
+        return [str(f["_id"]) for f in self.forms.find({}, {"_id": 1}).sort("_id", ASCENDING)]
+
+    def list_for_user(self, user_id, email, after_id=None, limit=None, versions_only=False):
+        """以單一 $or 查詢取得自己建立與可檢視的表單，依 _id 排序。"""
+        query = {"$or": [{"owner_id": user_id}, {"allowed_viewers": email}]}
+        if after_id:
+            oid = _oid(after_id)
+            if oid is None:
+                raise RowQueryError("cursor 不合法")
+            query = {"$and": [query, {"_id": {"$gt": oid}}]}
+        projection = {"version": 1} if versions_only else FORM_LIST_PROJECTION
+        cur = self.forms.find(query, projection).sort("_id", ASCENDING)
+        if limit is not None:
+            cur = cur.limit(limit)
+        return [_form_doc(f) for f in cur]
+
+    def touch(self, form_id, stats_inc=None, description=None, reset_stats=False, owner_id=None):
+        """以一次 update 更新表單計數器、最後修改時間與版本號。
+
+        每個會改變表單內容的 API 都必須經過這裡，version 遞增後 ETag 才會失效。
+        owner_id 有值時只更新該使用者擁有的表單；回傳是否有符合的表單。
+        """
+        oid = _oid(form_id)
+        if oid is None:
+            return False
+        update_set = {"updated_at": datetime.utcnow()}
+        if description is not None:
+            update_set["description"] = description
+        if reset_stats:
+            update_set["stats"] = dict(EMPTY_FORM_STATS)
+        inc = {f"stats.{k}": v for k, v in (stats_inc or {}).items() if v}
+        inc["version"] = 1
+        update = {"$set": update_set, "$inc": inc}
+        query = {"_id": oid}
+        if owner_id is not None:
+            query["owner_id"] = owner_id
+        return self.forms.update_one(query, update).matched_count > 0
+
+    def delete(self, form_id):
+        """刪除表單與其所有訂單（含封存）、買家統計、每日彙總。"""
+        oid = _oid(form_id)
+        if oid is None:
+            return
+        self.forms.delete_one({"_id": oid})
+        self.order_rows.delete_many({"form_id": form_id})
+        self.order_archive.delete_many({"form_id": form_id})
+        self.buyer_summaries.delete_many({"form_id": form_id})
+        self.daily_rollups.delete_many({"form_id": form_id})
+
+    def rebuild_stats(self, form_id=None):
+        """由 order_rows 重新計算 forms.stats，回傳更新的表單數。"""
+        pipeline = []
+        if form_id is not None:
+            pipeline.append({"$match": {"form_id": form_id}})
+        pipeline.append({"$group": {
+            "_id": "$form_id",
+            "row_count": {"$sum": 1},
+            "unpaid_count": {"$sum": {"$cond": [{"$eq": ["$remittance", True]}, 0, 1]}},
+            "unshipped_count": {"$sum": {"$cond": [{"$ne": [{"$ifNull": ["$shipped", ""]}, ""]}, 0, 1]}},
+        }})
+        found = {g["_id"]: {k: g[k] for k in EMPTY_FORM_STATS} for g in self.order_rows.aggregate(pipeline)}
+
+        query = {} if form_id is None else {"_id": _oid(form_id)}
+        ops = [
+            UpdateOne({"_id": f["_id"]}, {
+                "$set": {"stats": found.get(str(f["_id"]), EMPTY_FORM_STATS)},
+                "$inc": {"version": 1}
+            })
+            for f in self.forms.find(query, {"_id": 1})
+        ]
+        if ops:
+            self.forms.bulk_write(ops, ordered=False)
+        return len(ops)
+
+
+class MongoViewerRepository:
+    """檢視者名單（forms.allowed_viewers）；異動時一併遞增表單版本號。"""
+
+    def __init__(self, collection):
+        self.forms = collection
+
+    def list(self, form_id):
+        """賣家檢視時才讀取的檢視者名單。"""
+        oid = _oid(form_id)
+        f = (self.forms.find_one({"_id": oid}, {"allowed_viewers": 1}) if oid else None) or {}
+        return f.get("allowed_viewers", [])
+
+    def _update(self, form_id, update):
+        oid = _oid(form_id)
+        if oid is None:
+            return False
+        update = dict(update, **{"$set": {"updated_at": datetime.utcnow()}, "$inc": {"version": 1}})
+        return self.forms.update_one({"_id": oid}, update).matched_count > 0
+
+    def add(self, form_id, email):
+        return self._update(form_id, {"$addToSet": {"allowed_viewers": email}})
+
+    def remove(self, form_id, email):
+        return self._update(form_id, {"$pull": {"allowed_viewers": email}})
+
+
+def _row_query(form_id, filters):
+    """將篩選條件轉成 MongoDB 查詢，全部交給資料庫執行。"""
+    query = {"form_id": form_id}
+    filters = filters or {}
+
+    remittance = filters.get("remittance")
+    if remittance is not None:
+        query["remittance"] = remittance
+
+    shipped = filters.get("shipped")
+    if shipped is True:
+        query["shipped"] = {"$nin": [None, ""]}
+    elif shipped is False:
+        query["shipped"] = {"$in": [None, ""]}
+
+    if filters.get("buyer_email"):
+        query["buyer_email"] = filters["buyer_email"]
+
+    if filters.get("item_name"):
+        query["item_name"] = {"$regex": re.escape(filters["item_name"]), "$options": "i"}
+
+    return query
+
+
+def _row_cursor_filter(sort_key, direction, value, row_id):
+    """Keyset 分頁：取得排序位置在 (value, row_id) 之後的訂單。
+
+    MongoDB 排序時 null 最小，且 $gt/$lt 不會比對到 null，所以需另外處理。
+    """
+    after_id = {"$gt": row_id} if direction == ASCENDING else {"$lt": row_id}
+    if sort_key == "_id":
+        return {"_id": after_id}
+
+    same_value = {sort_key: value, "_id": after_id}
+    if value is None:
+        if direction == ASCENDING:
+            return {"$or": [{sort_key: {"$ne": None}}, same_value]}
+        return same_value
+
+    if direction == ASCENDING:
+        return {"$or": [{sort_key: {"$gt": value}}, same_value]}
+    return {"$or": [{sort_key: {"$lt": value}}, {sort_key: None}, same_value]}
+
+
+def _summary_key(form_id, row):
+    return {"form_id": form_id, "buyer_name": row.get("buyer_name"), "buyer_email": row.get("buyer_email")}
+
+
+def _rollup_key(form_id, row):
+    return {
+        "form_id": form_id,
+        "day": row_day(row.get("_id")),
+        "buyer_name": row.get("buyer_name"),
+        "buyer_email": row.get("buyer_email"),
+        "item_name": row.get("item_name"),
+    }
+
+
+_ROLLUP_FIELDS = ("form_id", "day", "buyer_name", "buyer_email", "item_name")
+
+
+def _summary_group_fields():
+    """由 order_rows 計算 SUMMARY_COUNTERS 的 $group 欄位（重建買家統計與每日彙總共用）。"""
+    shipped = {"$ne": [{"$ifNull": ["$shipped", ""]}, ""]}
+    paid = {"$eq": ["$remittance", True]}
+    total = {"$ifNull": ["$item_total", 0]}
+    return {
+        "row_count": {"$sum": 1},
+        "total": {"$sum": total},
+        "paid_count": {"$sum": {"$cond": [paid, 1, 0]}},
+        "paid_total": {"$sum": {"$cond": [paid, total, 0]}},
+        "unpaid_count": {"$sum": {"$cond": [paid, 0, 1]}},
+        "unpaid_total": {"$sum": {"$cond": [paid, 0, total]}},
+        "shipped_count": {"$sum": {"$cond": [shipped, 1, 0]}},
+        "shipped_total": {"$sum": {"$cond": [shipped, total, 0]}},
+    }
+
+
+class MongoRowRepository:
+    def __init__(self, db):
+        self.order_rows = db["order_rows"]
+        self.order_archive = db["order_archive"]
+        self.buyer_summaries = db["buyer_summaries"]
+        self.daily_rollups = db["daily_rollups"]
+
+    # ---------------- 讀取 ----------------
+    def find_page(self, form_id, filters, sort_key, direction, limit, cursor_token=None, include_social=True, fields=None):
+        """依條件讀取一頁訂單，回傳 (rows, next_cursor)；limit 為 None 時回傳全部。
+
+        fields 有值時只讀取這些欄位（另加 _id、version 與排序欄位）。
+        """
+        query = _row_query(form_id, filters)
+        if cursor_token:
+            value, row_id = decode_row_cursor(cursor_token, sort_key)
+            query = {"$and": [query, _row_cursor_filter(sort_key, direction, value, row_id)]}
+
+        sort = [(sort_key, direction)]
+        if sort_key != "_id":
+            sort.append(("_id", direction))
+
+        columns = projected_fields(fields, sort_key, include_social)
+        if columns is not None:
+            projection = dict.fromkeys(columns + ("_id", "version"), 1)
+        else:
+            projection = ROW_PROJECTION if include_social else BUYER_ROW_PROJECTION
+        cur = self.order_rows.find(query, projection).sort(sort)
+        if limit is None:
+            return list(cur), None
+
+        # 多讀一筆用來判斷是否還有下一頁
+        rows = list(cur.limit(limit + 1))
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_row_cursor(sort_key, rows[-1])
+
+    def search(self, form_id, text, filters, limit, cursor_token=None, include_social=True, fields=None):
+        """以 search_keys 索引搜尋訂單（買家名稱 / email / 物品名稱，不分大小寫），依建立順序回傳 (rows, next_cursor)。
+
+        text 為 normalize_search 後的搜尋字串；索引鍵只篩出候選訂單，兩個字元以上再以 $regex 確認包含整個字串。
+        """
+        query = _row_query(form_id, filters)
+        query["search_keys"] = {"$all": search_query_keys(text)}
+        clauses = [query]
+        if len(text) > 1:
+            pattern = {"$regex": re.escape(text), "$options": "i"}
+            clauses.append({"$or": [{field: pattern} for field in SEARCH_FIELDS]})
+        if cursor_token:
+            _, row_id = decode_row_cursor(cursor_token, "_id")
+            clauses.append({"_id": {"$gt": row_id}})
+
+        columns = projected_fields(fields, "_id", include_social)
+        if columns is not None:
+            projection = dict.fromkeys(columns + ("_id", "version"), 1)
+        else:
+            projection = ROW_PROJECTION if include_social else BUYER_ROW_PROJECTION
+        cur = self.order_rows.find({"$and": clauses} if len(clauses) > 1 else query, projection)
+        rows = list(cur.sort("_id", ASCENDING).limit(limit + 1))
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_row_cursor("_id", rows[-1])
+
+    def iter_rows(self, form_id, filters, include_social=True, batch_size=500):
+        """依建立順序逐批讀取符合條件的訂單（匯出用）。"""
+        projection = ROW_PROJECTION if include_social else BUYER_ROW_PROJECTION
+        return self.order_rows.find(_row_query(form_id, filters), projection).sort("_id", ASCENDING).batch_size(batch_size)
+
+    def get(self, form_id, row_id):
+        return self.order_rows.find_one({"_id": row_id, "form_id": form_id}, ROW_PROJECTION)
+
+    def id_at_index(self, form_id, index):
+        """依舊版前端傳來的列表 index 找出訂單 _id（訂單依 _id 即建立順序排列）。"""
+        if index < 0:
+            return None
+        cur = self.order_rows.find({"form_id": form_id}, {"_id": 1}).sort("_id", ASCENDING).skip(index).limit(1)
+        for r in cur:
+            return r["_id"]
+        return None
+
+    # ---------------- 寫入 ----------------
+    def insert(self, form_id, row):
+        self.order_rows.insert_one(dict(row, form_id=form_id, search_keys=row_search_keys(row)))
+        self._apply_to_summary(form_id, new_row=row)
+
+    def insert_many(self, form_id, rows):
+        self.order_rows.insert_many(
+            [dict(r, form_id=form_id, search_keys=row_search_keys(r)) for r in rows], ordered=False
+        )
+        self._add_to_summary(form_id, rows)
+
+    def _write_filter(self, form_id, row_id, version):
+        """單筆訂單寫入條件：有帶 version 時只在版本相符時才寫入。"""
+        query = {"_id": row_id, "form_id": form_id}
+        if version is not None:
+            query["version"] = version
+        return query
+
+    def update(self, form_id, row_id, version, changes):
+        """以 version 做樂觀鎖更新一筆訂單，回傳 (old_row, new_row)；條件不成立時回傳 None。
+
+        修改到搜尋欄位時，搜尋鍵要由修改後的整筆內容計算：先讀出目前內容，
+        再以讀到的版本為條件把 changes 與 search_keys 在同一次寫入中更新。
+        沒帶 version 時，讀取後被其他人修改就重新讀取再試。
+        """
+        if not any(k in changes for k in SEARCH_FIELDS):
+            old_row = self.order_rows.find_one_and_update(
+                self._write_filter(form_id, row_id, version),
+                {"$set": changes, "$inc": {"version": 1}},
+                projection=ROW_PROJECTION
+            )
+            if not old_row:
+                return None
+            return self._finish_update(form_id, old_row, changes)
+
+        for _ in range(UPDATE_RETRIES):
+            current = self.order_rows.find_one(self._write_filter(form_id, row_id, version), ROW_PROJECTION)
+            if not current:
+                return None
+            new_row = dict(current, **changes)
+            old_row = self.order_rows.find_one_and_update(
+                self._write_filter(form_id, row_id, current.get("version")),
+                {"$set": dict(changes, search_keys=row_search_keys(new_row)), "$inc": {"version": 1}},
+                projection=ROW_PROJECTION
+            )
+            if old_row:
+                return self._finish_update(form_id, old_row, changes)
+            if version is not None:
+                return None
+        return None
+
+    def _finish_update(self, form_id, old_row, changes):
+        new_row = dict(old_row, **changes)
+        new_row["version"] = old_row.get("version", 0) + 1
+        self._apply_to_summary(form_id, old_row=old_row, new_row=new_row)
+        return old_row, new_row
+
+    def update_many(self, form_id, updates, patch):
+        """把同一組欄位（patch）寫入多筆訂單：一次讀取、一次 bulk_write，買家統計也合併成一次寫入。
+
+        每筆以讀到的 version 為條件寫入，同時寫入這次批次的 batch_token；寫入後以 batch_token 一次查出實際寫入的訂單，
+        其餘（讀取之後才被修改或刪除）再以一次 $in 讀取，歸入衝突或找不到。統計的增量只計入實際寫入的訂單。
+        updates 為 [(row_id, version)]；回傳 (updated, conflicts, missing)，格式見 plan_batch_update。
+        """
+        ids = [row_id for row_id, _ in updates]
+        current = {r["_id"]: r for r in self.order_rows.find({"_id": {"$in": ids}, "form_id": form_id}, ROW_PROJECTION)}
+        planned, conflicts, missing = plan_batch_update(current, updates, patch)
+        if not planned:
+            return planned, conflicts, missing
+
+        token = str(ObjectId())
+        ops = [
+            UpdateOne(
+                {"_id": old_row["_id"], "form_id": form_id, "version": old_row.get("version")},
+                {"$set": dict(patch, batch_token=token), "$inc": {"version": 1}}
+            )
+            for old_row, _ in planned
+        ]
+        result = self.order_rows.bulk_write(ops, ordered=False)
+        if result.matched_count < len(ops):
+            planned_ids = [old_row["_id"] for old_row, _ in planned]
+            # 以 _id 索引查詢；寫入之後才被其他人修改的訂單仍保有這次的 batch_token，算已更新
+            applied = {r["_id"] for r in self.order_rows.find({"_id": {"$in": planned_ids}, "batch_token": token}, {"_id": 1})}
+            lost = [row_id for row_id in planned_ids if row_id not in applied]
+            after = {r["_id"]: r for r in self.order_rows.find({"_id": {"$in": lost}, "form_id": form_id}, ROW_PROJECTION)}
+            for row_id in lost:
+                if row_id in after:
+                    conflicts.append(after[row_id])
+                else:
+                    missing.append(row_id)
+            planned = [(old_row, new_row) for old_row, new_row in planned if old_row["_id"] in applied]
+        if planned:
+            self._bulk_apply_to_summary(form_id, [(old_row, -1) for old_row, _ in planned] + [(new_row, 1) for _, new_row in planned])
+        return planned, conflicts, missing
+
+    def delete(self, form_id, row_id, version):
+        """刪除一筆訂單並回傳刪除前的內容；條件不成立時回傳 None。"""
+        old_row = self.order_rows.find_one_and_delete(self._write_filter(form_id, row_id, version), projection=ROW_PROJECTION)
+        if old_row:
+            self._apply_to_summary(form_id, old_row=old_row)
+        return old_row
+
+    def clear(self, form_id):
+        self.order_rows.delete_many({"form_id": form_id})
+        self.order_archive.delete_many({"form_id": form_id})
+        self.buyer_summaries.delete_many({"form_id": form_id})
+        self.daily_rollups.delete_many({"form_id": form_id})
+
+    # ---------------- 買家統計與每日彙總（增量維護） ----------------
+    def _apply_to_summary(self, form_id, old_row=None, new_row=None):
+        """依一筆訂單的變動以 $inc 原子更新買家統計與每日彙總。"""
+        changes = []
+        if old_row is not None:
+            changes.append((old_row, -1))
+        if new_row is not None:
+            changes.append((new_row, 1))
+        self._bulk_apply_to_summary(form_id, changes, prune=old_row is not None)
+
+    def _add_to_summary(self, form_id, rows):
+        """批次新增訂單時，先在記憶體合併各買家的增量，再以一次 bulk_write 寫入。"""
+        self._bulk_apply_to_summary(form_id, [(row, 1) for row in rows])
+
+    def _bulk_apply_to_summary(self, form_id, changes, prune=False, rollups=True):
+        """changes 為 [(row, sign)]；在記憶體合併增量後，兩個 collection 各以一次 bulk_write 寫入。
+
+        prune=True 時（有訂單被移除）依序在 $inc 之後刪除 row_count 歸零的統計；
+        rollups=False 時只更新買家統計（封存訂單時每日彙總不變）。
+        """
+        targets = [(self.buyer_summaries, _summary_key)]
+        if rollups:
+            targets.append((self.daily_rollups, _rollup_key))
+        for collection, key_of in targets:
+            merged = {}
+            for row, sign in changes:
+                key = key_of(form_id, row)
+                _, delta = merged.setdefault(tuple(key.values()), (key, {}))
+                for k, v in row_summary_delta(row, sign).items():
+                    delta[k] = delta.get(k, 0) + v
+            ops = []
+            for key, delta in merged.values():
+                delta = {k: v for k, v in delta.items() if v}
+                if delta:
+                    ops.append(UpdateOne(key, {"$inc": delta}, upsert=True))
+            if prune:
+                # 買家（或該日的買家與物品）已沒有任何訂單時移除該筆統計
+                ops.extend(DeleteOne(dict(key, row_count={"$lte": 0})) for key, _ in merged.values())
+            if ops:
+                collection.bulk_write(ops, ordered=prune)
+
+    def summaries(self, form_id, buyer_email=None):
+        """讀取表單的買家統計（buyer_email 有值時只讀該買家）。"""
+        query = {"form_id": form_id}
+        if buyer_email is not None:
+            query["buyer_email"] = buyer_email
+        summaries = []
+        for s in self.buyer_summaries.find(query, {"_id": 0, "form_id": 0}):
+            for k in SUMMARY_COUNTERS:
+                s.setdefault(k, 0)
+            summaries.append(s)
+        return summaries
+
+    def rebuild_summaries(self, form_id=None):
+        """由 order_rows 重新計算買家統計，用來修正累積誤差。回傳重建的統計筆數。"""
+        pipeline = []
+        if form_id is not None:
+            pipeline.append({"$match": {"form_id": form_id}})
+        pipeline.append({"$group": dict(
+            _summary_group_fields(),
+            _id={"form_id": "$form_id", "buyer_name": "$buyer_name", "buyer_email": "$buyer_email"}
+        )})
+
+        docs = []
+        for g in self.order_rows.aggregate(pipeline):
+            doc = dict(g["_id"])
+            for k in SUMMARY_COUNTERS:
+                doc[k] = g.get(k, 0)
+            docs.append(doc)
+
+        self.buyer_summaries.delete_many({} if form_id is None else {"form_id": form_id})
+        if docs:
+            self.buyer_summaries.insert_many(docs, ordered=False)
+        return len(docs)
+
+
+    def rebuild_search(self, form_id=None, batch_size=1000):
+        """重新計算 search_keys（搬移舊資料或直接修改資料庫後執行）。回傳處理的訂單筆數。"""
+        query = {} if form_id is None else {"form_id": form_id}
+        projection = dict.fromkeys(SEARCH_FIELDS, 1)
+        count = 0
+        ops = []
+        for row in self.order_rows.find(query, projection):
+            ops.append(UpdateOne({"_id": row["_id"]}, {"$set": {"search_keys": row_search_keys(row)}}))
+            if len(ops) >= batch_size:
+                self.order_rows.bulk_write(ops, ordered=False)
+                count += len(ops)
+                ops = []
+        if ops:
+            self.order_rows.bulk_write(ops, ordered=False)
+            count += len(ops)
+        return count
+
+
+# 報表分組的 $group _id 與輸出欄位名稱
+_REPORT_GROUP_KEYS = {
+    "buyer": ("buyer_email", "$buyer_email"),
+    "item": ("item_name", "$item_name"),
+    "month": ("month", {"$substr": ["$day", 0, 7]}),
+}
+
+
+class MongoReportRepository:
+    """賣家跨表單報表：以 aggregation pipeline 彙總 daily_rollups（由 MongoRowRepository 增量維護）。"""
+
+    def __init__(self, db):
+        self.forms = db["forms"]
+        self.order_rows = db["order_rows"]
+        self.order_archive = db["order_archive"]
+        self.daily_rollups = db["daily_rollups"]
+
+    def seller_report(self, owner_id, group_by, start_day=None, end_day=None, form_ids=None):
+        """owner_id 所有表單（或其中的 form_ids）在 [start_day, end_day] 間的訂單，依 group_by 分組。
+
+        回傳 [{<分組欄位>, SUMMARY_COUNTERS..., form_count}]；月份依時間排序，其餘依金額由大到小。
+        """
+        owned = [str(f["_id"]) for f in self.forms.find({"owner_id": owner_id}, {"_id": 1})]
+        if form_ids is not None:
+            wanted = set(form_ids)
+            owned = [form_id for form_id in owned if form_id in wanted]
+        if not owned:
+            return []
+
+        match = {"form_id": {"$in": owned}}
+        day = {}
+        if start_day:
+            day["$gte"] = start_day
+        if end_day:
+            day["$lte"] = end_day
+        if day:
+            match["day"] = day
+
+        field, key = _REPORT_GROUP_KEYS[group_by]
+        group = {"_id": key, "forms": {"$addToSet": "$form_id"}}
+        for k in SUMMARY_COUNTERS:
+            group[k] = {"$sum": f"${k}"}
+        if group_by == "buyer":
+            group["buyer_name"] = {"$max": "$buyer_name"}
+        sort = {"_id": ASCENDING} if group_by == "month" else {"total": DESCENDING, "_id": ASCENDING}
+
+        report = []
+        for g in self.daily_rollups.aggregate([{"$match": match}, {"$group": group}, {"$sort": sort}]):
+            entry = {field: g["_id"]}
+            if group_by == "buyer":
+                entry["buyer_name"] = g.get("buyer_name")
+            for k in SUMMARY_COUNTERS:
+                entry[k] = g.get(k, 0)
+            entry["form_count"] = len(g.get("forms", ()))
+            report.append(entry)
+        return report
+
+    def rebuild(self, form_id=None):
+        """由 order_rows 與封存的訂單重新計算每日彙總（舊資料第一次使用報表前、或修正累積誤差時執行）。回傳彙總筆數。"""
+        created = {"$convert": {"input": "$_id", "to": "objectId", "onError": None, "onNull": None}}
+        day = {"$ifNull": [{"$dateToString": {"format": "%Y-%m-%d", "date": {"$toDate": created}}}, ""]}
+        pipeline = []
+        if form_id is not None:
+            pipeline.append({"$match": {"form_id": form_id}})
+        pipeline.append({"$group": dict(_summary_group_fields(), _id={
+            "form_id": "$form_id", "day": day,
+            "buyer_name": "$buyer_name", "buyer_email": "$buyer_email", "item_name": "$item_name",
+        })})
+
+        docs = {}
+        for g in self.order_rows.aggregate(pipeline, allowDiskUse=True):
+            doc = dict(g["_id"])
+            for k in SUMMARY_COUNTERS:
+                doc[k] = g.get(k, 0)
+            docs[tuple(g["_id"][k] for k in _ROLLUP_FIELDS)] = doc
+
+        # 封存的訂單是壓縮的，在記憶體中解開後加總
+        for chunk in self.order_archive.find({} if form_id is None else {"form_id": form_id}, {"form_id": 1, "data": 1}):
+            for row in unpack_rows(chunk["data"]):
+                key = _rollup_key(chunk["form_id"], row)
+                doc = docs.setdefault(tuple(key[k] for k in _ROLLUP_FIELDS), dict(key, **dict.fromkeys(SUMMARY_COUNTERS, 0)))
+                for k, v in row_summary_delta(row).items():
+                    doc[k] += v
+        docs = list(docs.values())
+
+        self.daily_rollups.delete_many({} if form_id is None else {"form_id": form_id})
+        if docs:
+            self.daily_rollups.insert_many(docs, ordered=False)
+        return len(docs)
+
+
+class MongoArchiveRepository:
+    """封存的訂單（order_archive collection）。
+
+    每份 document 是同一張表單、同一個月份中依 _id 連續的最多 ARCHIVE_CHUNK_ROWS 筆訂單
+    （data 為 pack_rows 壓縮的欄位式 JSON），同一張表單的各份 document 依 _id 排序且互不重疊，
+    以 (form_id, last_id) 索引依序讀取。
+    """
+
+    def __init__(self, db, rows):
+        self.order_rows = db["order_rows"]
+        self.order_archive = db["order_archive"]
+        self.rows = rows
+
+    def archive(self, form_id, before_id, limit):
+        """把 _id 小於 before_id、已匯款且已出貨的訂單（最多 limit 筆）搬到封存區，回傳搬移的訂單。
+
+        先寫入封存區再逐筆以讀到的 version 為條件刪除：中途失敗時訂單只會重複而不會遺失（下次執行會合併），
+        刪除前被修改的訂單留在 order_rows 並從封存區移除。買家統計扣除搬移的訂單，每日彙總不變。
+        """
+        candidates = list(self.order_rows.find(
+            {"form_id": form_id, "_id": {"$lt": before_id}, "remittance": True, "shipped": {"$nin": [None, ""]}},
+            ROW_PROJECTION
+        ).sort("_id", ASCENDING).limit(limit))
+        if not candidates:
+            return []
+        self._write(form_id, candidates)
+
+        archived, kept = [], []
+        for row in candidates:
+            deleted = self.order_rows.find_one_and_delete(
+                {"_id": row["_id"], "form_id": form_id, "version": row.get("version")}, projection={"_id": 1}
+            )
+            (archived if deleted else kept).append(row)
+        if kept:
+            self._write(form_id, (), removed=kept)
+        self.rows._bulk_apply_to_summary(form_id, [(row, -1) for row in archived], prune=True, rollups=False)
+        return archived
+
+    def _write(self, form_id, added, removed=()):
+        """依月份合併封存資料：只重寫 _id 範圍與這次異動重疊的 document，新的寫入後才刪除舊的。"""
+        by_month = {}
+        for row in list(added) + list(removed):
+            by_month.setdefault(row_month(row["_id"]), []).append(row["_id"])
+        added_ids = {row["_id"] for row in added}
+        for month, ids in by_month.items():
+            old = list(self.order_archive.find(
+                {"form_id": form_id, "month": month, "last_id": {"$gte": min(ids)}}, {"data": 1}
+            ))
+            existing = [row for doc in old for row in unpack_rows(doc["data"])]
+            chunks = archive_chunks(
+                existing,
+                [row for row in added if row["_id"] in ids],
+                [row["_id"] for row in removed if row["_id"] in ids and row["_id"] not in added_ids],
+            )
+            if chunks:
+                self.order_archive.insert_many(
+                    [dict(archive_chunk_info(rows), form_id=form_id, data=pack_rows(rows)) for rows in chunks],
+                    ordered=False
+                )
+            if old:
+                self.order_archive.delete_many({"_id": {"$in": [doc["_id"] for doc in old]}})
+
+    def _chunks(self, form_id, after_id=None, buyer_email=None):
+        query = {"form_id": form_id}
+        if after_id is not None:
+            query["last_id"] = {"$gt": after_id}
+        if buyer_email:
+            query["buyer_emails"] = buyer_email
+        for doc in self.order_archive.find(query, {"data": 1}).sort("last_id", ASCENDING):
+            yield doc["data"]
+
+    def find_page(self, form_id, filters, limit, cursor_token=None, include_social=True, fields=None):
+        """依建立順序讀取一頁封存的訂單，回傳 (rows, next_cursor)。"""
+        after_id = decode_row_cursor(cursor_token, "_id")[1] if cursor_token else None
+        filters = filters or {}
+        rows = iter_archived_rows(
+            self._chunks(form_id, after_id, filters.get("buyer_email")), filters, after_id, include_social, fields
+        )
+        return take_row_page(rows, limit)
+
+    def iter_rows(self, form_id, filters, include_social=True):
+        """依建立順序逐筆讀取符合條件的封存訂單（匯出用）。"""
+        filters = filters or {}
+        return iter_archived_rows(self._chunks(form_id, buyer_email=filters.get("buyer_email")), filters,
+                                  include_social=include_social)
+
+    def count(self, form_id):
+        return sum(doc.get("row_count", 0) for doc in self.order_archive.find({"form_id": form_id}, {"row_count": 1}))
+
+
+# 自動完成只回傳這些欄位
+BUYER_PROJECTION = {"_id": 0, "email": 1, "name": 1, "social": 1, "uses": 1}
+
+
+class MongoBuyerDirectory:
+    """賣家的買家名錄（buyer_directory collection）：新增或修改訂單時以 $inc 累加，依排名分數提供自動完成。"""
+
+    def __init__(self, db):
+        self.buyers = db["buyer_directory"]
+        self.forms = db["forms"]
+        self.order_rows = db["order_rows"]
+
+    def record(self, owner_id, rows):
+        """記錄 owner_id 的表單中新增 / 修改的訂單；新增了買家且超過上限時刪除排名最後的買家。"""
+        entries = buyer_entries(rows, datetime.now(timezone.utc).timestamp())
+        if not entries:
+            return
+        ops = []
+        for e in entries:
+            update_set = {"last_used_at": datetime.utcfromtimestamp(e["last_used"])}
+            update_set.update({k: e[k] for k in ("name", "social") if e[k]})
+            ops.append(UpdateOne(
+                {"owner_id": owner_id, "email": e["email"]},
+                {"$set": update_set, "$inc": {"uses": e["uses"], "score": e["score"]}},
+                upsert=True
+            ))
+        if self.buyers.bulk_write(ops, ordered=False).upserted_count:
+            self._trim(owner_id)
+
+    def _trim(self, owner_id):
+        if self.buyers.count_documents({"owner_id": owner_id}) <= BUYER_DIRECTORY_MAX + BUYER_DIRECTORY_SLACK:
+            return
+        tail = self.buyers.find({"owner_id": owner_id}, {"_id": 1}).sort("score", DESCENDING).skip(BUYER_DIRECTORY_MAX)
+        self.buyers.delete_many({"_id": {"$in": [b["_id"] for b in tail]}})
+
+    def suggest(self, owner_id, prefix, limit):
+        """email 或名稱以 prefix 開頭（不分大小寫）的買家，依排名取前 limit 筆；prefix 為空字串時不篩選。"""
+        query = {"owner_id": owner_id}
+        if prefix:
+            pattern = {"$regex": "^" + re.escape(prefix), "$options": "i"}
+            query["$or"] = [{"email": pattern}, {"name": pattern}]
+        cur = self.buyers.find(query, BUYER_PROJECTION).sort("score", DESCENDING).limit(limit)
+        return [{"email": b["email"], "name": b.get("name"), "social": b.get("social"), "uses": b.get("uses", 0)}
+                for b in cur]
+
+    def rebuild(self, owner_id=None):
+        """由 order_rows 重新建立買家名錄（依訂單建立時間計算分數），回傳買家筆數。
+
+        同時移除舊版 forms.recent_buyers 陣列。
+        """
+        query = {} if owner_id is None else {"owner_id": owner_id}
+        form_ids = {}
+        for f in self.forms.find(query, {"owner_id": 1}).sort("_id", ASCENDING):
+            form_ids.setdefault(f["owner_id"], []).append(str(f["_id"]))
+
+        total = 0
+        for owner, ids in form_ids.items():
+            rows = (
+                r for form_id in ids
+                for r in self.order_rows.find(
+                    {"form_id": form_id}, {"buyer_email": 1, "buyer_name": 1, "buyer_social": 1}
+                ).sort("_id", ASCENDING)
+            )
+            entries = sorted(buyer_entries(rows), key=lambda e: e["score"], reverse=True)[:BUYER_DIRECTORY_MAX]
+            self.buyers.delete_many({"owner_id": owner})
+            if entries:
+                self.buyers.insert_many([
+                    {"owner_id": owner, "email": e["email"], "name": e["name"], "social": e["social"],
+                     "uses": e["uses"], "score": e["score"], "last_used_at": datetime.utcfromtimestamp(e["last_used"])}
+                    for e in entries
+                ], ordered=False)
+            total += len(entries)
+        self.forms.update_many(dict(query, recent_buyers={"$exists": True}), {"$unset": {"recent_buyers": ""}})
+        return total
+
+
+class MongoMailJobStore:
+    """寄信佇列的工作（mail_jobs collection）；多個 worker 以 find_one_and_update 原子地領取。"""
+
+    def __init__(self, collection):
+        self.jobs = collection
+
+    def enqueue(self, to, subject, body, dedupe_key=None):
+        """寫入一筆 pending 工作；有相同 dedupe_key 的 pending 工作時改為更新內容。"""
+        now = datetime.utcnow()
+        job = {
+            "to": to,
+            "subject": subject,
+            "body": body,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+        }
+        if not dedupe_key:
+            self.jobs.insert_one(job)
+            return
+        try:
+            self.jobs.update_one(
+                {"dedupe_key": dedupe_key, "status": "pending"},
+                {"$set": {"subject": subject, "body": body, "updated_at": now},
+                 "$setOnInsert": {k: v for k, v in job.items() if k not in ("subject", "body")}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # 另一個請求同時寫入了同一個 dedupe_key，保留那一筆即可
+            pass
+
+    def claim(self, lock_seconds):
+        now = datetime.utcnow()
+        return self.jobs.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                # 寄送中途 crash 的工作：鎖過期後重新領取
+                {"status": "sending", "locked_until": {"$lte": now}},
+            ]},
+            {"$set": {"status": "sending", "locked_until": now + timedelta(seconds=lock_seconds)},
+             "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def mark_sent(self, job_id):
+        self.jobs.update_one({"_id": job_id}, {
+            "$set": {"status": "sent", "sent_at": datetime.utcnow()},
+            "$unset": {"locked_until": "", "dedupe_key": "", "body": ""}
+        })
+
+    def mark_retry(self, job_id, error, delay_seconds):
+        self.jobs.update_one({"_id": job_id}, {
+            "$set": {"status": "pending", "last_error": error,
+                     "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay_seconds)},
+            "$unset": {"locked_until": ""}
+        })
+
+    def mark_failed(self, job_id, error):
+        self.jobs.update_one({"_id": job_id}, {
+            "$set": {"status": "failed", "last_error": error},
+            "$unset": {"locked_until": "", "dedupe_key": ""}
+        })
+
+
+class _LazyCollection:
+    """collection 的代理：每次使用時取得目前 process 的 client 上對應的 collection。"""
+
+    def __init__(self, database, name):
+        self._database = database
+        self._name = name
+        self._pid = None
+        self._collection = None
+
+    def __getattr__(self, attr):
+        if self._pid != os.getpid():
+            self._collection = self._database.db[self._name]
+            self._pid = os.getpid()
+        return getattr(self._collection, attr)
+
+
+class MongoDatabase:
+    """每個 process 一個 MongoClient，第一次使用時才建立。
+
+    建立 client 會啟動背景監控 thread，fork 前建立的 client 不能在子 process 使用，
+    因此以 pid 判斷，fork 後自動重新建立。db["name"] 回傳 _LazyCollection，
+    repository 可以在 import 時建立而不連線。
+    """
+
+    def __init__(self, uri=None, db_name="datasys114", event_listeners=None, **client_options):
+        self.uri = uri
+        self.db_name = db_name
+        self.event_listeners = list(event_listeners or [])
+        self.client_options = client_options
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+
+    @property
+    def client(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._client = MongoClient(self.uri, event_listeners=self.event_listeners, **self.client_options)
+                    self._pid = os.getpid()
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    def __getitem__(self, name):
+        return _LazyCollection(self, name)
+
+    def __getattr__(self, attr):
+        # list_collection_names / create_collection 等 database 方法
+        return getattr(self.db, attr)
+
+
+class MongoStorage:
+    name = "mongo"
+
+    def __init__(self, uri=None, db_name="datasys114", event_listeners=None, **client_options):
+        self.database = MongoDatabase(uri, db_name, event_listeners=event_listeners, **client_options)
+        self.users = MongoUserRepository(self.database["users"])
+        self.forms = MongoFormRepository(self.database)
+        self.viewers = MongoViewerRepository(self.database["forms"])
+        self.rows = MongoRowRepository(self.database)
+        self.reports = MongoReportRepository(self.database)
+        self.archive = MongoArchiveRepository(self.database, self.rows)
+        self.buyers = MongoBuyerDirectory(self.database)
+        self.mail_jobs = MongoMailJobStore(self.database["mail_jobs"])
+
+    @property
+    def client(self):
+        return self.database.client
+
+    @property
+    def db(self):
+        return self.database.db
+
+    def ping(self, timeout=None):
+        """readiness 檢查；timeout（秒）限制包含選擇伺服器在內的總等待時間。"""
+        if timeout is None:
+            self.client.admin.command("ping")
+            return
+        with pymongo.timeout(timeout):
+            self.client.admin.command("ping")
+
+    def ensure_indexes(self):
+        return ensure_indexes(self.db)
+
+    def check_indexes(self):
+        return check_indexes(self.db)
+
+    def missing_indexes(self):
+        return missing_indexes(self.db)
+
+    def dedupe_unique_keys(self):
+        """合併會讓 unique 索引無法建立的重複資料，回傳 {collection: 處理的筆數}（create-indexes --dedupe 使用）。
+
+        - users：同一個 email 保留最早註冊的帳號，其他帳號的表單改歸這個帳號後刪除。
+        - mail_jobs：同一個 dedupe_key 的 pending 工作只保留最新的一筆（與 enqueue 合併時相同）。
+        - buyer_summaries / daily_rollups / buyer_directory：由訂單重新計算（rebuild-summaries / rebuild-buyers）。
+        """
+        fixed = {}
+        users = self.db["users"]
+        count = 0
+        for g in users.aggregate([
+            {"$group": {"_id": "$email", "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+        ]):
+            keep, *others = sorted(g["ids"])
+            self.db["forms"].update_many(
+                {"owner_id": {"$in": [str(i) for i in others]}}, {"$set": {"owner_id": str(keep)}, "$inc": {"version": 1}}
+            )
+            users.delete_many({"_id": {"$in": others}})
+            count += len(others)
+        if count:
+            self.buyers.rebuild()
+        fixed["users"] = count
+
+        jobs = self.db["mail_jobs"]
+        count = 0
+        for g in jobs.aggregate([
+            {"$match": {"status": "pending", "dedupe_key": {"$exists": True}}},
+            {"$group": {"_id": "$dedupe_key", "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+        ]):
+            *older, _ = sorted(g["ids"])
+            count += jobs.delete_many({"_id": {"$in": older}}).deleted_count
+        fixed["mail_jobs"] = count
+
+        for name, keys, rebuild in [
+            ("buyer_summaries", ("form_id", "buyer_name", "buyer_email"), self.rows.rebuild_summaries),
+            ("daily_rollups", _ROLLUP_FIELDS, self.reports.rebuild),
+            ("buyer_directory", ("owner_id", "email"), self.buyers.rebuild),
+        ]:
+            duplicated = list(self.db[name].aggregate([
+                {"$group": {"_id": {k: f"${k}" for k in keys}, "n": {"$sum": 1}}},
+                {"$match": {"n": {"$gt": 1}}},
+            ]))
+            if duplicated:
+                rebuild()
+            fixed[name] = len(duplicated)
+        return fixed
+
+    def drop_all(self):
+        """清空資料庫（只給基準測試等工具使用）。"""
+        for name in self.db.list_collection_names():
+            self.db.drop_collection(name)
+
+    def migrate_embedded_rows(self):
+        """把舊版 forms.rows 內嵌陣列搬到 order_rows；以 upsert 寫入，可重複執行。"""
+        forms = self.db["forms"]
+        order_rows = self.db["order_rows"]
+        moved_forms = 0
+        moved_rows = 0
+        for f in forms.find({"rows": {"$exists": True}}, {"rows": 1}):
+            form_id = str(f["_id"])
+            ops = []
+            for r in f.get("rows") or []:
+                doc = dict(r, form_id=form_id)
+                doc["_id"] = str(doc.get("_id") or ObjectId())
+                doc.setdefault("version", 1)
+                ops.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+            if ops:
+                order_rows.bulk_write(ops, ordered=False)
+            forms.update_one({"_id": f["_id"]}, {"$unset": {"rows": ""}})
+            moved_forms += 1
+            moved_rows += len(ops)
+        return moved_forms, moved_rows
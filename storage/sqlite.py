@@ -0,0 +1,1231 @@
+"""SQLite 實作：單一賣家的小型部署不需要資料庫伺服器，本機查詢通常在 1ms 以內。
+
+- 一般的資料表與索引（form_viewers 取代 MongoDB 的陣列欄位），
+  查詢計畫可用 `flask --app app check-indexes`（EXPLAIN QUERY PLAN）檢查。
+- WAL 模式：讀取不會被寫入擋住，多個 gunicorn worker 可以共用同一個檔案；
+  寫入以 BEGIN IMMEDIATE 取得寫鎖，忙碌時依 busy_timeout 等待。
+- 每個 thread（fork 後的每個 process）各自一條連線；所有 SQL 都是帶參數的固定字串，
+  sqlite3 模組會快取編譯好的 prepared statement（cached_statements），不會每次重新解析。
+- 買家統計讀取 buyer_summaries（每張表單每位買家一筆），賣家跨表單報表讀取 daily_rollups
+  （每張表單、每天、每個買家與物品一筆），都由 order_rows 上的 trigger 在同一個交易中增量維護；
+  舊版資料庫第一次開啟時由現有訂單建立 buyer_summaries。
+- 訂單搜尋使用 FTS5 trigram 全文索引 order_rows_search（SQLite 3.34 以上），同樣由 trigger 維護；
+  一、兩個字元的搜尋 trigram 無法使用，改為在該表單的訂單中逐筆比對。
+- 封存的訂單（已匯款且已出貨的舊訂單）搬到 order_archive，每張表單每個月份切成數份壓縮的資料；
+  買家統計不再計入，每日彙總照常計入。
+- 賣家的買家名錄 buyer_directory 以 (owner_id, score) 索引依排名讀取，每位賣家筆數有上限。
+- id 沿用 ObjectId 字串格式，與 MongoDB 版的 API 回應、分頁 cursor 相容。
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+
+from storage.base import (
+    ASCENDING, BATCH_PATCH_FIELDS, BUYER_DIRECTORY_MAX, BUYER_DIRECTORY_SLACK, EMPTY_FORM_STATS, ROW_FIELDS,
+    SEARCH_FIELDS, SUMMARY_COUNTERS, DuplicateEmailError, row_day, row_month, row_summary_delta, search_matches,
+    buyer_entries, pack_rows, unpack_rows, archive_chunks, archive_chunk_info, iter_archived_rows, take_row_page, projected_fields, plan_batch_update, encode_row_cursor, decode_row_cursor,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT,
+    email TEXT NOT NULL,
+    password TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email_unique ON users (email);
+
+CREATE TABLE IF NOT EXISTS forms (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    description TEXT NOT NULL DEFAULT '',
+    owner_id TEXT NOT NULL,
+    owner_email TEXT,
+    fields TEXT NOT NULL DEFAULT '{}',
+    row_count INTEGER NOT NULL DEFAULT 0,
+    unpaid_count INTEGER NOT NULL DEFAULT 0,
+    unshipped_count INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 1,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS forms_owner_id ON forms (owner_id, id);
+
+CREATE TABLE IF NOT EXISTS form_viewers (
+    form_id TEXT NOT NULL REFERENCES forms (id) ON DELETE CASCADE,
+    email TEXT NOT NULL,
+    PRIMARY KEY (form_id, email)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS form_viewers_email ON form_viewers (email, form_id);
+
+-- 每位賣家的買家名錄；score 見 storage.base.buyer_score_weight。舊版的 form_recent_buyers 已由此表取代
+CREATE TABLE IF NOT EXISTS buyer_directory (
+    owner_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    name TEXT,
+    social TEXT,
+    uses INTEGER NOT NULL DEFAULT 0,
+    score REAL NOT NULL DEFAULT 0,
+    last_used_at TEXT,
+    PRIMARY KEY (owner_id, email)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS buyer_directory_owner_score ON buyer_directory (owner_id, score DESC);
+DROP TABLE IF EXISTS form_recent_buyers;
+
+CREATE TABLE IF NOT EXISTS order_rows (
+    id TEXT PRIMARY KEY,
+    form_id TEXT NOT NULL REFERENCES forms (id) ON DELETE CASCADE,
+    buyer_name TEXT,
+    buyer_email TEXT,
+    item_name TEXT,
+    item_qty REAL,
+    item_price REAL,
+    item_total REAL,
+    remittance INTEGER NOT NULL DEFAULT 0,
+    shipped TEXT,
+    shipping_fee REAL,
+    buyer_social TEXT,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS order_rows_form_id ON order_rows (form_id, id);
+CREATE INDEX IF NOT EXISTS order_rows_form_buyer ON order_rows (form_id, buyer_email, id);
+
+-- 封存的訂單：同一張表單、同一個月份中依 id 連續的最多 ARCHIVE_CHUNK_ROWS 筆為一列，
+-- data 為 pack_rows 壓縮的欄位式 JSON；同一張表單的各列依 id 排序且互不重疊
+CREATE TABLE IF NOT EXISTS order_archive (
+    id INTEGER PRIMARY KEY,
+    form_id TEXT NOT NULL REFERENCES forms (id) ON DELETE CASCADE,
+    month TEXT NOT NULL,
+    first_id TEXT NOT NULL,
+    last_id TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    buyer_emails TEXT NOT NULL DEFAULT '[]',
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS order_archive_form_last ON order_archive (form_id, last_id);
+
+-- 每張表單每位買家的統計（只計入 order_rows 中的訂單）；NULL 欄位存成空字串，才能作為 upsert 的唯一鍵
+CREATE TABLE IF NOT EXISTS buyer_summaries (
+    form_id TEXT NOT NULL REFERENCES forms (id) ON DELETE CASCADE,
+    buyer_name TEXT NOT NULL,
+    buyer_email TEXT NOT NULL,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    total REAL NOT NULL DEFAULT 0,
+    paid_count INTEGER NOT NULL DEFAULT 0,
+    paid_total REAL NOT NULL DEFAULT 0,
+    unpaid_count INTEGER NOT NULL DEFAULT 0,
+    unpaid_total REAL NOT NULL DEFAULT 0,
+    shipped_count INTEGER NOT NULL DEFAULT 0,
+    shipped_total REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (form_id, buyer_name, buyer_email)
+) WITHOUT ROWID;
+
+-- NULL 欄位存成空字串，才能作為 upsert 的唯一鍵
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    form_id TEXT NOT NULL REFERENCES forms (id) ON DELETE CASCADE,
+    day TEXT NOT NULL,
+    buyer_name TEXT NOT NULL,
+    buyer_email TEXT NOT NULL,
+    item_name TEXT NOT NULL,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    total REAL NOT NULL DEFAULT 0,
+    paid_count INTEGER NOT NULL DEFAULT 0,
+    paid_total REAL NOT NULL DEFAULT 0,
+    unpaid_count INTEGER NOT NULL DEFAULT 0,
+    unpaid_total REAL NOT NULL DEFAULT 0,
+    shipped_count INTEGER NOT NULL DEFAULT 0,
+    shipped_total REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (form_id, day, buyer_name, buyer_email, item_name)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS mail_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    to_email TEXT NOT NULL,
+    subject TEXT,
+    body TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL,
+    locked_until REAL,
+    dedupe_key TEXT,
+    last_error TEXT,
+    created_at REAL,
+    updated_at REAL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS mail_jobs_status_next_attempt ON mail_jobs (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS mail_jobs_status_locked_until ON mail_jobs (status, locked_until);
+CREATE UNIQUE INDEX IF NOT EXISTS mail_jobs_dedupe_key_pending ON mail_jobs (dedupe_key) WHERE status = 'pending';
+"""
+
+
+
+def _rollup_counters(ref):
+    """一筆訂單（ref 為 NEW / OLD / order_rows）對每日彙總各欄位的貢獻。"""
+    total = f"IFNULL({ref}.item_total, 0)"
+    paid = f"{ref}.remittance != 0"
+    shipped = f"COALESCE({ref}.shipped, '') != ''"
+    return {
+        "row_count": "1",
+        "total": total,
+        "paid_count": f"({paid})",
+        "paid_total": f"(CASE WHEN {paid} THEN {total} ELSE 0 END)",
+        "unpaid_count": f"(NOT ({paid}))",
+        "unpaid_total": f"(CASE WHEN {paid} THEN 0 ELSE {total} END)",
+        "shipped_count": f"({shipped})",
+        "shipped_total": f"(CASE WHEN {shipped} THEN {total} ELSE 0 END)",
+    }
+
+
+def _rollup_key_values(ref):
+    return [f"{ref}.form_id", f"row_day({ref}.id)"] + [f"IFNULL({ref}.{k}, '')" for k in ("buyer_name", "buyer_email", "item_name")]
+
+
+_ROLLUP_KEY = "form_id, day, buyer_name, buyer_email, item_name"
+
+
+def _summary_key_values(ref):
+    return [f"{ref}.form_id"] + [f"IFNULL({ref}.{k}, '')" for k in ("buyer_name", "buyer_email")]
+
+
+_SUMMARY_KEY = "form_id, buyer_name, buyer_email"
+
+
+def _counter_upsert(table, key, key_values, ref, sign):
+    counters = _rollup_counters(ref)
+    prefix = "-" if sign < 0 else ""
+    values = key_values + [prefix + counters[k] for k in SUMMARY_COUNTERS]
+    updates = ", ".join(f"{k} = {k} + excluded.{k}" for k in SUMMARY_COUNTERS)
+    return (
+        f"INSERT INTO {table} ({key}, {', '.join(SUMMARY_COUNTERS)}) VALUES ({', '.join(values)})"
+        f" ON CONFLICT ({key}) DO UPDATE SET {updates};"
+    )
+
+
+def _counter_prune(table, key, key_values):
+    where = " AND ".join(f"{k} = {v}" for k, v in zip(key.split(", "), key_values))
+    return f"DELETE FROM {table} WHERE {where} AND row_count <= 0;"
+
+
+def _rollup_upsert(ref, sign):
+    return _counter_upsert("daily_rollups", _ROLLUP_KEY, _rollup_key_values(ref), ref, sign)
+
+
+def _rollup_prune(ref):
+    return _counter_prune("daily_rollups", _ROLLUP_KEY, _rollup_key_values(ref))
+
+
+def _summary_upsert(ref, sign):
+    return _counter_upsert("buyer_summaries", _SUMMARY_KEY, _summary_key_values(ref), ref, sign)
+
+
+def _summary_prune(ref):
+    return _counter_prune("buyer_summaries", _SUMMARY_KEY, _summary_key_values(ref))
+
+
+# 每日彙總由 trigger 維護：新增 / 刪除 / 修改訂單時在同一個交易中更新（row_day 在每條連線上註冊）
+SCHEMA += f"""
+CREATE TRIGGER IF NOT EXISTS order_rows_rollup_insert AFTER INSERT ON order_rows BEGIN
+    {_rollup_upsert("NEW", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS order_rows_rollup_delete AFTER DELETE ON order_rows BEGIN
+    {_rollup_upsert("OLD", -1)}
+    {_rollup_prune("OLD")}
+END;
+CREATE TRIGGER IF NOT EXISTS order_rows_rollup_update
+AFTER UPDATE OF buyer_name, buyer_email, item_name, item_total, remittance, shipped ON order_rows BEGIN
+    {_rollup_upsert("OLD", -1)}
+    {_rollup_upsert("NEW", 1)}
+    {_rollup_prune("OLD")}
+END;
+"""
+
+# 買家統計同樣由 trigger 維護，讀取表單時只讀 buyer_summaries（每位買家一筆），不需掃描訂單
+SCHEMA += f"""
+CREATE TRIGGER IF NOT EXISTS order_rows_summary_insert AFTER INSERT ON order_rows BEGIN
+    {_summary_upsert("NEW", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS order_rows_summary_delete AFTER DELETE ON order_rows BEGIN
+    {_summary_upsert("OLD", -1)}
+    {_summary_prune("OLD")}
+END;
+CREATE TRIGGER IF NOT EXISTS order_rows_summary_update
+AFTER UPDATE OF buyer_name, buyer_email, item_total, remittance, shipped ON order_rows BEGIN
+    {_summary_upsert("OLD", -1)}
+    {_summary_upsert("NEW", 1)}
+    {_summary_prune("OLD")}
+END;
+"""
+
+# 訂單搜尋：FTS5 trigram 索引（不分大小寫的子字串比對），以 order_rows 為外部內容，不重複儲存欄位值。
+# rowid 對應 order_rows 的 rowid；VACUUM 可能重新編號，之後需執行 rebuild-summaries 重建索引。
+SEARCH_INDEXED = sqlite3.sqlite_version_info >= (3, 34, 0)
+_SEARCH_COLUMNS = ", ".join(SEARCH_FIELDS)
+
+
+def _search_index_write(ref, command=None):
+    values = ", ".join(f"{ref}.{k}" for k in SEARCH_FIELDS)
+    if command is None:
+        return f"INSERT INTO order_rows_search (rowid, {_SEARCH_COLUMNS}) VALUES ({ref}.rowid, {values});"
+    return (
+        f"INSERT INTO order_rows_search (order_rows_search, rowid, {_SEARCH_COLUMNS})"
+        f" VALUES ('{command}', {ref}.rowid, {values});"
+    )
+
+
+if SEARCH_INDEXED:
+    SCHEMA += f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS order_rows_search USING fts5(
+    {_SEARCH_COLUMNS}, content='order_rows', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS order_rows_search_insert AFTER INSERT ON order_rows BEGIN
+    {_search_index_write("NEW")}
+END;
+CREATE TRIGGER IF NOT EXISTS order_rows_search_delete AFTER DELETE ON order_rows BEGIN
+    {_search_index_write("OLD", "delete")}
+END;
+CREATE TRIGGER IF NOT EXISTS order_rows_search_update AFTER UPDATE OF {_SEARCH_COLUMNS} ON order_rows
+WHEN {" OR ".join(f"OLD.{k} IS NOT NEW.{k}" for k in SEARCH_FIELDS)}
+BEGIN
+    {_search_index_write("OLD", "delete")}
+    {_search_index_write("NEW")}
+END;
+"""
+
+
+def _sql_search_match(text, buyer_name, buyer_email, item_name):
+    return search_matches(text, {"buyer_name": buyer_name, "buyer_email": buyer_email, "item_name": item_name})
+
+
+_FTS_MATCH_PLAN = re.compile(r"VIRTUAL TABLE INDEX \d+:M")
+
+
+def _fts_phrase(text):
+    """搜尋字串轉成 FTS5 片語（雙引號包住，內部的雙引號重複一次），特殊字元不會被當成查詢語法。"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _like_escape(text):
+    """LIKE ... ESCAPE '\\' 的樣式中 \\ % _ 需跳脫。"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _search_clause(text):
+    """搜尋的 WHERE 條件與參數。
+
+    三個字元以上走 FTS5 索引；兩個字元以 LIKE 比對（不分大小寫僅限 ASCII，與 item_name 篩選相同）；
+    一個字元以 search_match 比對單字開頭。後兩者在該表單的訂單中逐筆比對。
+    """
+    if SEARCH_INDEXED and len(text) >= 3:
+        return "rowid IN (SELECT rowid FROM order_rows_search WHERE order_rows_search MATCH ?)", [_fts_phrase(text)]
+    if len(text) > 1:
+        pattern = "%" + _like_escape(text) + "%"
+        like = " OR ".join(f"{k} LIKE ? ESCAPE '\\'" for k in SEARCH_FIELDS)
+        return f"({like})", [pattern] * len(SEARCH_FIELDS)
+    return "search_match(?, buyer_name, buyer_email, item_name)", [text]
+
+
+_SAMPLE_ID = str(ObjectId())
+_SAMPLE_EMAIL = "index-check@example.com"
+
+# (說明, SQL, 參數) —— 與 indexes.HOT_QUERIES 對應的常用查詢
+HOT_QUERIES = [
+    ("登入 / 註冊：users by email", "SELECT * FROM users WHERE email = ?", (_SAMPLE_EMAIL,)),
+    ("Dashboard：owned 或 viewable", None, (_SAMPLE_ID, _SAMPLE_EMAIL, "", -1)),
+    ("賣家讀取訂單", "SELECT * FROM order_rows WHERE form_id = ? ORDER BY id", (_SAMPLE_ID,)),
+    ("買家讀取自己的訂單",
+     "SELECT * FROM order_rows WHERE form_id = ? AND buyer_email = ? ORDER BY id", (_SAMPLE_ID, _SAMPLE_EMAIL)),
+    ("訂單搜尋：order_rows_search (FTS5)", None, (_SAMPLE_ID, *_search_clause("abc")[1], -1)),
+    ("買家統計", None, (_SAMPLE_ID,)),
+    ("買家名錄：buyer_directory by owner_id / score", None, (_SAMPLE_ID, "ab%", "ab%", 8)),
+    ("歷史訂單：order_archive by form_id / last_id", None, (_SAMPLE_ID, "", None)),
+    ("賣家報表：daily_rollups by form_id / day", None, (_SAMPLE_ID, "2000-01-01", "2000-01-01", None, None)),
+    ("寄信 worker 領取工作", None, (0, 0)),
+]
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+def _new_id():
+    return str(ObjectId())
+
+
+class SQLiteDatabase:
+    """每個 thread 一條連線；path 為 ":memory:" 時使用同一 process 內共用的記憶體資料庫（測試用）。"""
+
+    def __init__(self, path, timeout=30, cached_statements=256):
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_pid = None
+        self._keepalive = None
+        if path == ":memory:":
+            # 記憶體資料庫在最後一條連線關閉時消失，保留一條連線讓它存活
+            self.path, self.uri = f"file:orders-{uuid.uuid4().hex}?mode=memory&cache=shared", True
+            self._keepalive = self._connect()
+        else:
+            self.path, self.uri = path, False
+
+    def _connect(self):
+        # isolation_level=None：預設 autocommit，多個語句的寫入以 transaction() 包起來
+        conn = sqlite3.connect(
+            self.path, timeout=self.timeout, uri=self.uri,
+            isolation_level=None, cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+        if not self.uri:
+            conn.execute("PRAGMA journal_mode = WAL")
+            # WAL 模式下 NORMAL 不會損毀資料庫，只在斷電時可能遺失最後幾筆交易
+            conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.create_function("row_day", 1, row_day, deterministic=True)
+        conn.create_function("search_match", 4, _sql_search_match, deterministic=True)
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # fork 前開啟的連線不能在子 process 使用
+            conn = self._connect()
+            self._local.conn, self._local.pid = conn, os.getpid()
+            self.ensure_schema(conn)
+        return conn
+
+    def ensure_schema(self, conn=None):
+        if self._schema_pid == os.getpid():
+            return
+        if conn is None:
+            # 新連線會在 connection() 中建立資料表
+            self.connection()
+            return
+        with self._schema_lock:
+            if self._schema_pid != os.getpid():
+                new_summaries = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'buyer_summaries'"
+                ).fetchone() is None
+                conn.executescript(SCHEMA)
+                if new_summaries:
+                    # 舊版資料庫的買家統計是即時計算的：第一次建立 buyer_summaries 時由現有訂單填入
+                    with self.transaction() as c:
+                        c.execute("DELETE FROM buyer_summaries")
+                        c.execute(_REBUILD_SUMMARIES_SQL, (None, None))
+                self._schema_pid = os.getpid()
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE 取得寫鎖，讀取與寫入之間不會被其他連線插隊。"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def _form_info(r):
+    return {
+        "_id": r["id"],
+        "title": r["title"],
+        "description": r["description"],
+        "owner_id": r["owner_id"],
+        "owner_email": r["owner_email"],
+        "fields": json.loads(r["fields"] or "{}"),
+        "version": r["version"],
+    }
+
+
+def _row_dict(r, include_social=True):
+    """sqlite3.Row 轉成訂單 dict；只讀取部分欄位（fields= 投影）時只包含查詢到的欄位。"""
+    keys = r.keys()
+    row = {"_id": r["id"]}
+    for k in ROW_FIELDS:
+        if k in keys:
+            row[k] = r[k]
+    if "remittance" in row:
+        row["remittance"] = bool(row["remittance"])
+    row["version"] = r["version"]
+    if not include_social:
+        row.pop("buyer_social", None)
+    return row
+
+
+def _row_params(row):
+    return [int(bool(row.get(k))) if k == "remittance" else row.get(k) for k in ROW_FIELDS]
+
+
+class SQLiteUserRepository:
+    def __init__(self, db):
+        self.db = db
+
+    def get_by_email(self, email):
+        r = self.db.execute("SELECT id, username, email, password FROM users WHERE email = ?", (email,)).fetchone()
+        if r is None:
+            return None
+        return {"_id": r["id"], "username": r["username"], "email": r["email"], "password": r["password"]}
+
+    def exists(self, email):
+        return self.db.execute("SELECT 1 FROM users WHERE email = ?", (email,)).fetchone() is not None
+
+    def create(self, username, email, password):
+        user_id = _new_id()
+        try:
+            self.db.execute(
+                "INSERT INTO users (id, username, email, password) VALUES (?, ?, ?, ?)",
+                (user_id, username, email, password)
+            )
+        except sqlite3.IntegrityError:
+            raise DuplicateEmailError(email)
+        return user_id
+
+    def set_password(self, user_id, password, expected=None):
+        cur = self.db.execute(
+            "UPDATE users SET password = ? WHERE id = ? AND (? IS NULL OR password = ?)",
+            (password, user_id, expected, expected)
+        )
+        return cur.rowcount > 0
+
+    def set_username(self, user_id, username):
+        self.db.execute("UPDATE users SET username = ? WHERE id = ?", (username, user_id))
+
+
+_FORM_INFO_COLUMNS = "id, title, description, owner_id, owner_email, fields, version"
+
+# 自己建立的表單與可檢視的表單各自走索引，再以主鍵依 id 排序分頁；LIMIT -1 表示不限筆數
+_LIST_FORMS_SQL = f"""
+SELECT {_FORM_INFO_COLUMNS}, row_count, unpaid_count, unshipped_count, updated_at FROM forms
+WHERE id IN (SELECT id FROM forms WHERE owner_id = ? UNION SELECT form_id FROM form_viewers WHERE email = ?)
+  AND id > ?
+ORDER BY id LIMIT ?
+"""
+
+_TOUCH_FORM_SQL = """
+UPDATE forms SET
+    version = version + 1,
+    updated_at = :updated_at,
+    description = COALESCE(:description, description),
+    row_count = (CASE WHEN :reset THEN 0 ELSE row_count END) + :row_count,
+    unpaid_count = (CASE WHEN :reset THEN 0 ELSE unpaid_count END) + :unpaid_count,
+    unshipped_count = (CASE WHEN :reset THEN 0 ELSE unshipped_count END) + :unshipped_count
+WHERE id = :form_id AND (:owner_id IS NULL OR owner_id = :owner_id)
+"""
+
+_REBUILD_STATS_SQL = """
+UPDATE forms SET
+    version = version + 1,
+    row_count = (SELECT COUNT(*) FROM order_rows WHERE form_id = forms.id),
+    unpaid_count = (SELECT COUNT(*) FROM order_rows WHERE form_id = forms.id AND remittance = 0),
+    unshipped_count = (SELECT COUNT(*) FROM order_rows WHERE form_id = forms.id AND (shipped IS NULL OR shipped = ''))
+WHERE ? IS NULL OR id = ?
+"""
+
+
+class SQLiteFormRepository:
+    def __init__(self, db):
+        self.db = db
+
+    def create(self, title, description, owner_id, owner_email, fields):
+        form_id = _new_id()
+        self.db.execute(
+            "INSERT INTO forms (id, title, description, owner_id, owner_email, fields, version, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, 1, ?)",
+            (form_id, title, description or "", owner_id, owner_email, json.dumps(fields, ensure_ascii=False), _now())
+        )
+        return form_id
+
+    def get(self, form_id, viewer_email=None):
+        if viewer_email is None:
+            r = self.db.execute(f"SELECT {_FORM_INFO_COLUMNS} FROM forms WHERE id = ?", (form_id,)).fetchone()
+            return _form_info(r) if r else None
+        r = self.db.execute(
+            f"SELECT {_FORM_INFO_COLUMNS}, EXISTS (SELECT 1 FROM form_viewers WHERE form_id = forms.id AND email = ?)"
+            " AS is_viewer FROM forms WHERE id = ?",
+            (viewer_email, form_id)
+        ).fetchone()
+        if r is None:
+            return None
+        f = _form_info(r)
+        f["is_viewer"] = bool(r["is_viewer"])
+        return f
+
+    def version(self, form_id):
+        r = self.db.execute("SELECT version FROM forms WHERE id = ?", (form_id,)).fetchone()
+        return r["version"] if r else None
+
+    def ids(self):
+        return [r[0] for r in self.db.execute("SELECT id FROM forms ORDER BY id")]
+
+    def list_for_user(self, user_id, email, after_id=None, limit=None, versions_only=False):
+        rows = self.db.execute(_LIST_FORMS_SQL, (user_id, email, after_id or "", -1 if limit is None else limit))
+        found = []
+        for r in rows:
+            if versions_only:
+                found.append({"_id": r["id"], "version": r["version"]})
+                continue
+            f = _form_info(r)
+            del f["fields"]
+            f["stats"] = {k: r[k] for k in EMPTY_FORM_STATS}
+            f["updated_at"] = datetime.fromisoformat(r["updated_at"]) if r["updated_at"] else None
+            found.append(f)
+        return found
+
+    def touch(self, form_id, stats_inc=None, description=None, reset_stats=False, owner_id=None):
+        """更新表單計數器、最後修改時間並遞增版本號；回傳是否有符合的表單。"""
+        stats_inc = stats_inc or {}
+        params = {
+            "form_id": form_id, "owner_id": owner_id, "updated_at": _now(),
+            "description": description, "reset": int(bool(reset_stats)),
+        }
+        for k in EMPTY_FORM_STATS:
+            params[k] = stats_inc.get(k, 0)
+        return self.db.execute(_TOUCH_FORM_SQL, params).rowcount > 0
+
+    def delete(self, form_id):
+        # 檢視者、訂單與封存的訂單以 ON DELETE CASCADE 一併刪除
+        self.db.execute("DELETE FROM forms WHERE id = ?", (form_id,))
+
+    def rebuild_stats(self, form_id=None):
+        return self.db.execute(_REBUILD_STATS_SQL, (form_id, form_id)).rowcount
+
+
+class SQLiteViewerRepository:
+    """檢視者名單（form_viewers）；異動時一併遞增表單版本號。"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def list(self, form_id):
+        return [r[0] for r in self.db.execute(
+            "SELECT email FROM form_viewers WHERE form_id = ? ORDER BY email", (form_id,))]
+
+    def _bump(self, conn, form_id):
+        return conn.execute(
+            "UPDATE forms SET version = version + 1, updated_at = ? WHERE id = ?", (_now(), form_id)
+        ).rowcount > 0
+
+    def add(self, form_id, email):
+        with self.db.transaction() as conn:
+            if not self._bump(conn, form_id):
+                return False
+            conn.execute("INSERT OR IGNORE INTO form_viewers (form_id, email) VALUES (?, ?)", (form_id, email))
+        return True
+
+    def remove(self, form_id, email):
+        with self.db.transaction() as conn:
+            if not self._bump(conn, form_id):
+                return False
+            conn.execute("DELETE FROM form_viewers WHERE form_id = ? AND email = ?", (form_id, email))
+        return True
+
+
+_ROW_COLUMNS = "id, " + ", ".join(ROW_FIELDS) + ", version"
+_INSERT_ROW_SQL = (
+    f"INSERT INTO order_rows (id, form_id, version, {', '.join(ROW_FIELDS)})"
+    f" VALUES (?, ?, ?, {', '.join('?' for _ in ROW_FIELDS)})"
+)
+_UPDATE_ROW_SQL = (
+    f"UPDATE order_rows SET {', '.join(f'{k} = ?' for k in ROW_FIELDS)}, version = version + 1 WHERE id = ?"
+)
+
+# 空字串是 NULL 存成的唯一鍵，回傳時還原為 None
+_SUMMARY_SQL = f"""
+SELECT NULLIF(buyer_name, '') AS buyer_name, NULLIF(buyer_email, '') AS buyer_email, {', '.join(SUMMARY_COUNTERS)}
+FROM buyer_summaries
+WHERE form_id = ? AND (? IS NULL OR buyer_email = ?)
+"""
+
+_REBUILD_SUMMARIES_SQL = f"""
+INSERT INTO buyer_summaries ({_SUMMARY_KEY}, {', '.join(SUMMARY_COUNTERS)})
+SELECT {', '.join(_summary_key_values('order_rows'))}, {', '.join(f'SUM({e})' for e in _rollup_counters('order_rows').values())}
+FROM order_rows
+WHERE ? IS NULL OR form_id = ?
+GROUP BY 1, 2, 3
+"""
+
+
+def _row_where(form_id, filters):
+    """將篩選條件轉成 WHERE 子句；組合有限，每種組合的 SQL 字串固定，可重複使用 prepared statement。"""
+    clauses = ["form_id = ?"]
+    params = [form_id]
+    filters = filters or {}
+
+    remittance = filters.get("remittance")
+    if remittance is not None:
+        clauses.append("remittance = ?")
+        params.append(int(remittance))
+
+    shipped = filters.get("shipped")
+    if shipped is True:
+        clauses.append("COALESCE(shipped, '') != ''")
+    elif shipped is False:
+        clauses.append("COALESCE(shipped, '') = ''")
+
+    if filters.get("buyer_email"):
+        clauses.append("buyer_email = ?")
+        params.append(filters["buyer_email"])
+
+    if filters.get("item_name"):
+        # LIKE 不分大小寫（ASCII），% 與 _ 需跳脫
+        clauses.append("item_name LIKE ? ESCAPE '\\'")
+        params.append(f"%{_like_escape(filters['item_name'])}%")
+
+    return clauses, params
+
+
+def _row_cursor_clause(column, direction, value, row_id):
+    """Keyset 分頁：排序位置在 (value, row_id) 之後的訂單；SQLite 與 MongoDB 一樣把 NULL 排在最小。"""
+    after_id = "id > ?" if direction == ASCENDING else "id < ?"
+    if column == "id":
+        return after_id, [row_id]
+    if value is None:
+        if direction == ASCENDING:
+            return f"({column} IS NOT NULL OR ({column} IS NULL AND {after_id}))", [row_id]
+        return f"({column} IS NULL AND {after_id})", [row_id]
+    if direction == ASCENDING:
+        return f"({column} > ? OR ({column} = ? AND {after_id}))", [value, value, row_id]
+    return f"({column} < ? OR {column} IS NULL OR ({column} = ? AND {after_id}))", [value, value, row_id]
+
+
+class SQLiteRowRepository:
+    def __init__(self, db):
+        self.db = db
+
+    # ---------------- 讀取 ----------------
+    def find_page(self, form_id, filters, sort_key, direction, limit, cursor_token=None, include_social=True, fields=None):
+        column = "id" if sort_key == "_id" else sort_key
+        columns = projected_fields(fields, sort_key, include_social)
+        select = _ROW_COLUMNS if columns is None else ", ".join(("id",) + columns + ("version",))
+        clauses, params = _row_where(form_id, filters)
+        if cursor_token:
+            value, row_id = decode_row_cursor(cursor_token, sort_key)
+            clause, extra = _row_cursor_clause(column, direction, value, row_id)
+            clauses.append(clause)
+            params.extend(extra)
+
+        order = "ASC" if direction == ASCENDING else "DESC"
+        order_by = f"{column} {order}" if column == "id" else f"{column} {order}, id {order}"
+        # 多讀一筆用來判斷是否還有下一頁
+        params.append(-1 if limit is None else limit + 1)
+        sql = f"SELECT {select} FROM order_rows WHERE {' AND '.join(clauses)} ORDER BY {order_by} LIMIT ?"
+        rows = [_row_dict(r, include_social) for r in self.db.execute(sql, params)]
+        if limit is None or len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_row_cursor(sort_key, rows[-1])
+
+    def search(self, form_id, text, filters, limit, cursor_token=None, include_social=True, fields=None):
+        """搜尋訂單（買家名稱 / email / 物品名稱，不分大小寫），依建立順序回傳 (rows, next_cursor)。"""
+        columns = projected_fields(fields, "_id", include_social)
+        select = _ROW_COLUMNS if columns is None else ", ".join(("id",) + columns + ("version",))
+        clauses, params = _row_where(form_id, filters)
+        if cursor_token:
+            _, row_id = decode_row_cursor(cursor_token, "_id")
+            clauses.append("id > ?")
+            params.append(row_id)
+        clause, extra = _search_clause(text)
+        clauses.append(clause)
+        params += extra + [limit + 1]
+        sql = f"SELECT {select} FROM order_rows WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?"
+        rows = [_row_dict(r, include_social) for r in self.db.execute(sql, params)]
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_row_cursor("_id", rows[-1])
+
+    def rebuild_search(self, form_id=None):
+        """由 order_rows 重建 FTS5 搜尋索引（舊資料庫第一次使用搜尋前，或 VACUUM 之後執行）。
+
+        索引不分表單，一律整個重建；回傳已索引的訂單筆數。
+        """
+        if not SEARCH_INDEXED:
+            return 0
+        self.db.execute("INSERT INTO order_rows_search (order_rows_search) VALUES ('rebuild')")
+        return self.db.execute("SELECT COUNT(*) FROM order_rows").fetchone()[0]
+
+    def iter_rows(self, form_id, filters, include_social=True, batch_size=500):
+        """依建立順序逐批讀取（匯出用）；每批是一次獨立查詢，串流期間不會一直持有讀取交易。"""
+        cursor = None
+        while True:
+            rows, cursor = self.find_page(form_id, filters, "_id", ASCENDING, batch_size, cursor, include_social)
+            yield from rows
+            if cursor is None:
+                return
+
+    def get(self, form_id, row_id):
+        r = self.db.execute(
+            f"SELECT {_ROW_COLUMNS} FROM order_rows WHERE id = ? AND form_id = ?", (row_id, form_id)
+        ).fetchone()
+        return _row_dict(r) if r else None
+
+    def id_at_index(self, form_id, index):
+        if index < 0:
+            return None
+        r = self.db.execute(
+            "SELECT id FROM order_rows WHERE form_id = ? ORDER BY id LIMIT 1 OFFSET ?", (form_id, index)
+        ).fetchone()
+        return r["id"] if r else None
+
+    # ---------------- 寫入 ----------------
+    def insert(self, form_id, row):
+        self.db.execute(_INSERT_ROW_SQL, [row["_id"], form_id, row.get("version", 1)] + _row_params(row))
+
+    def insert_many(self, form_id, rows):
+        with self.db.transaction() as conn:
+            conn.executemany(
+                _INSERT_ROW_SQL,
+                ([r["_id"], form_id, r.get("version", 1)] + _row_params(r) for r in rows)
+            )
+
+    def _locked_row(self, conn, form_id, row_id, version):
+        r = conn.execute(
+            f"SELECT {_ROW_COLUMNS} FROM order_rows WHERE id = ? AND form_id = ? AND (? IS NULL OR version = ?)",
+            (row_id, form_id, version, version)
+        ).fetchone()
+        return _row_dict(r) if r else None
+
+    def update(self, form_id, row_id, version, changes):
+        with self.db.transaction() as conn:
+            old_row = self._locked_row(conn, form_id, row_id, version)
+            if old_row is None:
+                return None
+            new_row = dict(old_row, **changes)
+            new_row["version"] = old_row["version"] + 1
+            conn.execute(_UPDATE_ROW_SQL, _row_params(new_row) + [row_id])
+        return old_row, new_row
+
+    def update_many(self, form_id, updates, patch):
+        """在同一個交易中讀取並以 executemany 更新多筆訂單；回傳 (updated, conflicts, missing)。"""
+        columns = [k for k in BATCH_PATCH_FIELDS if k in patch]
+        sql = f"UPDATE order_rows SET {', '.join(f'{k} = ?' for k in columns)}, version = version + 1 WHERE id = ?"
+        ids = [row_id for row_id, _ in updates]
+        with self.db.transaction() as conn:
+            current = {}
+            # 每批的 id 數量在 SQLite 的參數上限（999）以內
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                for r in conn.execute(
+                    f"SELECT {_ROW_COLUMNS} FROM order_rows WHERE form_id = ? AND id IN ({', '.join('?' for _ in chunk)})",
+                    [form_id] + chunk
+                ):
+                    current[r["id"]] = _row_dict(r)
+            planned, conflicts, missing = plan_batch_update(current, updates, patch)
+            conn.executemany(
+                sql,
+                ([int(bool(new_row[k])) if k == "remittance" else new_row[k] for k in columns] + [new_row["_id"]]
+                 for _, new_row in planned)
+            )
+        return planned, conflicts, missing
+
+    def delete(self, form_id, row_id, version):
+        with self.db.transaction() as conn:
+            old_row = self._locked_row(conn, form_id, row_id, version)
+            if old_row is not None:
+                conn.execute("DELETE FROM order_rows WHERE id = ?", (row_id,))
+        return old_row
+
+    def clear(self, form_id):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM order_rows WHERE form_id = ?", (form_id,))
+            conn.execute("DELETE FROM order_archive WHERE form_id = ?", (form_id,))
+            # 每日彙總中還有封存訂單的部分，一併清除
+            conn.execute("DELETE FROM daily_rollups WHERE form_id = ?", (form_id,))
+
+    # ---------------- 買家統計 ----------------
+    def summaries(self, form_id, buyer_email=None):
+        summaries = []
+        for r in self.db.execute(_SUMMARY_SQL, (form_id, buyer_email, buyer_email)):
+            s = {"buyer_name": r["buyer_name"], "buyer_email": r["buyer_email"]}
+            for k in SUMMARY_COUNTERS:
+                s[k] = r[k] or 0
+            summaries.append(s)
+        return summaries
+
+    def rebuild_summaries(self, form_id=None):
+        """由訂單重新計算買家統計（修正增量統計的誤差）；回傳統計筆數。"""
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM buyer_summaries WHERE ? IS NULL OR form_id = ?", (form_id, form_id))
+            return conn.execute(_REBUILD_SUMMARIES_SQL, (form_id, form_id)).rowcount
+
+
+_CLAIM_SQL = """
+SELECT id, to_email, subject, body, attempts FROM mail_jobs
+WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND locked_until <= ?)
+ORDER BY next_attempt_at LIMIT 1
+"""
+
+
+_REPORT_GROUP_SQL = {
+    "buyer": ("buyer_email", "buyer_email"),
+    "item": ("item_name", "item_name"),
+    "month": ("month", "substr(day, 1, 7)"),
+}
+
+_REPORT_SQL = """
+SELECT {key} AS group_key{extra},
+    SUM(row_count) AS row_count, SUM(total) AS total,
+    SUM(paid_count) AS paid_count, SUM(paid_total) AS paid_total,
+    SUM(unpaid_count) AS unpaid_count, SUM(unpaid_total) AS unpaid_total,
+    SUM(shipped_count) AS shipped_count, SUM(shipped_total) AS shipped_total,
+    COUNT(DISTINCT form_id) AS form_count
+FROM daily_rollups
+WHERE form_id IN (SELECT id FROM forms WHERE owner_id = ?)
+  AND (? IS NULL OR day >= ?) AND (? IS NULL OR day <= ?){forms}
+GROUP BY group_key
+ORDER BY {order}
+"""
+
+_REBUILD_ROLLUPS_SQL = f"""
+INSERT INTO daily_rollups ({_ROLLUP_KEY}, {', '.join(SUMMARY_COUNTERS)})
+SELECT {', '.join(_rollup_key_values('order_rows'))}, {', '.join(f'SUM({e})' for e in _rollup_counters('order_rows').values())}
+FROM order_rows
+WHERE ? IS NULL OR form_id = ?
+GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+_ADD_ROLLUP_SQL = (
+    f"INSERT INTO daily_rollups ({_ROLLUP_KEY}, {', '.join(SUMMARY_COUNTERS)})"
+    f" VALUES ({', '.join('?' for _ in range(5 + len(SUMMARY_COUNTERS)))})"
+    f" ON CONFLICT ({_ROLLUP_KEY}) DO UPDATE SET {', '.join(f'{k} = {k} + excluded.{k}' for k in SUMMARY_COUNTERS)}"
+)
+
+
+def _rollup_params(form_id, row):
+    delta = row_summary_delta(row)
+    key = [form_id, row_day(row["_id"])] + [row.get(k) or "" for k in ("buyer_name", "buyer_email", "item_name")]
+    return key + [delta.get(k, 0) for k in SUMMARY_COUNTERS]
+
+
+def _report_sql(group_by, form_count=None):
+    key = _REPORT_GROUP_SQL[group_by][1]
+    return _REPORT_SQL.format(
+        key=key,
+        extra=", MAX(NULLIF(buyer_name, '')) AS buyer_name" if group_by == "buyer" else "",
+        forms="" if form_count is None else f" AND form_id IN ({', '.join('?' for _ in range(form_count))})",
+        order="group_key" if group_by == "month" else "total DESC, group_key",
+    )
+
+
+class SQLiteReportRepository:
+    """賣家跨表單報表：彙總 daily_rollups（由 order_rows 的 trigger 維護）。"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def seller_report(self, owner_id, group_by, start_day=None, end_day=None, form_ids=None):
+        params = [owner_id, start_day, start_day, end_day, end_day]
+        if form_ids is not None:
+            if not form_ids:
+                return []
+            params.extend(form_ids)
+        field = _REPORT_GROUP_SQL[group_by][0]
+        report = []
+        for r in self.db.execute(_report_sql(group_by, None if form_ids is None else len(form_ids)), params):
+            # 彙總表中以空字串代表 NULL
+            entry = {field: r["group_key"] if group_by == "month" else (r["group_key"] or None)}
+            if group_by == "buyer":
+                entry["buyer_name"] = r["buyer_name"]
+            for k in SUMMARY_COUNTERS:
+                entry[k] = r[k] or 0
+            entry["form_count"] = r["form_count"]
+            report.append(entry)
+        return report
+
+    def rebuild(self, form_id=None):
+        """由 order_rows 與封存的訂單重新計算每日彙總（舊資料庫第一次使用報表前執行）。回傳彙總筆數。"""
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM daily_rollups WHERE ? IS NULL OR form_id = ?", (form_id, form_id))
+            conn.execute(_REBUILD_ROLLUPS_SQL, (form_id, form_id))
+            # 封存的訂單是壓縮的，在記憶體中解開後逐筆加回
+            for chunk in conn.execute(
+                "SELECT form_id, data FROM order_archive WHERE ? IS NULL OR form_id = ?", (form_id, form_id)
+            ).fetchall():
+                conn.executemany(_ADD_ROLLUP_SQL, (_rollup_params(chunk["form_id"], row) for row in unpack_rows(chunk["data"])))
+            return conn.execute(
+                "SELECT COUNT(*) FROM daily_rollups WHERE ? IS NULL OR form_id = ?", (form_id, form_id)
+            ).fetchone()[0]
+
+
+_ARCHIVE_CANDIDATES_SQL = f"""
+SELECT {_ROW_COLUMNS} FROM order_rows
+WHERE form_id = ? AND id < ? AND remittance != 0 AND COALESCE(shipped, '') != ''
+ORDER BY id LIMIT ?
+"""
+
+# 依 (form_id, last_id) 索引由 after_id 之後的資料依序讀取；buyer_email 有值時略過沒有該買家的資料
+_ARCHIVE_CHUNKS_SQL = """
+SELECT data FROM order_archive
+WHERE form_id = ? AND last_id > ?
+  AND (?3 IS NULL OR EXISTS (SELECT 1 FROM json_each(buyer_emails) WHERE value = ?3))
+ORDER BY last_id
+"""
+
+
+class SQLiteArchiveRepository:
+    """封存的訂單（order_archive）；搬移在單一交易中完成。"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def archive(self, form_id, before_id, limit):
+        """把 id 小於 before_id、已匯款且已出貨的訂單（最多 limit 筆）搬到封存區，回傳搬移的訂單。
+
+        刪除訂單時 trigger 會扣除每日彙總，刪除前先把這些訂單加回去，封存後賣家報表不變。
+        """
+        with self.db.transaction() as conn:
+            rows = [_row_dict(r) for r in conn.execute(_ARCHIVE_CANDIDATES_SQL, (form_id, before_id, limit))]
+            if not rows:
+                return []
+            self._write(conn, form_id, rows)
+            conn.executemany(_ADD_ROLLUP_SQL, (_rollup_params(form_id, row) for row in rows))
+            conn.executemany("DELETE FROM order_rows WHERE id = ?", ((row["_id"],) for row in rows))
+        return rows
+
+    def _write(self, conn, form_id, added):
+        """依月份合併封存資料：只重寫 id 範圍與這次搬移重疊的資料列。"""
+        by_month = {}
+        for row in added:
+            by_month.setdefault(row_month(row["_id"]), []).append(row)
+        for month, rows in by_month.items():
+            old = conn.execute(
+                "SELECT id, data FROM order_archive WHERE form_id = ? AND last_id >= ? AND month = ?",
+                (form_id, min(r["_id"] for r in rows), month)
+            ).fetchall()
+            existing = [row for r in old for row in unpack_rows(r["data"])]
+            conn.executemany("DELETE FROM order_archive WHERE id = ?", ((r["id"],) for r in old))
+            for chunk in archive_chunks(existing, rows):
+                info = archive_chunk_info(chunk)
+                conn.execute(
+                    "INSERT INTO order_archive (form_id, month, first_id, last_id, row_count, buyer_emails, data)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (form_id, info["month"], info["first_id"], info["last_id"], info["row_count"],
+                     json.dumps(info["buyer_emails"], ensure_ascii=False), pack_rows(chunk))
+                )
+
+    def _chunks(self, form_id, after_id=None, buyer_email=None):
+        # 先讀出所有符合的資料列再解壓縮，逐筆產生期間不持有讀取交易
+        found = self.db.execute(_ARCHIVE_CHUNKS_SQL, (form_id, after_id or "", buyer_email or None)).fetchall()
+        return (r["data"] for r in found)
+
+    def find_page(self, form_id, filters, limit, cursor_token=None, include_social=True, fields=None):
+        """依建立順序讀取一頁封存的訂單，回傳 (rows, next_cursor)。"""
+        after_id = decode_row_cursor(cursor_token, "_id")[1] if cursor_token else None
+        filters = filters or {}
+        rows = iter_archived_rows(
+            self._chunks(form_id, after_id, filters.get("buyer_email")), filters, after_id, include_social, fields
+        )
+        return take_row_page(rows, limit)
+
+    def iter_rows(self, form_id, filters, include_social=True):
+        """依建立順序逐筆讀取符合條件的封存訂單（匯出用）。"""
+        filters = filters or {}
+        return iter_archived_rows(self._chunks(form_id, buyer_email=filters.get("buyer_email")), filters,
+                                  include_social=include_social)
+
+    def count(self, form_id):
+        return self.db.execute(
+            "SELECT IFNULL(SUM(row_count), 0) FROM order_archive WHERE form_id = ?", (form_id,)
+        ).fetchone()[0]
+
+
+_RECORD_BUYER_SQL = """
+INSERT INTO buyer_directory (owner_id, email, name, social, uses, score, last_used_at)
+VALUES (:owner_id, :email, :name, :social, :uses, :score, :last_used_at)
+ON CONFLICT (owner_id, email) DO UPDATE SET
+    name = COALESCE(excluded.name, name),
+    social = COALESCE(excluded.social, social),
+    uses = uses + excluded.uses,
+    score = score + excluded.score,
+    last_used_at = MAX(COALESCE(last_used_at, ''), excluded.last_used_at)
+"""
+
+_TRIM_BUYERS_SQL = """
+DELETE FROM buyer_directory WHERE owner_id = ? AND email IN (
+    SELECT email FROM buyer_directory WHERE owner_id = ? ORDER BY score DESC LIMIT -1 OFFSET ?
+)
+"""
+
+# 依 (owner_id, score) 索引由排名最高的買家往下讀，找到 limit 筆符合前綴的就停止
+_SUGGEST_BUYERS_SQL = """
+SELECT email, name, social, uses FROM buyer_directory
+WHERE owner_id = ? AND (email LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\')
+ORDER BY score DESC LIMIT ?
+"""
+
+
+class SQLiteBuyerDirectory:
+    """賣家的買家名錄（buyer_directory）：新增或修改訂單時累加，依排名分數提供自動完成。"""
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def _params(owner_id, entry):
+        last_used = datetime.fromtimestamp(entry["last_used"], timezone.utc).replace(tzinfo=None).isoformat()
+        return dict(entry, owner_id=owner_id, last_used_at=last_used)
+
+    def record(self, owner_id, rows):
+        """記錄 owner_id 的表單中新增 / 修改的訂單；買家數超過上限時刪除排名最後的買家。"""
+        entries = buyer_entries(rows, time.time())
+        if not entries:
+            return
+        with self.db.transaction() as conn:
+            conn.executemany(_RECORD_BUYER_SQL, [self._params(owner_id, e) for e in entries])
+            count = conn.execute("SELECT COUNT(*) FROM buyer_directory WHERE owner_id = ?", (owner_id,)).fetchone()[0]
+            if count > BUYER_DIRECTORY_MAX + BUYER_DIRECTORY_SLACK:
+                conn.execute(_TRIM_BUYERS_SQL, (owner_id, owner_id, BUYER_DIRECTORY_MAX))
+
+    def suggest(self, owner_id, prefix, limit):
+        """email 或名稱以 prefix 開頭（不分大小寫）的買家，依排名取前 limit 筆；prefix 為空字串時不篩選。"""
+        pattern = _like_escape(prefix) + "%"
+        return [dict(r) for r in self.db.execute(_SUGGEST_BUYERS_SQL, (owner_id, pattern, pattern, limit))]
+
+    def rebuild(self, owner_id=None):
+        """由 order_rows 重新建立買家名錄（依訂單建立時間計算分數），回傳買家筆數。"""
+        owners = [owner_id] if owner_id is not None else [
+            r[0] for r in self.db.execute("SELECT DISTINCT owner_id FROM forms")]
+        total = 0
+        for owner in owners:
+            rows = self.db.execute(
+                "SELECT id AS _id, buyer_email, buyer_name, buyer_social FROM order_rows"
+                " WHERE form_id IN (SELECT id FROM forms WHERE owner_id = ?) ORDER BY id",
+                (owner,)
+            )
+            entries = sorted(buyer_entries(dict(r) for r in rows), key=lambda e: e["score"], reverse=True)
+            entries = entries[:BUYER_DIRECTORY_MAX]
+            with self.db.transaction() as conn:
+                conn.execute("DELETE FROM buyer_directory WHERE owner_id = ?", (owner,))
+                conn.executemany(_RECORD_BUYER_SQL, [self._params(owner, e) for e in entries])
+            total += len(entries)
+        return total
+
+
+class SQLiteMailJobStore:
+    """寄信佇列的工作（mail_jobs 資料表）；在 BEGIN IMMEDIATE 交易中領取，多個 worker 不會重複寄送。"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def enqueue(self, to, subject, body, dedupe_key=None):
+        now = time.time()
+        self.db.execute(
+            "INSERT INTO mail_jobs (to_email, subject, body, status, attempts, next_attempt_at, dedupe_key, created_at)"
+            " VALUES (?, ?, ?, 'pending', 0, ?, ?, ?)"
+            " ON CONFLICT (dedupe_key) WHERE status = 'pending'"
+            " DO UPDATE SET subject = excluded.subject, body = excluded.body, updated_at = excluded.created_at",
+            (to, subject, body, now, dedupe_key or None, now)
+        )
+
+    def claim(self, lock_seconds):
+        now = time.time()
+        with self.db.transaction() as conn:
+            r = conn.execute(_CLAIM_SQL, (now, now)).fetchone()
+            if r is None:
+                return None
+            conn.execute(
+                "UPDATE mail_jobs SET status = 'sending', locked_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (now + lock_seconds, r["id"])
+            )
+        return {"_id": r["id"], "to": r["to_email"], "subject": r["subject"], "body": r["body"],
+                "attempts": r["attempts"] + 1}
+
+    def mark_sent(self, job_id):
+        self.db.execute(
+            "UPDATE mail_jobs SET status = 'sent', sent_at = ?, locked_until = NULL, dedupe_key = NULL, body = NULL"
+            " WHERE id = ?",
+            (time.time(), job_id)
+        )
+
+    def mark_retry(self, job_id, error, delay_seconds):
+        self.db.execute(
+            "UPDATE mail_jobs SET status = 'pending', last_error = ?, next_attempt_at = ?, locked_until = NULL"
+            " WHERE id = ?",
+            (error, time.time() + delay_seconds, job_id)
+        )
+
+    def mark_failed(self, job_id, error):
+        self.db.execute(
+            "UPDATE mail_jobs SET status = 'failed', last_error = ?, locked_until = NULL, dedupe_key = NULL"
+            " WHERE id = ?",
+            (error, job_id)
+        )
+
+
+class SQLiteStorage:
+    name = "sqlite"
+
+    def __init__(self, path="orders.sqlite3", timeout=30):
+        self.database = SQLiteDatabase(path, timeout=timeout)
+        self.users = SQLiteUserRepository(self.database)
+        self.forms = SQLiteFormRepository(self.database)
+        self.viewers = SQLiteViewerRepository(self.database)
+        self.rows = SQLiteRowRepository(self.database)
+        self.reports = SQLiteReportRepository(self.database)
+        self.archive = SQLiteArchiveRepository(self.database)
+        self.buyers = SQLiteBuyerDirectory(self.database)
+        self.mail_jobs = SQLiteMailJobStore(self.database)
+
+    def ping(self, timeout=None):
+        self.database.execute("SELECT 1")
+
+    def ensure_indexes(self):
+        """資料表與索引在第一次連線時建立；這裡確認後回傳索引名稱。"""
+        self.database.ensure_schema()
+        return [
+            f"{r['tbl_name']}.{r['name']}" for r in self.database.execute(
+                "SELECT tbl_name, name FROM sqlite_master WHERE type = 'index' ORDER BY tbl_name, name")
+        ]
+
+    def missing_indexes(self):
+        """索引與資料表在同一個 schema 中建立，連線成功即表示都已存在。"""
+        return []
+
+    def dedupe_unique_keys(self):
+        """unique 索引從建立資料表時就存在，不會有重複資料。"""
+        return {}
+
+    def check_indexes(self):
+        """以 EXPLAIN QUERY PLAN 檢查常用查詢，回傳 [(說明, 是否通過, 計畫)]；SCAN 整張資料表即不通過。"""
+        sql_by_description = {
+            "Dashboard：owned 或 viewable": _LIST_FORMS_SQL,
+            "訂單搜尋：order_rows_search (FTS5)":
+                f"SELECT {_ROW_COLUMNS} FROM order_rows WHERE form_id = ? AND {_search_clause('abc')[0]} ORDER BY id LIMIT ?",
+            "買家統計": _SUMMARY_SQL.replace("(? IS NULL OR buyer_email = ?)", "1"),
+            "買家名錄：buyer_directory by owner_id / score": _SUGGEST_BUYERS_SQL,
+            "歷史訂單：order_archive by form_id / last_id": _ARCHIVE_CHUNKS_SQL,
+            "賣家報表：daily_rollups by form_id / day": _report_sql("month"),
+            "寄信 worker 領取工作": _CLAIM_SQL,
+        }
+        results = []
+        for description, sql, params in HOT_QUERIES:
+            sql = sql or sql_by_description[description]
+            plan = [r["detail"] for r in self.database.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            # FTS5 以 MATCH 查詢時計畫為 "SCAN ... VIRTUAL TABLE INDEX n:M..."，使用的是全文索引；
+            # json_each 掃描的是單一資料列中的 JSON 陣列，不是資料表
+            full_scan = any(
+                d.startswith("SCAN ") and " USING " not in d and not _FTS_MATCH_PLAN.search(d)
+                and not d.startswith("SCAN json_each ") for d in plan
+            )
+            results.append((description, not full_scan, plan))
+        return results
+
+    def drop_all(self):
+        """清空所有資料（只給基準測試等工具使用）。"""
+        with self.database.transaction() as conn:
+            for table in ("order_rows", "order_archive", "buyer_summaries", "daily_rollups", "buyer_directory", "form_viewers", "forms", "users", "mail_jobs"):
+                conn.execute(f"DELETE FROM {table}")
@@ -0,0 +1,58 @@
+"""兩種儲存實作共用的測試 fixture：SQLite 使用暫存檔，MongoDB 使用 mongomock（不需要資料庫伺服器）。"""
+import uuid
+
+import mongomock
+import pytest
+from bson.objectid import ObjectId
+
+import storage.mongo
+from storage.mongo import MongoStorage
+from storage.sqlite import SQLiteStorage
+
+
+def _create_indexes(self, indexes, session=None):
+    """mongomock 的 create_indexes 只轉交 unique / sparse，partialFilterExpression 會被丟掉；改為轉交全部選項。"""
+    return [
+        self.create_index(list(index.document["key"].items()), session=session,
+                          **{k: v for k, v in index.document.items() if k != "key"})
+        for index in indexes
+    ]
+
+
+@pytest.fixture(params=["sqlite", "mongo"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        s = SQLiteStorage(str(tmp_path / "orders.sqlite3"))
+    else:
+        monkeypatch.setattr(storage.mongo, "MongoClient", mongomock.MongoClient)
+        monkeypatch.setattr(mongomock.collection.Collection, "create_indexes", _create_indexes)
+        s = MongoStorage(db_name=f"test_{uuid.uuid4().hex}")
+    s.ensure_indexes()
+    yield s
+    s.drop_all()
+
+
+@pytest.fixture
+def form_id(store):
+    return store.forms.create("團購", "", "owner-1", "owner@example.com", {"remittance": True, "shipped": True})
+
+
+def make_row(**fields):
+    """app.py 寫入前的訂單格式：_id 為 ObjectId 字串、version 從 1 開始、item_total 由數量與單價計算。"""
+    row = {
+        "_id": str(ObjectId()),
+        "buyer_name": "Alice",
+        "buyer_email": "alice@example.com",
+        "item_name": "蘋果",
+        "item_qty": 1.0,
+        "item_price": 10.0,
+        "remittance": False,
+        "shipped": None,
+        "shipping_fee": 0.0,
+        "buyer_social": "@alice",
+        "version": 1,
+    }
+    row.update(fields)
+    if "item_total" not in fields:
+        row["item_total"] = row["item_qty"] * row["item_price"] + (row["shipping_fee"] or 0)
+    return row
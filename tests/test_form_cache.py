@@ -0,0 +1,65 @@
+"""表單快取：由快取的整張表單在記憶體中產生的頁面，必須與資料庫的 find_page 完全相同。"""
+import pytest
+
+from conftest import make_row
+from form_cache import MemoryFormCache
+from storage.base import ASCENDING, DESCENDING, ROW_SORT_KEYS, find_rows_page
+
+
+def seed_varied(store, form_id):
+    rows = []
+    for i in range(12):
+        rows.append(make_row(
+            buyer_name=["Alice", "Bob", None, "carol"][i % 4],
+            buyer_email=["alice@example.com", "bob@example.com", None, "carol@example.com"][i % 4],
+            item_name=["蘋果", "Apple pie", "香蕉", "apple"][i % 3],
+            item_qty=float(i % 5),
+            item_total=float((i * 7) % 4) * 10,
+            remittance=i % 3 == 0,
+            shipped=[None, "2024-05-01", "", "2024-04-01"][i % 4],
+        ))
+    store.rows.insert_many(form_id, rows)
+    return list(store.rows.iter_rows(form_id, {}))
+
+
+def walk(fetch, limit):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = fetch(cursor)
+        pages.append([dict(r) for r in rows])
+        if cursor is None or limit is None:
+            return pages
+
+
+@pytest.mark.parametrize("sort_key", sorted(ROW_SORT_KEYS))
+@pytest.mark.parametrize("direction", [ASCENDING, DESCENDING])
+def test_memory_page_matches_database(store, form_id, sort_key, direction):
+    all_rows = seed_varied(store, form_id)
+    for filters, include_social, fields, limit in [
+        ({}, True, None, 5),
+        ({}, True, None, None),
+        ({"remittance": False}, True, ["item_name"], 3),
+        ({"shipped": True, "item_name": "APPLE"}, True, None, 2),
+        ({"shipped": False}, True, None, 4),
+        ({"buyer_email": "bob@example.com"}, False, None, 2),
+    ]:
+        from_db = walk(lambda c: store.rows.find_page(
+            form_id, dict(filters), sort_key, direction, limit, c, include_social=include_social, fields=fields
+        ), limit)
+        in_memory = walk(lambda c: find_rows_page(
+            all_rows, filters, sort_key, direction, limit, c, include_social=include_social, fields=fields
+        ), limit)
+        assert in_memory == from_db, (filters, fields, limit)
+
+
+def test_memory_cache_replaces_old_version_and_evicts():
+    cache = MemoryFormCache(max_bytes=16 * 200, ttl=60)
+    cache.set("f1", 1, {"rows": []})
+    assert cache.get("f1", 1) == {"rows": []}
+    assert cache.get("f1", 2) is None
+    cache.set("f1", 2, {"rows": [1]})
+    assert cache.get("f1", 1) is None and cache.get("f1", 2) == {"rows": [1]}
+    for i in range(40):
+        cache.set(f"g{i}", 1, {"rows": ["x" * 100]})
+    assert cache.bytes <= cache.max_bytes and cache.evictions > 0
+    assert cache.hits == 2 and cache.misses == 2
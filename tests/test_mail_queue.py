@@ -0,0 +1,174 @@
+"""寄信佇列：以假的 smtplib.SMTP 測試去除重複、退避重試與 crash 後重新領取。"""
+import smtplib
+import time
+import types
+from datetime import datetime, timedelta
+
+import pytest
+
+import mail_queue
+import storage.mongo
+import storage.sqlite
+from mail_queue import MailQueue, PooledSMTP, SMTPSettings
+
+
+class FakeSMTP:
+    """記錄寄出的郵件；failures 為接下來要失敗的次數。"""
+
+    instances = []
+    sent = []
+    failures = 0
+
+    def __init__(self, host, port, timeout=None):
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def noop(self):
+        return (250, b"OK")
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if self.closed:
+            raise smtplib.SMTPServerDisconnected("connection closed")
+        if FakeSMTP.failures:
+            FakeSMTP.failures -= 1
+            raise smtplib.SMTPDataError(451, b"try again later")
+        FakeSMTP.sent.append((to_addrs[0], msg))
+
+    def quit(self):
+        self.closed = True
+
+
+class Clock:
+    """讓 SQLite（time.time）與 MongoDB（datetime.utcnow）的佇列看到同一個可快轉的時間。"""
+
+    def __init__(self, monkeypatch):
+        self.offset = 0.0
+        clock = self
+
+        class FakeDatetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return datetime.utcnow() + timedelta(seconds=clock.offset)
+
+        monkeypatch.setattr(storage.sqlite, "time", types.SimpleNamespace(time=lambda: time.time() + clock.offset))
+        monkeypatch.setattr(storage.mongo, "datetime", FakeDatetime)
+
+    def advance(self, seconds):
+        self.offset += seconds
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    monkeypatch.setattr(FakeSMTP, "instances", [])
+    monkeypatch.setattr(FakeSMTP, "sent", [])
+    monkeypatch.setattr(FakeSMTP, "failures", 0)
+    monkeypatch.setattr(mail_queue.smtplib, "SMTP", FakeSMTP)
+    settings = SMTPSettings(host="localhost", port=25, user="", password="", from_email="shop@example.com", use_tls=False)
+    conn = PooledSMTP(settings)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    return Clock(monkeypatch)
+
+
+@pytest.fixture
+def queue(store):
+    return MailQueue(store.mail_jobs, max_attempts=3, base_delay=5, in_process=False)
+
+
+def drain(queue, smtp):
+    count = 0
+    while queue.process_one(smtp):
+        count += 1
+    return count
+
+
+def test_sends_and_reuses_connection(queue, smtp):
+    queue.enqueue("a@example.com", "訂單", "第一封")
+    queue.enqueue("b@example.com", "訂單", "第二封")
+    assert drain(queue, smtp) == 2
+    assert [to for to, _ in FakeSMTP.sent] == ["a@example.com", "b@example.com"]
+    assert len(FakeSMTP.instances) == 1
+
+
+def test_pending_jobs_with_same_dedupe_key_are_merged(queue, smtp):
+    for i in range(3):
+        queue.enqueue("a@example.com", "重設密碼", f"連結 {i}", dedupe_key="reset:a@example.com")
+    queue.enqueue("b@example.com", "重設密碼", "連結 b", dedupe_key="reset:b@example.com")
+
+    assert drain(queue, smtp) == 2
+    assert [to for to, _ in FakeSMTP.sent] == ["a@example.com", "b@example.com"]
+    assert "連結 2".encode("utf-8") in _body(FakeSMTP.sent[0][1])
+
+    # 已寄出的工作不再佔用 dedupe_key
+    queue.enqueue("a@example.com", "重設密碼", "連結 3", dedupe_key="reset:a@example.com")
+    assert drain(queue, smtp) == 1
+
+
+def test_failed_send_is_retried_with_exponential_backoff(queue, smtp, clock):
+    FakeSMTP.failures = 2
+    queue.enqueue("a@example.com", "訂單", "內容")
+
+    assert queue.process_one(smtp) is True and FakeSMTP.sent == []
+    # 第一次失敗後等 base_delay 秒
+    clock.advance(4)
+    assert queue.process_one(smtp) is False
+    clock.advance(2)
+    assert queue.process_one(smtp) is True and FakeSMTP.sent == []
+    # 第二次失敗後等 2 倍
+    clock.advance(9)
+    assert queue.process_one(smtp) is False
+    clock.advance(2)
+    assert queue.process_one(smtp) is True
+    assert len(FakeSMTP.sent) == 1
+
+
+def test_job_fails_after_max_attempts(queue, smtp, clock):
+    FakeSMTP.failures = 10
+    queue.enqueue("a@example.com", "訂單", "內容", dedupe_key="order:1")
+    for _ in range(3):
+        assert queue.process_one(smtp) is True
+        clock.advance(60)
+    assert queue.process_one(smtp) is False
+    assert FakeSMTP.sent == []
+    # 標記為 failed 後同一個 dedupe_key 可以重新排入
+    FakeSMTP.failures = 0
+    queue.enqueue("a@example.com", "訂單", "內容", dedupe_key="order:1")
+    assert drain(queue, smtp) == 1
+
+
+def test_claim_of_crashed_worker_is_released_after_lock_expires(queue, store, smtp, clock):
+    queue.enqueue("a@example.com", "訂單", "內容")
+    # 另一個 worker 領取後 crash，沒有標記結果
+    job = store.mail_jobs.claim(queue.lock_seconds)
+    assert job is not None and job["attempts"] == 1
+    assert queue.process_one(smtp) is False
+
+    clock.advance(queue.lock_seconds + 1)
+    assert queue.process_one(smtp) is True
+    assert len(FakeSMTP.sent) == 1
+    assert queue.process_one(smtp) is False
+
+
+def test_reconnects_when_server_dropped_connection(queue, smtp):
+    queue.enqueue("a@example.com", "訂單", "第一封")
+    drain(queue, smtp)
+    FakeSMTP.instances[0].closed = True
+    queue.enqueue("b@example.com", "訂單", "第二封")
+    assert drain(queue, smtp) == 1
+    assert len(FakeSMTP.instances) == 2 and len(FakeSMTP.sent) == 2
+
+
+def _body(message):
+    """MIMEText 以 base64 編碼 UTF-8 內容，解碼後比對。"""
+    import email
+    return email.message_from_string(message).get_payload(decode=True)
@@ -0,0 +1,51 @@
+"""訂單匯入 / 匯出：匯入與新增 / 修改訂單共用 parse_row_amounts 的規則，CSV 匯出不會產生公式。"""
+import csv
+import io
+
+import pytest
+
+from order_io import ImportRowError, build_import_row, export_columns, iter_csv_export, parse_row_amounts
+
+
+def test_amounts_default_to_zero_and_compute_total():
+    assert parse_row_amounts({"item_qty": "2", "item_price": 30, "shipping_fee": ""}, False) == {
+        "item_qty": 2.0, "item_price": 30.0, "shipping_fee": 0.0, "item_total": 60.0,
+    }
+    assert parse_row_amounts({"item_qty": 2, "item_price": 30, "shipping_fee": 60}, True)["item_total"] == 120.0
+    assert parse_row_amounts({}, False)["item_qty"] == 0.0
+
+
+@pytest.mark.parametrize("record", [
+    {"item_qty": "abc"},
+    {"item_price": "nan"},
+    {"shipping_fee": "inf"},
+    {"item_qty": -1},
+    {"item_price": "-0.5"},
+])
+def test_invalid_amounts_are_rejected(record):
+    with pytest.raises(ImportRowError):
+        parse_row_amounts(record, False)
+
+
+def test_import_accepts_the_same_rows_as_add_row():
+    record = {"buyer_name": "Alice", "buyer_email": "alice@example.com", "item_name": "蘋果", "item_qty": "0"}
+    row = build_import_row(record, False)
+    assert row["item_qty"] == 0.0 and row["item_total"] == 0.0
+    with pytest.raises(ImportRowError):
+        build_import_row(dict(record, item_qty="-2"), False)
+
+
+def test_csv_export_neutralises_formulas():
+    rows = [
+        {"buyer_name": "=HYPERLINK(\"http://evil\",\"x\")", "item_name": "+cmd", "item_qty": -1.0, "item_total": 10.0},
+        {"buyer_name": "@SUM(A1)", "item_name": "\tTab", "item_qty": 1.0, "item_total": 0.0},
+        {"buyer_name": "-2+3", "item_name": "\rCR", "item_qty": 2.0, "item_total": 5.0},
+        {"buyer_name": "Alice", "item_name": "蘋果 = 2", "item_qty": 3.0, "item_total": 1.5},
+    ]
+    columns = export_columns({}, True)
+    text = b"".join(iter_csv_export(rows, columns)).decode("utf-8-sig")
+    records = list(csv.reader(io.StringIO(text, newline="")))[1:]
+    assert [r[0] for r in records] == ["'=HYPERLINK(\"http://evil\",\"x\")", "'@SUM(A1)", "'-2+3", "Alice"]
+    assert [r[2] for r in records] == ["'+cmd", "'\tTab", "'\rCR", "蘋果 = 2"]
+    # 數字欄位不加前綴
+    assert records[0][3] == "-1.0"
@@ -0,0 +1,369 @@
+"""儲存層（SQLiteStorage / MongoStorage）的行為測試：樂觀鎖、批次更新、增量統計、搜尋與封存。"""
+import pytest
+from pymongo.errors import OperationFailure
+
+from conftest import make_row
+from storage.mongo import MongoStorage
+from storage.base import ASCENDING, DuplicateEmailError, SUMMARY_COUNTERS, archive_cutoff_id, normalize_search, row_search_keys, row_summary_delta
+
+
+def all_rows(store, form_id):
+    return list(store.rows.iter_rows(form_id, {}))
+
+
+def expected_summaries(rows):
+    """由訂單重新計算的買家統計，與增量維護的 buyer_summaries 比對。"""
+    expected = {}
+    for row in rows:
+        key = (row.get("buyer_name") or None, row.get("buyer_email") or None)
+        s = expected.setdefault(key, dict.fromkeys(SUMMARY_COUNTERS, 0))
+        for k, v in row_summary_delta(row).items():
+            s[k] += v
+    return {k: v for k, v in expected.items() if v["row_count"]}
+
+
+def actual_summaries(store, form_id):
+    return {
+        (s["buyer_name"] or None, s["buyer_email"] or None): {k: s[k] for k in SUMMARY_COUNTERS}
+        for s in store.rows.summaries(form_id) if s["row_count"]
+    }
+
+
+def buyer_report(store):
+    return {
+        r["buyer_email"]: {k: r[k] for k in SUMMARY_COUNTERS}
+        for r in store.reports.seller_report("owner-1", "buyer") if r["row_count"]
+    }
+
+
+def expected_report(rows):
+    report = {}
+    for row in rows:
+        r = report.setdefault(row.get("buyer_email") or None, dict.fromkeys(SUMMARY_COUNTERS, 0))
+        for k, v in row_summary_delta(row).items():
+            r[k] += v
+    return report
+
+
+def assert_consistent(store, form_id, archived=()):
+    rows = all_rows(store, form_id)
+    assert actual_summaries(store, form_id) == expected_summaries(rows)
+    assert buyer_report(store) == expected_report(rows + list(archived))
+
+
+def search_ids(store, form_id, text):
+    rows, _ = store.rows.search(form_id, normalize_search(text), {}, 50)
+    return {r["_id"] for r in rows}
+
+
+def seed(store, form_id):
+    rows = [
+        make_row(buyer_name="Alice", buyer_email="alice@example.com", item_name="蘋果", remittance=True),
+        make_row(buyer_name="Alice", buyer_email="alice@example.com", item_name="香蕉", item_qty=2.0),
+        make_row(buyer_name="Bob", buyer_email="bob@example.com", item_name="蘋果", shipped="2024-05-01"),
+        make_row(buyer_name=None, buyer_email=None, item_name="葡萄", item_price=3.0),
+    ]
+    store.rows.insert_many(form_id, rows)
+    return rows
+
+
+# ---------------- 單筆更新 / 刪除 ----------------
+def test_dedupe_lets_unique_indexes_be_created(store):
+    """舊資料有重複 email / 重複的 pending 寄信工作時 unique 索引無法建立；--dedupe 合併後即可建立。"""
+    if not isinstance(store, MongoStorage):
+        pytest.skip("SQLite 的 unique 索引從建立資料表時就存在")
+    legacy = MongoStorage(db_name=store.database.db_name + "_legacy")
+    db = legacy.db
+    first = db["users"].insert_one({"username": "a", "email": "dup@example.com", "password": "h1"}).inserted_id
+    second = db["users"].insert_one({"username": "b", "email": "dup@example.com", "password": "h2"}).inserted_id
+    form_id = legacy.forms.create("團購", "", str(second), "dup@example.com", {})
+    db["mail_jobs"].insert_many([
+        {"status": "pending", "dedupe_key": "reset:dup@example.com", "body": "舊連結"},
+        {"status": "pending", "dedupe_key": "reset:dup@example.com", "body": "新連結"},
+    ])
+    assert ("users.email_unique", True) in legacy.missing_indexes()
+    with pytest.raises(OperationFailure):
+        legacy.ensure_indexes()
+
+    fixed = legacy.dedupe_unique_keys()
+    assert fixed["users"] == 1 and fixed["mail_jobs"] == 1
+    legacy.ensure_indexes()
+    assert legacy.missing_indexes() == []
+    assert [u["_id"] for u in db["users"].find()] == [first]
+    assert legacy.forms.get(form_id)["owner_id"] == str(first)
+    assert [j["body"] for j in db["mail_jobs"].find()] == ["新連結"]
+    with pytest.raises(DuplicateEmailError):
+        legacy.users.create("c", "dup@example.com", "h3")
+    legacy.drop_all()
+
+
+def test_update_requires_matching_version(store, form_id):
+    row = seed(store, form_id)[0]
+    assert store.rows.update(form_id, row["_id"], 2, {"item_qty": 3.0}) is None
+
+    old_row, new_row = store.rows.update(form_id, row["_id"], 1, {"item_qty": 3.0, "item_total": 30.0})
+    assert old_row["version"] == 1 and new_row["version"] == 2
+    assert store.rows.get(form_id, row["_id"])["item_total"] == 30.0
+    # 同一個版本號不能再寫一次
+    assert store.rows.update(form_id, row["_id"], 1, {"item_qty": 4.0}) is None
+    assert_consistent(store, form_id)
+
+
+def test_update_without_version_always_writes(store, form_id):
+    row = seed(store, form_id)[1]
+    store.rows.update(form_id, row["_id"], 1, {"remittance": True})
+    _, new_row = store.rows.update(form_id, row["_id"], None, {"shipped": "2024-06-01"})
+    assert new_row["version"] == 3
+    assert_consistent(store, form_id)
+
+
+def test_update_moving_row_to_another_buyer(store, form_id):
+    row = seed(store, form_id)[0]
+    store.rows.update(form_id, row["_id"], 1, {"buyer_name": "Carol", "buyer_email": "carol@example.com"})
+    summaries = actual_summaries(store, form_id)
+    assert summaries[("Carol", "carol@example.com")]["row_count"] == 1
+    assert summaries[("Alice", "alice@example.com")]["row_count"] == 1
+    assert_consistent(store, form_id)
+
+
+def test_delete_checks_version_and_updates_summaries(store, form_id):
+    rows = seed(store, form_id)
+    assert store.rows.delete(form_id, rows[2]["_id"], 5) is None
+    assert store.rows.delete(form_id, rows[2]["_id"], 1)["_id"] == rows[2]["_id"]
+    assert store.rows.get(form_id, rows[2]["_id"]) is None
+    assert ("Bob", "bob@example.com") not in actual_summaries(store, form_id)
+    assert_consistent(store, form_id)
+
+
+# ---------------- 批次更新 ----------------
+def test_update_many_classifies_rows(store, form_id):
+    rows = seed(store, form_id)
+    store.rows.update(form_id, rows[1]["_id"], 1, {"item_qty": 5.0})
+    updates = [(rows[0]["_id"], 1), (rows[1]["_id"], 1), (rows[2]["_id"], None), ("ffffffffffffffffffffffff", 1)]
+
+    planned, conflicts, missing = store.rows.update_many(form_id, updates, {"shipped": "2024-07-01"})
+
+    assert [new["_id"] for _, new in planned] == [rows[0]["_id"], rows[2]["_id"]]
+    assert [r["_id"] for r in conflicts] == [rows[1]["_id"]]
+    assert missing == ["ffffffffffffffffffffffff"]
+    assert store.rows.get(form_id, rows[0]["_id"])["shipped"] == "2024-07-01"
+    assert store.rows.get(form_id, rows[1]["_id"])["shipped"] is None
+    assert store.rows.get(form_id, rows[2]["_id"])["version"] == 2
+    assert_consistent(store, form_id)
+
+
+def test_update_many_then_single_update_keeps_versions(store, form_id):
+    rows = seed(store, form_id)
+    store.rows.update_many(form_id, [(r["_id"], 1) for r in rows], {"remittance": True})
+    assert store.rows.update(form_id, rows[0]["_id"], 1, {"item_qty": 9.0}) is None
+    assert store.rows.update(form_id, rows[0]["_id"], 2, {"item_qty": 9.0, "item_total": 90.0}) is not None
+    assert_consistent(store, form_id)
+
+
+def test_update_many_counts_rows_changed_around_the_write(store, form_id):
+    """MongoDB 一次 bulk_write：寫入前被修改的訂單算衝突，寫入後才被修改的訂單仍算已更新，統計不漂移。"""
+    if not isinstance(store, MongoStorage):
+        pytest.skip("SQLite 的批次更新在同一個交易內")
+    rows = seed(store, form_id)
+    collection = store.rows.order_rows
+    write = collection.bulk_write
+    writes = []
+
+    def interleaved(ops, **kwargs):
+        writes.append(len(ops))
+        # 規劃之後、寫入之前，另一位使用者修改了第二筆、刪除了第三筆
+        store.rows.update(form_id, rows[1]["_id"], 1, {"item_qty": 4.0, "item_total": 40.0})
+        store.rows.delete(form_id, rows[2]["_id"], 1)
+        result = write(ops, **kwargs)
+        # 第一筆寫入之後馬上又被修改
+        store.rows.update(form_id, rows[0]["_id"], None, {"remittance": False})
+        return result
+
+    collection.bulk_write = interleaved
+    try:
+        planned, conflicts, missing = store.rows.update_many(
+            form_id, [(rows[0]["_id"], 1), (rows[1]["_id"], 1), (rows[2]["_id"], 1)], {"shipped": "2024-07-01"}
+        )
+    finally:
+        del collection.bulk_write
+
+    assert writes == [3]
+    assert [new["_id"] for _, new in planned] == [rows[0]["_id"]]
+    assert [r["_id"] for r in conflicts] == [rows[1]["_id"]] and conflicts[0]["item_qty"] == 4.0
+    assert "batch_token" not in conflicts[0]
+    assert missing == [rows[2]["_id"]]
+    row = store.rows.get(form_id, rows[0]["_id"])
+    assert row["version"] == 3 and "batch_token" not in row
+    assert_consistent(store, form_id)
+
+
+# ---------------- 搜尋 ----------------
+def test_search_follows_edits(store, form_id):
+    rows = seed(store, form_id)
+    assert search_ids(store, form_id, "bob") == {rows[2]["_id"]}
+
+    store.rows.update(form_id, rows[2]["_id"], 1, {"buyer_name": "Robert", "buyer_email": "robert@example.com"})
+    assert search_ids(store, form_id, "bob") == set()
+    assert search_ids(store, form_id, "robert") == {rows[2]["_id"]}
+    # 只修改其他欄位時搜尋結果不變
+    store.rows.update(form_id, rows[2]["_id"], 2, {"remittance": True})
+    assert search_ids(store, form_id, "robert") == {rows[2]["_id"]}
+
+    store.rows.delete(form_id, rows[2]["_id"], 3)
+    assert search_ids(store, form_id, "robert") == set()
+
+
+@pytest.mark.parametrize("moment", ["before", "after"])
+def test_search_keys_survive_concurrent_update(store, form_id, moment):
+    """MongoDB：修改買家名稱的同時另一個請求修改了匯款狀態，搜尋鍵仍要對應最後的內容。"""
+    if not isinstance(store, MongoStorage):
+        pytest.skip("SQLite 的搜尋索引由觸發器在同一個交易內更新")
+    row = seed(store, form_id)[2]
+    collection = store.rows.order_rows
+    write = collection.find_one_and_update
+    calls = []
+
+    def interleaved(query, update, **kwargs):
+        if calls:
+            return write(query, update, **kwargs)
+        calls.append(query["_id"])
+        if moment == "before":
+            store.rows.update(form_id, row["_id"], None, {"remittance": True})
+        result = write(query, update, **kwargs)
+        if moment == "after":
+            store.rows.update(form_id, row["_id"], None, {"remittance": True})
+        return result
+
+    collection.find_one_and_update = interleaved
+    try:
+        assert store.rows.update(form_id, row["_id"], None, {"buyer_name": "Robert"}) is not None
+    finally:
+        del collection.find_one_and_update
+
+    stored = collection.find_one({"_id": row["_id"]})
+    assert stored["buyer_name"] == "Robert" and stored["remittance"] is True and stored["version"] == 3
+    assert stored["search_keys"] == row_search_keys(stored)
+    assert search_ids(store, form_id, "robert") == {row["_id"]}
+    assert_consistent(store, form_id)
+
+
+def test_search_keys_update_conflict_with_version(store, form_id):
+    """帶 version 修改搜尋欄位時，讀取之後被其他人修改就回傳衝突，不寫入。"""
+    if not isinstance(store, MongoStorage):
+        pytest.skip("SQLite 的更新在同一個交易內")
+    row = seed(store, form_id)[2]
+    collection = store.rows.order_rows
+    write = collection.find_one_and_update
+    calls = []
+
+    def interleaved(query, update, **kwargs):
+        if not calls:
+            calls.append(query["_id"])
+            store.rows.update(form_id, row["_id"], 1, {"remittance": True})
+        return write(query, update, **kwargs)
+
+    collection.find_one_and_update = interleaved
+    try:
+        assert store.rows.update(form_id, row["_id"], 1, {"buyer_name": "Robert"}) is None
+    finally:
+        del collection.find_one_and_update
+
+    assert store.rows.get(form_id, row["_id"])["buyer_name"] == "Bob"
+    assert search_ids(store, form_id, "bob") == {row["_id"]}
+    assert_consistent(store, form_id)
+
+
+def test_search_is_case_insensitive_substring(store, form_id):
+    rows = seed(store, form_id)
+    assert search_ids(store, form_id, "ALICE@EXAMPLE") == {rows[0]["_id"], rows[1]["_id"]}
+    assert search_ids(store, form_id, "香蕉") == {rows[1]["_id"]}
+
+
+# ---------------- 分頁 ----------------
+def test_find_page_cursor_walks_all_rows(store, form_id):
+    store.rows.insert_many(form_id, [make_row(item_name=f"item{i}") for i in range(7)])
+    seen, cursor = [], None
+    while True:
+        rows, cursor = store.rows.find_page(form_id, {}, "_id", ASCENDING, 3, cursor)
+        seen += [r["item_name"] for r in rows]
+        if cursor is None:
+            break
+    assert seen == [f"item{i}" for i in range(7)]
+
+
+def test_buyer_filter_hides_other_buyers(store, form_id):
+    seed(store, form_id)
+    rows, _ = store.rows.find_page(
+        form_id, {"buyer_email": "bob@example.com"}, "_id", ASCENDING, 10, include_social=False
+    )
+    assert [r["buyer_name"] for r in rows] == ["Bob"]
+    assert "buyer_social" not in rows[0]
+
+
+# ---------------- 封存 ----------------
+def test_archive_moves_completed_rows(store, form_id):
+    rows = [
+        make_row(buyer_email="alice@example.com", remittance=True, shipped="2024-01-02"),
+        make_row(buyer_email="alice@example.com", remittance=True, shipped=None),
+        make_row(buyer_email="bob@example.com", remittance=True, shipped="2024-01-03"),
+        make_row(buyer_email="bob@example.com", remittance=False, shipped="2024-01-03"),
+    ]
+    store.rows.insert_many(form_id, rows)
+    assert store.archive.archive(form_id, archive_cutoff_id(30), 100) == []
+
+    archived = store.archive.archive(form_id, archive_cutoff_id(-1), 100)
+
+    assert {r["_id"] for r in archived} == {rows[0]["_id"], rows[2]["_id"]}
+    assert {r["_id"] for r in all_rows(store, form_id)} == {rows[1]["_id"], rows[3]["_id"]}
+    assert store.archive.count(form_id) == 2
+    # 買家統計只計入目前的訂單，賣家報表仍計入封存的訂單
+    assert_consistent(store, form_id, archived=archived)
+    page, cursor = store.archive.find_page(form_id, {"buyer_email": "bob@example.com"}, 10, include_social=False)
+    assert [r["_id"] for r in page] == [rows[2]["_id"]] and cursor is None
+    assert "buyer_social" not in page[0]
+
+
+def test_archive_merges_runs_in_order(store, form_id, monkeypatch):
+    import storage.base
+    monkeypatch.setattr(storage.base, "ARCHIVE_CHUNK_ROWS", 2)
+    first = [make_row(item_name=f"a{i}", remittance=True, shipped="2024-01-01") for i in range(3)]
+    store.rows.insert_many(form_id, first)
+    store.archive.archive(form_id, archive_cutoff_id(-1), 100)
+    second = [make_row(item_name=f"b{i}", remittance=True, shipped="2024-01-01") for i in range(3)]
+    store.rows.insert_many(form_id, second)
+    store.archive.archive(form_id, archive_cutoff_id(-1), 100)
+
+    ids = [r["_id"] for r in store.archive.iter_rows(form_id, {})]
+    assert ids == sorted(r["_id"] for r in first + second)
+    page, cursor = store.archive.find_page(form_id, {}, 4)
+    rest, end = store.archive.find_page(form_id, {}, 4, cursor)
+    assert [r["_id"] for r in page + rest] == ids and end is None
+
+
+def test_clear_removes_rows_archive_and_rollups(store, form_id):
+    rows = seed(store, form_id)
+    store.rows.update(form_id, rows[0]["_id"], 1, {"shipped": "2024-01-01"})
+    store.archive.archive(form_id, archive_cutoff_id(-1), 100)
+    store.rows.clear(form_id)
+    assert all_rows(store, form_id) == []
+    assert store.archive.count(form_id) == 0
+    assert store.rows.summaries(form_id) == []
+    assert buyer_report(store) == {}
+
+
+def test_delete_form_removes_everything(store, form_id):
+    seed(store, form_id)
+    store.forms.delete(form_id)
+    assert store.forms.get(form_id) is None
+    assert all_rows(store, form_id) == []
+    assert store.rows.summaries(form_id) == []
+    assert buyer_report(store) == {}
+
+
+def test_rebuild_summaries_matches_incremental(store, form_id):
+    rows = seed(store, form_id)
+    store.rows.update(form_id, rows[0]["_id"], 1, {"buyer_email": "zed@example.com"})
+    store.rows.delete(form_id, rows[3]["_id"], 1)
+    before = actual_summaries(store, form_id)
+    store.rows.rebuild_summaries(form_id)
+    assert actual_summaries(store, form_id) == before == expected_summaries(all_rows(store, form_id))